@@ -5,15 +5,18 @@ import os
 from flask import Flask, render_template, request, session, jsonify, redirect, url_for
 from flask_socketio import SocketIO, emit, join_room, leave_room 
 from models.rag_system import OptimizedRAGSystem
-from models.face_auth import FaceAuthTransformer
+from models.face_auth import get_face_model_pool, save_face_embedding
+from models.auth_session import AuthSession
+from models.face_workers import FaceRecognitionExecutor, FaceWorkersBusy
+from models.frame_decode import decode_frame
+from models.face_tracking import FaceTracker
 from config import Config
 import os
 from dotenv import load_dotenv
 import sqlite3
 import base64
-import numpy as np
-import cv2
 import logging
+import queue
 from utils import get_purchase_history
 from models.extract_info import LLMExtract
 load_dotenv()
@@ -24,23 +27,24 @@ socketio = SocketIO(app, async_mode='eventlet', cors_allowed_origins="*")
 
 config = Config()
 rag_system = OptimizedRAGSystem(config)
-client_auth_transformers = {} 
+face_model_pool = get_face_model_pool(
+    config.face_pool_size,
+    adaptive_detection=config.face_det_adaptive,
+    coarse_size=config.face_det_coarse_size,
+    roi_size=config.face_det_roi_size,
+    roi_expand=config.face_det_roi_expand
+)
+face_executor = FaceRecognitionExecutor(
+    face_model_pool,
+    mode=config.face_worker_mode,
+    threads=config.face_pool_size,
+    max_pending=config.face_max_pending,
+    pool_timeout=config.face_pool_timeout
+)
+auth_sessions = {}
 
 logging.basicConfig(level=logging.DEBUG)
 
-def decode_image_from_base64(base64_string):
-    """Decodes a base64 image string (data URL) into an OpenCV image."""
-    try:
-        if ',' in base64_string:
-            base64_string = base64_string.split(',')[1]
-        img_data = base64.b64decode(base64_string)
-        np_arr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        return img
-    except Exception as e:
-        print(f"Error decoding base64 image: {e}")
-        return None
-
 # --- Routes ---
 @app.route('/')
 def index():
@@ -111,6 +115,15 @@ def chat():
             print(f"Failed to add error to chat history: {hist_e}")
         return jsonify({"error": "Failed to get response from assistant"}), 500
 
+@app.route('/metrics')
+def metrics():
+    """Exposes runtime counters (cache hit rates, etc.) as JSON."""
+    metrics = rag_system.get_metrics()
+    metrics['face_model_pool'] = face_model_pool.stats()
+    metrics['face_workers'] = face_executor.stats()
+    metrics['auth_sessions'] = [auth_session.to_dict() for auth_session in list(auth_sessions.values())]
+    return jsonify(metrics)
+
 @app.route('/logout')
 def logout():
     """Logs the user out by clearing relevant session keys."""
@@ -150,12 +163,30 @@ def start_anonymous_chat():
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
-    """Handles displaying and processing the registration form (simulation)."""
+    """Handles displaying and processing the registration form; a face photo enrolls the customer for login."""
     if request.method == 'POST':
         name = request.form.get('name')
         user_id = request.form.get('user_id')
-        print(f"Simulating registration for: Name={name}, ID={user_id}")
-        return redirect(url_for('index'))
+        photo = request.files.get('photo')
+        if not photo or not photo.filename:
+            print(f"Simulating registration for: Name={name}, ID={user_id}")
+            return redirect(url_for('index'))
+
+        frame, _ = decode_frame(photo.read())
+        if frame is None:
+            return render_template('register.html', error='Không đọc được ảnh.')
+        try:
+            result = face_executor.embed(frame)
+            if result.get('embedding') is None:
+                return render_template('register.html', error='Không tìm thấy khuôn mặt trong ảnh.')
+            save_face_embedding(int(user_id), result['embedding'], name=name)
+            print(f"Registered face for: Name={name}, ID={user_id}")
+        except (queue.Empty, FaceWorkersBusy):
+            return render_template('register.html', error='Máy chủ đang bận, vui lòng thử lại.')
+        except Exception as e:
+            print(f"Error registering face for ID {user_id}: {e}")
+            return render_template('register.html', error=f'Lỗi máy chủ: {e}')
+        return redirect(url_for('authenticate'))
 
     return render_template('register.html') 
 
@@ -166,9 +197,13 @@ def handle_connect():
     sid = request.sid
     print(f'Client connected for auth: {sid}')
 
-    client_auth_transformers[sid] = FaceAuthTransformer()
+    auth_sessions[sid] = AuthSession(sid, tracker=FaceTracker(
+        iou_threshold=config.face_track_iou,
+        quality_margin=config.face_track_quality_margin,
+        consensus_frames=config.face_consensus_frames
+    ))
     join_room(sid) 
-    print(f"Auth transformer created for SID: {sid}")
+    print(f"Auth session created for SID: {sid}")
 
 @socketio.on('disconnect')
 def handle_disconnect():
@@ -176,64 +211,95 @@ def handle_disconnect():
     sid = request.sid
     print(f'Client disconnected: {sid}')
 
-    if sid in client_auth_transformers:
-        del client_auth_transformers[sid]
-        print(f"Auth transformer removed for SID: {sid}")
+    if sid in auth_sessions:
+        del auth_sessions[sid]
+        print(f"Auth session removed for SID: {sid}")
     leave_room(sid)
 
 @socketio.on('video_frame')
 def handle_video_frame(data):
-    """Receives and processes video frames for face authentication."""
+    """Admits a video frame for face authentication; only the newest pending frame per client is kept."""
     sid = request.sid
 
-    if sid not in client_auth_transformers:
-        print(f"Error: No auth transformer found for SID {sid}. Client might need to reconnect.")
+    auth_session = auth_sessions.get(sid)
+    if auth_session is None:
+        print(f"Error: No auth session found for SID {sid}. Client might need to reconnect.")
         return
 
-    image_data_url = data.get('image')
-    if not image_data_url:
+    if auth_session.done:
+        # Already authenticated: stop spending CPU on this client
+        return
+
+    # 'image' is a binary JPEG attachment, or a base64 data URL from older clients
+    image = data.get('image')
+    if not image:
         print(f"Error: No image data received from {sid}")
         return
 
-    frame = decode_image_from_base64(image_data_url)
+    # Start a worker only if this session has none running; otherwise the frame just replaces the pending one
+    if auth_session.submit(image):
+        socketio.start_background_task(process_auth_frames, sid)
+
+def process_auth_frames(sid):
+    """Processes a session's newest pending frame until none is left, then tells the client to send the next one."""
+    auth_session = auth_sessions.get(sid)
+    while auth_session is not None:
+        image = auth_session.take()
+        if image is None:
+            break
+        if auth_session.done:
+            continue
+        socketio.emit('auth_result', process_auth_frame(sid, auth_session, image), room=sid)
+
+    if auth_session is not None and sid in auth_sessions:
+        socketio.emit('ready_for_frame', auth_session.counters(), room=sid)
+
+def process_auth_frame(sid, auth_session, image):
+    """Runs face recognition on one frame and returns the auth_result payload."""
+    frame, scale = decode_frame(image, config.face_decode_min_side)
     if frame is None:
         print(f"Error decoding image from {sid}")
-        return
-
-    transformer = client_auth_transformers[sid]
+        return {'success': False, 'message': 'Đang xử lý...', 'bbox': None, 'confidence': None}
 
     try:
-        result = transformer.recognize_face(frame) 
+        result = face_executor.recognize(frame, auth_session.tracker)
+        auth_session.frames_processed += 1
         match_outcome = result.get('match')
         bbox = result.get('bbox')
         confidence = result.get('confidence')
 
         if bbox:
-            bbox = [int(coord) for coord in bbox]
+            # Back to the coordinates of the frame the client sent (it may have been decoded at reduced scale)
+            bbox = [int(coord * scale) for coord in bbox]
 
         # Prepare the payload to send back
-        emit_data = {'success': False, 'message': None, 'user_info': None, 'bbox': bbox, 'confidence': confidence}
+        emit_data = {'success': False, 'message': None, 'user_info': None, 'bbox': bbox, 'confidence': confidence,
+                     'timings': {stage: round(ms, 1) for stage, ms in result.get('timings', {}).items()},
+                     'detect_mode': result.get('detect_mode')}
 
         if isinstance(match_outcome, dict) and 'id' in match_outcome: # Successful match
             print(f"Authentication successful for SID: {sid}. User: {match_outcome}")
             emit_data['success'] = True
             emit_data['user_info'] = match_outcome
-            emit('auth_result', emit_data, room=sid)
         elif match_outcome is False: 
             print(f"Authentication explicitly failed for SID: {sid}")
             emit_data['success'] = False
             emit_data['message'] = 'Không nhận dạng được khuôn mặt.'
-            emit('auth_result', emit_data, room=sid)
+        elif result.get('votes'): # Matched, waiting for consensus over more frames
+            emit_data['success'] = False
+            emit_data['message'] = 'Đang xác nhận khuôn mặt...'
         else: # No face detected or processing issue
             emit_data['success'] = False
             emit_data['message'] = 'Đang xử lý...'
+        return emit_data
 
-            emit('auth_result', emit_data, room=sid)
-
+    except (queue.Empty, FaceWorkersBusy):
+        print(f"Face workers busy, frame from SID {sid} not processed")
+        return {'success': False, 'message': 'Máy chủ đang bận, vui lòng chờ...', 'bbox': None, 'confidence': None}
     except Exception as e:
         print(f"Error during face recognition processing for SID {sid}: {e}")
         # Notify client of the server error
-        emit('auth_result', {'success': False, 'message': f'Lỗi máy chủ: {e}', 'bbox': None, 'confidence': None}, room=sid)
+        return {'success': False, 'message': f'Lỗi máy chủ: {e}', 'bbox': None, 'confidence': None}
 
 @app.route('/confirm_auth', methods=['POST'])
 def confirm_auth():
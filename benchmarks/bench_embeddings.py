@@ -0,0 +1,62 @@
+"""Compare per-text and batched PhoBERT embedding of the vector store corpus.
+
+Run from the project root:
+    python -m benchmarks.bench_embeddings --limit 500 --batch-size 32
+"""
+import argparse
+import time
+
+import numpy as np
+
+from config import Config
+from utils import load_table_data
+from models.rag_system import PhoBERTEmbeddings
+
+
+def _timed_embed(embeddings: PhoBERTEmbeddings, texts, batch_size: int):
+    embeddings.batch_size = batch_size
+    start = time.perf_counter()
+    vectors = embeddings.embed_documents(texts)
+    elapsed = time.perf_counter() - start
+    return np.asarray(vectors, dtype=np.float32), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limit", type=int, default=0, help="Only embed the first N documents (0 = all)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-batch-tokens", type=int, default=8192)
+    args = parser.parse_args()
+
+    config = Config()
+    documents = load_table_data(config.db_path)
+    texts = [doc["content"] for doc in documents]
+    if args.limit:
+        texts = texts[:args.limit]
+    if not texts:
+        print("No documents to embed")
+        return
+
+    embeddings = PhoBERTEmbeddings(config.embedding_model, max_batch_tokens=args.max_batch_tokens)
+    # Warm up so neither path pays for lazy initialisation
+    embeddings.embed_documents(texts[:2])
+
+    sequential, sequential_time = _timed_embed(embeddings, texts, batch_size=1)
+    batched, batched_time = _timed_embed(embeddings, texts, batch_size=args.batch_size)
+
+    max_abs_diff = float(np.abs(sequential - batched).max())
+    cosine = np.sum(sequential * batched, axis=1) / (
+        np.linalg.norm(sequential, axis=1) * np.linalg.norm(batched, axis=1)
+    )
+
+    print(f"Documents:        {len(texts)}")
+    print(f"Per-text path:    {len(texts) / sequential_time:8.1f} docs/sec ({sequential_time:.2f}s)")
+    print(f"Batched path:     {len(texts) / batched_time:8.1f} docs/sec ({batched_time:.2f}s, "
+          f"batch_size={args.batch_size}, max_batch_tokens={args.max_batch_tokens})")
+    print(f"Speedup:          {sequential_time / batched_time:8.2f}x")
+    print(f"Max |difference|: {max_abs_diff:.2e}")
+    print(f"Min cosine:       {float(cosine.min()):.8f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Recall@k and search latency of the FAISS index types against exact (flat) search.
+
+By default the vectors saved in vector_store/ (all partitions together) are used: --queries of them are held out as queries
+and the rest are indexed. --synthetic N generates N clustered vectors instead, chunk by chunk
+from a seed, so a 1M x 768 corpus only needs memory for the index being measured; the exact
+neighbours are found with a chunked brute-force pass.
+
+Every index type is built with the same parameters the app uses (models/faiss_index.py), then
+searched with each nprobe / efSearch in the sweep. Latency is per single-query search.
+
+Run from the project root:
+    python -m benchmarks.bench_faiss --k 5
+    python -m benchmarks.bench_faiss --synthetic 1000000 --types flat hnsw ivf_pq
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from config import Config
+from models.faiss_index import INDEX_KINDS, IndexSpec, index_kind, new_index
+from models.vector_store import saved_store_paths
+
+
+class Corpus:
+    """Vectors to index, produced in chunks so large synthetic corpora never sit in memory at once"""
+
+    def __init__(self, vectors=None, size=0, dim=768, clusters=1000, chunk_size=100_000, seed=0):
+        self.vectors = vectors
+        self.size = len(vectors) if vectors is not None else size
+        self.dim = vectors.shape[1] if vectors is not None else dim
+        self.chunk_size = chunk_size
+        self.seed = seed
+        if vectors is None:
+            self.centers = np.random.default_rng(seed).normal(size=(clusters, dim)).astype(np.float32)
+
+    def _synthetic(self, rng, n):
+        labels = rng.integers(0, len(self.centers), n)
+        return self.centers[labels] + 0.35 * rng.normal(size=(n, self.dim)).astype(np.float32)
+
+    def chunks(self):
+        for number, start in enumerate(range(0, self.size, self.chunk_size)):
+            n = min(self.chunk_size, self.size - start)
+            if self.vectors is not None:
+                yield start, self.vectors[start:start + n]
+            else:
+                yield start, self._synthetic(np.random.default_rng((self.seed, number)), n)
+
+    def sample(self, n):
+        """Training sample: the first n vectors"""
+        parts, have = [], 0
+        for _, chunk in self.chunks():
+            parts.append(chunk[:n - have])
+            have += len(parts[-1])
+            if have >= n:
+                break
+        return np.concatenate(parts)
+
+    def queries(self, n):
+        return self._synthetic(np.random.default_rng((self.seed, 1 << 30)), n)
+
+
+def _saved_vectors(path, queries, seed=0):
+    parts = []
+    for store_path in saved_store_paths(path):
+        index = faiss.read_index(os.path.join(store_path, "index.faiss"))
+        if index_kind(index) != "flat":
+            raise SystemExit(f"{store_path} holds a {index_kind(index)} index; the benchmark needs the exact vectors of a flat store")
+        parts.append(index.reconstruct_n(0, index.ntotal))
+    if not parts:
+        raise SystemExit(f"No saved vectors under {path}")
+    vectors = np.concatenate(parts)
+    order = np.random.default_rng(seed).permutation(len(vectors))
+    return vectors[order[queries:]], vectors[order[:queries]]
+
+
+def exact_neighbours(corpus, xq, k):
+    """Brute-force k nearest neighbours, merged chunk by chunk"""
+    best_d = np.full((len(xq), k), np.inf, dtype=np.float32)
+    best_i = np.full((len(xq), k), -1, dtype=np.int64)
+    for start, chunk in corpus.chunks():
+        d, i = faiss.knn(xq, np.ascontiguousarray(chunk), min(k, len(chunk)))
+        d = np.concatenate([best_d, d], axis=1)
+        i = np.concatenate([best_i, i + start], axis=1)
+        top = np.argsort(d, axis=1)[:, :k]
+        best_d, best_i = np.take_along_axis(d, top, 1), np.take_along_axis(i, top, 1)
+    return best_i
+
+
+def build(corpus, spec):
+    start = time.perf_counter()
+    train = None
+    if spec.kind in ("ivf_flat", "ivf_pq"):
+        nlist = spec.nlist or int(4 * np.sqrt(corpus.size))
+        train = corpus.sample(min(corpus.size, max(256 * nlist, 64 * 2 ** spec.pq_bits)))
+        # nlist follows the full corpus size, not the size of the training sample
+        spec = IndexSpec(**{**spec.__dict__, "nlist": min(nlist, len(train) // 39)})
+    index = new_index(spec, corpus.dim, train)
+    for _, chunk in corpus.chunks():
+        index.add(np.ascontiguousarray(chunk, dtype=np.float32))
+    elapsed = time.perf_counter() - start
+    with tempfile.NamedTemporaryFile(suffix=".faiss") as f:
+        faiss.write_index(index, f.name)
+        size = os.path.getsize(f.name)
+    return index, elapsed, size
+
+
+def measure(index, xq, truth, k):
+    _, found = index.search(xq, k)
+    recall = np.mean([len(set(f[f >= 0]) & set(t)) / k for f, t in zip(found, truth)])
+    timings = []
+    for q in xq:
+        start = time.perf_counter()
+        index.search(q[None, :], k)
+        timings.append((time.perf_counter() - start) * 1000)
+    return recall, np.percentile(timings, 50), np.percentile(timings, 99)
+
+
+def main():
+    config = Config()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store", default=config.vector_store_path, help="Flat store whose vectors are benchmarked")
+    parser.add_argument("--synthetic", type=int, default=0, help="Use N synthetic vectors instead of the store")
+    parser.add_argument("--dim", type=int, default=768, help="Dimension of synthetic vectors")
+    parser.add_argument("--types", nargs="+", choices=INDEX_KINDS, default=list(INDEX_KINDS))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=config.top_k_results)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    parser.add_argument("--threads", type=int, default=1, help="FAISS threads while searching (1 = one request)")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        corpus = Corpus(size=args.synthetic, dim=args.dim)
+        xq = corpus.queries(args.queries)
+        source = f"{args.synthetic} synthetic {args.dim}-dim vectors"
+    else:
+        vectors, xq = _saved_vectors(args.store, args.queries)
+        corpus = Corpus(vectors)
+        source = f"{corpus.size} vectors from {args.store}"
+    print(f"{source}, {len(xq)} queries, recall@{args.k}")
+
+    start = time.perf_counter()
+    truth = exact_neighbours(corpus, xq, args.k)
+    print(f"Exact neighbours in {time.perf_counter() - start:.1f}s")
+
+    base = IndexSpec.from_config(config)
+    rows = []
+    for kind in args.types:
+        spec = IndexSpec(**{**base.__dict__, "kind": kind})
+        index, build_s, size = build(corpus, spec)
+        built = index_kind(index)
+        if built != kind:
+            print(f"{kind} fell back to {built}; skipped")
+            continue
+        sweep = ([("nprobe", n) for n in args.nprobe] if kind.startswith("ivf")
+                 else [("efSearch", ef) for ef in args.ef_search] if kind == "hnsw" else [("", None)])
+        faiss.omp_set_num_threads(args.threads)
+        for name, value in sweep:
+            if name == "nprobe":
+                faiss.extract_index_ivf(index).nprobe = value
+            elif name == "efSearch":
+                index.hnsw.efSearch = value
+            recall, p50, p99 = measure(index, xq, truth, args.k)
+            rows.append((kind, f"{name}={value}" if name else "exact", recall, p50, p99, build_s, size))
+        faiss.omp_set_num_threads(os.cpu_count() or 1)
+        del index
+
+    print(f"\n{'index':<10}{'search':<14}{'recall@' + str(args.k):>10}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'build s':>10}{'size MiB':>10}")
+    for kind, params, recall, p50, p99, build_s, size in rows:
+        print(f"{kind:<10}{params:<14}{recall:>10.3f}{p50:>10.3f}{p99:>10.3f}{build_s:>10.1f}{size / 2**20:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
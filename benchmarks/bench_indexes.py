@@ -0,0 +1,131 @@
+"""Before/after latency of the hot joins on a synthetic copy of Database.db.
+
+Builds a database with the real schema and catalogue (Categories, Product, Variant, Store) and
+synthetic customers, orders and order lines, asks the index advisor what it would add for the
+workload, then times the workload before and after applying migrations/.
+
+Run from the project root:
+    python -m benchmarks.bench_indexes --order-lines 2000000 --out /tmp/bench_indexes.db
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from db import MIGRATIONS_DIR, apply_migrations, default_db_path, get_db
+from models.index_advisor import IndexAdvisor
+
+CATALOGUE_TABLES = ["Categories", "Product", "Variant", "Store"]
+
+# (label, SQL with one "?" for a random customer / product id, parameter kind)
+WORKLOAD = [
+    ("purchase history", """
+        SELECT o.Order_date, p.Name_Product, od.Quantity, (v.Price * od.Quantity) AS Price
+        FROM Orders o
+        JOIN Order_detail od ON o.Id = od.Order_id
+        JOIN Variant v ON od.Variant_id = v.Id
+        JOIN Product p ON v.Product_id = p.Id
+        WHERE o.Customer_id = ?
+        ORDER BY o.Order_date DESC
+        LIMIT 5""", "customer"),
+    ("orders of customer", "SELECT COUNT(*) FROM Orders WHERE Customer_id = ?", "customer"),
+    ("customer spend", """
+        SELECT SUM(v.Price * od.Quantity) FROM Orders o
+        JOIN Order_detail od ON od.Order_id = o.Id
+        JOIN Variant v ON v.Id = od.Variant_id
+        WHERE o.Customer_id = ?""", "customer"),
+    ("units sold of product", """
+        SELECT SUM(od.Quantity) FROM Order_detail od
+        JOIN Variant v ON od.Variant_id = v.Id
+        WHERE v.Product_id = ?""", "product"),
+]
+
+
+def build(source_db, out, customers, orders, order_lines, seed=0):
+    if os.path.exists(out):
+        os.remove(out)
+    rng = random.Random(seed)
+    src = sqlite3.connect(source_db)
+    dst = sqlite3.connect(out)
+    dst.execute("PRAGMA journal_mode = OFF")
+    dst.execute("PRAGMA synchronous = OFF")
+    for (sql,) in src.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' "
+                              "AND name != 'schema_migrations'"):
+        dst.execute(sql)
+    for table in CATALOGUE_TABLES:
+        rows = src.execute(f"SELECT * FROM {table}").fetchall()
+        if rows:
+            dst.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+    variant_ids = [row[0] for row in src.execute("SELECT Id FROM Variant")]
+    store_ids = [row[0] for row in src.execute("SELECT Id FROM Store")]
+    src.close()
+
+    start = time.perf_counter()
+    dst.executemany(
+        "INSERT INTO customers (id, name, sex, age, location) VALUES (?, ?, ?, ?, ?)",
+        ((i, f"Khách {i}", rng.choice(["Nam", "Nữ"]), rng.randint(16, 70), "TP.HCM") for i in range(1, customers + 1))
+    )
+    dst.executemany(
+        "INSERT INTO Orders (Id, Customer_id, Store_id, Order_date) VALUES (?, ?, ?, ?)",
+        ((i, rng.randint(1, customers), rng.choice(store_ids),
+          f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}") for i in range(1, orders + 1))
+    )
+    dst.executemany(
+        "INSERT INTO Order_detail (Id, Order_id, Variant_id, Quantity) VALUES (?, ?, ?, ?)",
+        ((i, rng.randint(1, orders), rng.choice(variant_ids), rng.randint(1, 4)) for i in range(1, order_lines + 1))
+    )
+    dst.commit()
+    dst.close()
+    print(f"Built {out}: {customers} customers, {orders} orders, {order_lines} order lines "
+          f"in {time.perf_counter() - start:.1f}s ({os.path.getsize(out) / 2**20:.0f} MiB)")
+
+
+def time_workload(db_path, customers, products, repeats, seed=1):
+    rng = random.Random(seed)
+    results = {}
+    with get_db(db_path).connection(read_only=True) as conn:
+        for label, sql, kind in WORKLOAD:
+            timings = []
+            for _ in range(repeats):
+                param = rng.randint(1, customers) if kind == "customer" else rng.choice(products)
+                start = time.perf_counter()
+                conn.execute(sql, (param,)).fetchall()
+                timings.append((time.perf_counter() - start) * 1000)
+            results[label] = (statistics.median(timings), max(timings))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=default_db_path(), help="Database to copy the schema and catalogue from")
+    parser.add_argument("--out", default=os.path.join(tempfile.gettempdir(), "bench_indexes.db"))
+    parser.add_argument("--order-lines", type=int, default=2_000_000)
+    parser.add_argument("--customers", type=int, default=50_000)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    orders = max(1, args.order_lines // 4)
+    build(args.source, args.out, args.customers, orders, args.order_lines)
+    with get_db(args.out).connection(read_only=True) as conn:
+        products = [row[0] for row in conn.execute("SELECT Id FROM Product")]
+
+    _, proposals = IndexAdvisor(args.out, min_rows=10000).advise(sql for _, sql, _ in WORKLOAD)
+    print("\nAdvisor proposals for the workload:")
+    for proposal in proposals:
+        print(f"  {proposal.create_statement()}")
+
+    before = time_workload(args.out, args.customers, products, args.repeats)
+    apply_migrations(args.out, MIGRATIONS_DIR)
+    after = time_workload(args.out, args.customers, products, args.repeats)
+
+    print(f"\n{'query':<24}{'before p50 ms':>15}{'after p50 ms':>15}{'speedup':>10}")
+    for label, _, _ in WORKLOAD:
+        b, a = before[label][0], after[label][0]
+        print(f"{label:<24}{b:>15.2f}{a:>15.3f}{b / max(a, 1e-6):>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Check that the ONNX Runtime embedder agrees with the PyTorch one on the vector store corpus.
+
+Embeds every document stored in vector_store/ (every partition) with both backends and reports the
+cosine similarity between the two vectors of each document, plus throughput.
+Exits with status 1 if any document falls below --min-cosine.
+
+Run from the project root:
+    python -m benchmarks.check_onnx_parity [--no-quantize] [--min-cosine 0.99]
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+from config import Config
+from models.rag_system import PhoBERTEmbeddings, PhoBERTOnnxEmbeddings
+from models.vector_store import saved_store_paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--no-quantize", action="store_true", help="Compare against the fp32 ONNX model")
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    parser.add_argument("--limit", type=int, default=0, help="Only check the first N documents (0 = all)")
+    args = parser.parse_args()
+
+    config = Config()
+    torch_embeddings = PhoBERTEmbeddings(
+        config.embedding_model,
+        batch_size=config.embedding_batch_size,
+        max_batch_tokens=config.embedding_max_batch_tokens
+    )
+    onnx_embeddings = PhoBERTOnnxEmbeddings(
+        config.embedding_model,
+        model_dir=config.onnx_model_dir,
+        quantize=not args.no_quantize,
+        intra_op_threads=config.onnx_intra_op_threads,
+        batch_size=config.embedding_batch_size,
+        max_batch_tokens=config.embedding_max_batch_tokens
+    )
+
+    texts = []
+    for store_path in saved_store_paths(config.vector_store_path):
+        store = FAISS.load_local(store_path, torch_embeddings, allow_dangerous_deserialization=True)
+        texts.extend(store.docstore.search(doc_id).page_content for doc_id in store.index_to_docstore_id.values())
+    if args.limit:
+        texts = texts[:args.limit]
+    if not texts:
+        print("Vector store is empty")
+        return
+
+    results = {}
+    for name, embedder in (("torch", torch_embeddings), ("onnx", onnx_embeddings)):
+        start = time.perf_counter()
+        vectors = np.asarray(embedder.embed_documents(texts), dtype=np.float32)
+        results[name] = (vectors, time.perf_counter() - start)
+
+    reference, torch_time = results["torch"]
+    candidate, onnx_time = results["onnx"]
+    cosine = np.sum(reference * candidate, axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    )
+
+    print(f"Documents:   {len(texts)}")
+    print(f"Torch:       {len(texts) / torch_time:8.1f} docs/sec")
+    print(f"ONNX{'' if args.no_quantize else ' int8'}:   {len(texts) / onnx_time:8.1f} docs/sec")
+    print(f"Cosine:      min {cosine.min():.6f}  p1 {np.percentile(cosine, 1):.6f}  mean {cosine.mean():.6f}")
+
+    failing = int(np.sum(cosine < args.min_cosine))
+    if failing:
+        print(f"FAIL: {failing} documents below cosine {args.min_cosine}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
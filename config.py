@@ -16,19 +16,105 @@ class Config:
     # Database configuration
     db_path: str = os.getenv("DB_PATH", "Database.db")
     db_timeout: int = int(os.getenv("DB_TIMEOUT", 30))
+    # Connection pool (db.py): idle connections kept per mode, optional WAL journal and per-connection page cache / mmap
+    db_pool_size: int = int(os.getenv("DB_POOL_SIZE", 8))
+    db_wal: bool = os.getenv("DB_WAL", "false").lower() == "true"  # switches the database file itself to WAL
+    db_mmap_size: int = int(os.getenv("DB_MMAP_SIZE", 256 * 1024 * 1024))  # bytes, 0 = off
+    db_cache_size_kib: int = int(os.getenv("DB_CACHE_SIZE_KIB", 16 * 1024))
+    # Limits for LLM-generated SQL: rows and value bytes passed to the answer prompt, and execution time
+    sql_max_rows: int = int(os.getenv("SQL_MAX_ROWS", 200))
+    sql_max_bytes: int = int(os.getenv("SQL_MAX_BYTES", 32 * 1024))
+    sql_time_budget_ms: int = int(os.getenv("SQL_TIME_BUDGET_MS", 2000))  # 0 = no limit
+    # Cost gate: reject full scans above sql_max_scan_rows (or nested scans multiplying past it); queries that
+    # scan a table of sql_large_table_rows+ rows without a LIMIT are capped at 10 * sql_max_rows rows
+    sql_large_table_rows: int = int(os.getenv("SQL_LARGE_TABLE_ROWS", 10000))
+    sql_max_scan_rows: int = int(os.getenv("SQL_MAX_SCAN_ROWS", 1000000))
+    # JSONL log of executed generated SQL, read by scripts/index_advisor.py (empty disables)
+    sql_log_path: str = os.getenv("SQL_LOG_PATH", "logs/generated_sql.jsonl")
+    # Send only the tables relevant to the question (plus joining tables) in the SQL generation prompt
+    sql_compact_schema: bool = os.getenv("SQL_COMPACT_SCHEMA", "false").lower() == "true"
     
     # Vector store configuration
     vector_store_path: str = os.getenv("VECTOR_STORE_PATH", "vector_store")
     top_k_results: int = int(os.getenv("TOP_K_RESULTS", 5))
     
+    # "startup": diff both stores against the database on start and embed only new/changed rows; "off": load as saved
+    vector_store_sync: str = os.getenv("VECTOR_STORE_SYNC", "startup")
+    # false: a missing store is not embedded at start (the app runs without it); build it with scripts/build_index.py
+    vector_store_build_on_start: bool = os.getenv("VECTOR_STORE_BUILD_ON_START", "true").lower() == "true"
+    # What the row store indexes: "products" (Product + Variant + Categories, one document per product),
+    # "stores" (one per store), and/or table names indexed row by row ("tables" = every table)
+    vector_document_sources: str = os.getenv("VECTOR_DOCUMENT_SOURCES", "products,stores,Categories")
+    # One index per source in vector_store/<source>/; a question searches the tables its keywords name, topped up
+    # to vector_partitions_max with the partitions whose centroid is closest to it
+    vector_store_partitioned: bool = os.getenv("VECTOR_STORE_PARTITIONED", "true").lower() == "true"
+    vector_partitions_max: int = int(os.getenv("VECTOR_PARTITIONS_MAX", 2))
+    # Fuse row store FAISS results with a BM25 index (vector_store/**/lexical.json) by reciprocal rank;
+    # hybrid_candidates results are taken from each side before fusing
+    hybrid_search: bool = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+    hybrid_rrf_k: int = int(os.getenv("HYBRID_RRF_K", 60))
+    hybrid_candidates: int = int(os.getenv("HYBRID_CANDIDATES", 20))
+    # FAISS index for both stores: "flat" (exact), "hnsw", "ivf_flat" or "ivf_pq" (models/faiss_index.py).
+    # nprobe / efSearch apply at load; the other parameters take effect when the index is rebuilt or converted
+    vector_index_type: str = os.getenv("VECTOR_INDEX_TYPE", "flat")
+    vector_index_nlist: int = int(os.getenv("VECTOR_INDEX_NLIST", 0))  # 0 = about 4 * sqrt(vectors)
+    vector_index_nprobe: int = int(os.getenv("VECTOR_INDEX_NPROBE", 16))
+    vector_index_hnsw_m: int = int(os.getenv("VECTOR_INDEX_HNSW_M", 32))
+    vector_index_ef_construction: int = int(os.getenv("VECTOR_INDEX_EF_CONSTRUCTION", 200))
+    vector_index_ef_search: int = int(os.getenv("VECTOR_INDEX_EF_SEARCH", 64))
+    vector_index_pq_m: int = int(os.getenv("VECTOR_INDEX_PQ_M", 64))  # must divide the embedding size (768)
+    vector_index_pq_bits: int = int(os.getenv("VECTOR_INDEX_PQ_BITS", 8))
+
     # Description vector store configuration
     description_vector_store_path: str = os.getenv("DESCRIPTION_VECTOR_STORE_PATH", "description_vector_store")
     
     # Model configuration
     embedding_model: str = os.getenv("EMBEDDING_MODEL", "vinai/phobert-base")
+    embedding_batch_size: int = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))  # 1 = one forward pass per text
+    embedding_max_batch_tokens: int = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", 8192))
+    # Embedding backend: "torch" (eager PyTorch) or "onnx" (ONNX Runtime, exported on first use)
+    embedding_backend: str = os.getenv("EMBEDDING_BACKEND", "torch")
+    onnx_model_dir: str = os.getenv("ONNX_MODEL_DIR", "onnx_models")
+    onnx_quantize: bool = os.getenv("ONNX_QUANTIZE", "true").lower() == "true"  # dynamic int8 weights
+    onnx_intra_op_threads: int = int(os.getenv("ONNX_INTRA_OP_THREADS", 0))  # 0 = all cores
+
+    # Query embedding cache (in-process LRU + optional on-disk store, empty dir disables disk)
+    query_cache_size: int = int(os.getenv("QUERY_CACHE_SIZE", 1024))
+    query_cache_dir: str = os.getenv("QUERY_CACHE_DIR", "query_cache")
+    query_cache_disk_size: int = int(os.getenv("QUERY_CACHE_DISK_SIZE", 20000))
+    query_cache_ttl: int = int(os.getenv("QUERY_CACHE_TTL", 7 * 24 * 3600))  # seconds, 0 = never expire
+
+    # Local query router (SQL vs vector); the LLM is asked only when the classifier margin is below router_min_margin
+    router_enabled: bool = os.getenv("ROUTER_ENABLED", "true").lower() == "true"
+    router_min_margin: float = float(os.getenv("ROUTER_MIN_MARGIN", 0.05))
+    router_cache_path: str = os.getenv("ROUTER_CACHE_PATH", "router_centroids.npz")
+
+    # Generated SQL cache (exact or near-duplicate questions, cleared when the schema changes; empty dir disables)
+    sql_cache_dir: str = os.getenv("SQL_CACHE_DIR", "sql_cache")
+    sql_cache_size: int = int(os.getenv("SQL_CACHE_SIZE", 500))
+    sql_cache_ttl: int = int(os.getenv("SQL_CACHE_TTL", 30 * 24 * 3600))  # seconds, 0 = never expire
+    # Reuse SQL for near-duplicate questions (same numbers, centered embedding cosine above a threshold fitted on
+    # labelled question pairs); off by default, exact normalized-question hits only
+    sql_cache_semantic: bool = os.getenv("SQL_CACHE_SEMANTIC", "false").lower() == "true"
+    sql_cache_similarity: float = float(os.getenv("SQL_CACHE_SIMILARITY", 0))  # 0 = fitted threshold
+
     llm_model: str = os.getenv("LLM_MODEL", "gemini-1.5-flash-latest")
     llm_temperature: float = float(os.getenv("LLM_TEMPERATURE", 0.8))
     
+    # Face authentication: shared pool of detection/recognition models
+    face_pool_size: int = int(os.getenv("FACE_POOL_SIZE", 2))
+    face_pool_timeout: float = float(os.getenv("FACE_POOL_TIMEOUT", 5))  # seconds to wait for a free model
+    face_worker_mode: str = os.getenv("FACE_WORKER_MODE", "tpool")  # "tpool" (native threads) or "inline"
+    face_det_adaptive: bool = os.getenv("FACE_DET_ADAPTIVE", "true").lower() == "true"  # coarse search + face ROI instead of 640x640
+    face_det_coarse_size: int = int(os.getenv("FACE_DET_COARSE_SIZE", 320))  # multiple of 32
+    face_det_roi_size: int = int(os.getenv("FACE_DET_ROI_SIZE", 224))  # multiple of 32
+    face_det_roi_expand: float = float(os.getenv("FACE_DET_ROI_EXPAND", 2.0))  # ROI side / face side
+    face_decode_min_side: int = int(os.getenv("FACE_DECODE_MIN_SIDE", 640))  # full-size detector input; larger JPEGs decode at 1/2, 1/4 or 1/8 scale (0 = off)
+    face_max_pending: int = int(os.getenv("FACE_MAX_PENDING", 8))  # frames queued or running across all sessions
+    face_consensus_frames: int = int(os.getenv("FACE_CONSENSUS_FRAMES", 3))  # frames agreeing on a match before login
+    face_track_iou: float = float(os.getenv("FACE_TRACK_IOU", 0.5))  # box overlap that continues a face track
+    face_track_quality_margin: float = float(os.getenv("FACE_TRACK_QUALITY_MARGIN", 0.05))  # re-embed only if quality improves by this
+
     # API Keys - Read directly from environment variables (loaded from .env)
     google_api_key: str = os.getenv("GOOGLE_API_KEY")
     huggingface_hub_token: str = os.getenv("HUGGINGFACE_HUB_TOKEN")
@@ -45,6 +131,21 @@ class Config:
         os.makedirs(description_vector_store_full_path, exist_ok=True)
         self.description_vector_store_path = description_vector_store_full_path # Update path to be absolute
 
+        self.onnx_model_dir = os.path.join(self.base_dir, self.onnx_model_dir)
+
+        # Keep the on-disk query cache next to the vector stores
+        if self.query_cache_dir:
+            self.query_cache_dir = os.path.join(self.base_dir, self.query_cache_dir)
+
+        if self.sql_cache_dir:
+            self.sql_cache_dir = os.path.join(self.base_dir, self.sql_cache_dir)
+
+        if self.sql_log_path:
+            self.sql_log_path = os.path.join(self.base_dir, self.sql_log_path)
+
+        if self.router_cache_path:
+            self.router_cache_path = os.path.join(self.base_dir, self.router_cache_path)
+
         # Ensure db path is absolute
         db_full_path = os.path.join(self.base_dir, self.db_path)
         if not os.path.exists(db_full_path):
@@ -0,0 +1,202 @@
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from config import Config
+
+
+MIGRATIONS_DIR = os.path.join(Config.base_dir, "migrations")
+
+
+def default_db_path() -> str:
+    """Database path resolved the same way as Config.db_path (DB_PATH relative to the project root)"""
+    return os.path.join(Config.base_dir, Config.db_path)
+
+
+class ConnectionManager:
+    """Pool of tuned SQLite connections for one database file.
+
+    Each greenlet or thread checks out its own connection with connection() and returns it when the
+    block ends, so requests stop paying connect/teardown cost and keep the statements already prepared
+    in each connection's statement cache. read_only=True gives a connection opened with mode=ro and
+    query_only, for SQL written by the LLM.
+    """
+
+    def __init__(self, db_path: str, timeout: float = 30, pool_size: int = 8, wal: bool = False,
+                 mmap_size: int = 256 * 1024 * 1024, cache_size_kib: int = 16 * 1024,
+                 cached_statements: int = 256):
+        self.db_path = os.path.abspath(db_path)
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.wal = wal
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        self.cached_statements = cached_statements
+        self._idle: Dict[bool, List[sqlite3.Connection]] = {False: [], True: []}
+        self._lock = threading.Lock()
+        self._wal_checked = False
+        self.opened = 0
+        self.reused = 0
+
+    def open(self, read_only: bool = False) -> sqlite3.Connection:
+        """New tuned connection outside the pool (for long-lived users such as the face gallery)"""
+        if read_only:
+            conn = sqlite3.connect(f"file:{quote(self.db_path)}?mode=ro", uri=True, timeout=self.timeout,
+                                   check_same_thread=False, cached_statements=self.cached_statements)
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False,
+                                   cached_statements=self.cached_statements)
+            if self.wal:
+                if not self._wal_checked:
+                    # journal_mode is stored in the database file (this rewrites its header), so it is opt-in
+                    # and only has to succeed once
+                    self._wal_checked = True
+                    mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+                    if mode.lower() != "wal":
+                        print(f"Could not enable WAL on {self.db_path} (journal_mode={mode})")
+                conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kib)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        self.opened += 1
+        return conn
+
+    @contextmanager
+    def connection(self, read_only: bool = False):
+        """Check out a pooled connection; any open transaction is rolled back when it is returned"""
+        if read_only and self.wal and not self._wal_checked:
+            # Switch to WAL before the first read-only connection so readers never block the writer
+            self.open().close()
+        with self._lock:
+            idle = self._idle[read_only]
+            conn = idle.pop() if idle else None
+        if conn is None:
+            conn = self.open(read_only)
+        else:
+            self.reused += 1
+
+        healthy = True
+        try:
+            yield conn
+        finally:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                healthy = False
+            with self._lock:
+                idle = self._idle[read_only]
+                if healthy and len(idle) < self.pool_size:
+                    idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+                idle.clear()
+
+    def stats(self) -> dict:
+        return {
+            "opened": self.opened,
+            "reused": self.reused,
+            "idle": len(self._idle[False]),
+            "idle_read_only": len(self._idle[True])
+        }
+
+
+_managers: Dict[str, ConnectionManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_db(db_path: Optional[str] = None) -> ConnectionManager:
+    """Shared ConnectionManager for a database file (the configured database by default)"""
+    path = os.path.abspath(db_path or default_db_path())
+    with _managers_lock:
+        manager = _managers.get(path)
+        if manager is None:
+            manager = ConnectionManager(
+                path,
+                timeout=Config.db_timeout,
+                pool_size=Config.db_pool_size,
+                wal=Config.db_wal,
+                mmap_size=Config.db_mmap_size,
+                cache_size_kib=Config.db_cache_size_kib
+            )
+            _managers[path] = manager
+    return manager
+
+
+def list_migrations(directory: str = MIGRATIONS_DIR) -> List[Tuple[int, str, str]]:
+    """(version, name, path) for every NNNN_name.sql file, in version order"""
+    migrations = []
+    if os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            match = re.match(r"^(\d+)_(\w+)\.sql$", filename)
+            if match:
+                migrations.append((int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    return sorted(migrations)
+
+
+def applied_migrations(conn: sqlite3.Connection, create: bool = True) -> Dict[int, str]:
+    """version -> name of the migrations recorded in schema_migrations"""
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='schema_migrations'").fetchone()
+    if not exists and not create:
+        return {}
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations "
+        "(version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    )
+    conn.commit()
+    return dict(conn.execute("SELECT version, name FROM schema_migrations").fetchall())
+
+
+def _statements(script: str) -> List[str]:
+    statements, current = [], ""
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            if current.strip():
+                statements.append(current.strip())
+            current = ""
+    if current.strip() and not current.strip().startswith("--"):
+        statements.append(current.strip())
+    return statements
+
+
+def apply_migrations(db_path: Optional[str] = None, directory: str = MIGRATIONS_DIR,
+                     dry_run: bool = False) -> List[Tuple[int, str]]:
+    """Apply pending migrations in order, each in its own transaction; returns what was (or would be) applied"""
+    manager = get_db(db_path)
+    done = []
+    with manager.connection() as conn:
+        applied = applied_migrations(conn)
+        for version, name, path in list_migrations(directory):
+            if version in applied:
+                continue
+            if dry_run:
+                done.append((version, name))
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                statements = _statements(f.read())
+            try:
+                conn.execute("BEGIN")
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute("INSERT INTO schema_migrations (version, name) VALUES (?, ?)", (version, name))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                print(f"Migration {version:04d}_{name} failed; database left at the previous version")
+                raise
+            print(f"Applied migration {version:04d}_{name}")
+            done.append((version, name))
+    return done
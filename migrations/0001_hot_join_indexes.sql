@@ -0,0 +1,7 @@
+-- Indexes for the joins used by purchase history and typical generated SQL.
+-- Orders is filtered by customer and sorted by date, so one composite index serves both.
+CREATE INDEX IF NOT EXISTS idx_orders_customer_id_order_date ON Orders(Customer_id, Order_date);
+CREATE INDEX IF NOT EXISTS idx_order_detail_order_id ON Order_detail(Order_id);
+CREATE INDEX IF NOT EXISTS idx_order_detail_variant_id ON Order_detail(Variant_id);
+CREATE INDEX IF NOT EXISTS idx_variant_product_id ON Variant(Product_id);
+CREATE INDEX IF NOT EXISTS idx_product_categories_id ON Product(Categories_id);
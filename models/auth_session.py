@@ -0,0 +1,69 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+
+@dataclass
+class AuthSession:
+    """Lightweight per-connection state for face authentication.
+
+    Face models live in the shared FaceModelPool; a session only tracks its own progress.
+    Frame admission is latest-frame-wins: at most one frame is pending, and a newer frame
+    replaces (drops) an older one that has not been picked up yet. Once the tracker has
+    confirmed a match the session is done and further frames are ignored.
+    """
+    sid: str
+    connected_at: float = field(default_factory=time.time)
+    frames_received: int = 0
+    frames_processed: int = 0
+    frames_dropped: int = 0
+    last_frame_at: float = 0.0
+    pending_frame: Optional[Any] = field(default=None, repr=False)
+    busy: bool = False
+    tracker: Optional[Any] = field(default=None, repr=False)  # FaceTracker following this session's face
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.tracker is not None and self.tracker.confirmed is not None
+
+    def submit(self, frame) -> bool:
+        """Stores `frame` as the pending frame. Returns True if the caller should start a worker for this session."""
+        with self._lock:
+            self.frames_received += 1
+            self.last_frame_at = time.time()
+            if self.pending_frame is not None:
+                self.frames_dropped += 1
+            self.pending_frame = frame
+            if self.busy:
+                return False
+            self.busy = True
+            return True
+
+    def take(self):
+        """Pops the pending frame for the worker; returns None (and marks the session idle) when there is none."""
+        with self._lock:
+            frame = self.pending_frame
+            self.pending_frame = None
+            if frame is None:
+                self.busy = False
+            return frame
+
+    def counters(self) -> dict:
+        counters = {
+            'frames_received': self.frames_received,
+            'frames_processed': self.frames_processed,
+            'frames_dropped': self.frames_dropped
+        }
+        if self.tracker is not None:
+            counters.update(self.tracker.stats())
+        return counters
+
+    def to_dict(self) -> dict:
+        return {
+            'sid': self.sid,
+            'connected_for': round(time.time() - self.connected_at, 1),
+            'busy': self.busy,
+            **self.counters()
+        }
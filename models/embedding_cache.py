@@ -0,0 +1,251 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+def normalize_query(text: str) -> str:
+    """Normalize query text so trivially different spellings share a cache key"""
+    return " ".join(unicodedata.normalize("NFC", text).lower().split())
+
+
+def _key_tag(key: str) -> int:
+    """Non-zero 64-bit tag of a key; 0 marks an empty slot"""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+
+class DiskEmbeddingStore:
+    """Fixed-capacity float32 embedding store backed by a memory-mapped file and a JSON key index.
+
+    The key index is written every flush_every puts, after flush_interval seconds, or at exit, not on
+    every put. Each slot also carries the tag of the key it holds (keys.u64), so an index entry that
+    is stale after a crash (its slot since reused by another key) is detected and treated as a miss.
+    """
+
+    def __init__(self, directory: str, namespace: str, capacity: int = 20000, ttl: int = 0,
+                 flush_every: int = 64, flush_interval: float = 30.0):
+        self.directory = directory
+        self.namespace = namespace
+        self.capacity = capacity
+        self.ttl = ttl
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.vectors_path = os.path.join(directory, "embeddings.f32")
+        self.tags_path = os.path.join(directory, "keys.u64")
+        self.index_path = os.path.join(directory, "index.json")
+
+        self.dim: Optional[int] = None
+        self._vectors: Optional[np.memmap] = None
+        self._tags: Optional[np.memmap] = None
+        self._dirty = 0
+        self._last_flush = time.time()
+        # key -> (slot, timestamp), oldest first
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._free_slots: List[int] = []
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+        atexit.register(self.flush)
+
+    def _load(self):
+        """Load the key index; drop everything if it belongs to another model or layout"""
+        if not all(os.path.exists(path) for path in (self.index_path, self.vectors_path, self.tags_path)):
+            self._reset()
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get("namespace") != self.namespace or index.get("capacity") != self.capacity:
+                print(f"Query cache at {self.directory} was built for another model or size. Resetting.")
+                self._reset()
+                return
+
+            self.dim = index["dim"]
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+            self._tags = np.memmap(self.tags_path, dtype=np.uint64, mode="r+", shape=(self.capacity,))
+            now = time.time()
+            used = set()
+            for key, slot, timestamp in index.get("entries", []):
+                if self.ttl and now - timestamp > self.ttl:
+                    continue
+                self._entries[key] = [slot, timestamp]
+                used.add(slot)
+            self._free_slots = [slot for slot in range(self.capacity - 1, -1, -1) if slot not in used]
+        except Exception as e:
+            print(f"Error loading query cache index: {e}. Starting fresh.")
+            self._reset()
+
+    def _reset(self):
+        for path in (self.vectors_path, self.tags_path, self.index_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.dim = None
+        self._vectors = None
+        self._tags = None
+        self._dirty = 0
+        self._entries = OrderedDict()
+        self._free_slots = list(range(self.capacity - 1, -1, -1))
+
+    def _save_index(self):
+        index = {
+            "namespace": self.namespace,
+            "capacity": self.capacity,
+            "dim": self.dim,
+            "entries": [[key, slot, timestamp] for key, (slot, timestamp) in self._entries.items()]
+        }
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def flush(self):
+        """Write pending vectors and the key index to disk"""
+        if not self._dirty or self._vectors is None:
+            return
+        self._vectors.flush()
+        self._tags.flush()
+        self._save_index()
+        self._dirty = 0
+        self._last_flush = time.time()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        slot, timestamp = entry
+        if int(self._tags[slot]) != _key_tag(key):
+            # Index entry saved before its slot was reused and the process stopped before the next flush;
+            # the key that reused it was never indexed, so the slot is free again
+            del self._entries[key]
+            self._free_slots.append(slot)
+            return None
+        if self.ttl and time.time() - timestamp > self.ttl:
+            del self._entries[key]
+            self._free_slots.append(slot)
+            return None
+        self._entries.move_to_end(key)
+        return np.array(self._vectors[slot])
+
+    def put(self, key: str, vector: np.ndarray):
+        vector = np.asarray(vector, dtype=np.float32)
+        if self._vectors is None:
+            self.dim = int(vector.shape[0])
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="w+", shape=(self.capacity, self.dim))
+            self._tags = np.memmap(self.tags_path, dtype=np.uint64, mode="w+", shape=(self.capacity,))
+        if vector.shape[0] != self.dim:
+            return
+
+        if key in self._entries:
+            slot = self._entries.pop(key)[0]
+        elif self._free_slots:
+            slot = self._free_slots.pop()
+        else:
+            # Evict the least recently used entry and reuse its slot
+            _, (slot, _) = self._entries.popitem(last=False)
+
+        # Clear the tag while the vector is replaced so a stale index entry never matches a half-written slot
+        self._tags[slot] = 0
+        self._vectors[slot] = vector
+        self._tags[slot] = _key_tag(key)
+        self._entries[key] = [slot, time.time()]
+        self._dirty += 1
+        if self._dirty >= self.flush_every or time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def clear(self):
+        self._reset()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class QueryEmbeddingCache:
+    """In-process LRU for query embeddings with an optional on-disk second tier"""
+
+    def __init__(self, namespace: str, max_size: int = 1024, disk_dir: Optional[str] = None,
+                 disk_size: int = 20000, ttl: int = 0):
+        self.namespace = namespace
+        self.max_size = max_size
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.disk = None
+        if disk_dir:
+            try:
+                self.disk = DiskEmbeddingStore(disk_dir, namespace, capacity=disk_size, ttl=ttl)
+            except Exception as e:
+                print(f"Error opening on-disk query cache at {disk_dir}: {e}. Using memory only.")
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, text: str) -> Optional[List[float]]:
+        key = normalize_query(text)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                vector, timestamp = entry
+                if not self.ttl or time.time() - timestamp <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return list(vector)
+                del self._memory[key]
+
+            if self.disk is not None:
+                vector = self.disk.get(key)
+                if vector is not None:
+                    self._remember(key, vector.tolist())
+                    self.disk_hits += 1
+                    return vector.tolist()
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, vector: List[float]):
+        key = normalize_query(text)
+        with self._lock:
+            self._remember(key, list(vector))
+            if self.disk is not None:
+                try:
+                    self.disk.put(key, np.asarray(vector, dtype=np.float32))
+                except Exception as e:
+                    print(f"Error writing query embedding to disk cache: {e}")
+
+    def flush(self):
+        with self._lock:
+            if self.disk is not None:
+                self.disk.flush()
+
+    def _remember(self, key: str, vector: List[float]):
+        if self.max_size <= 0:
+            return
+        self._memory[key] = (vector, time.time())
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self.disk is not None:
+                self.disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current sizes"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "namespace": self.namespace,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_size": len(self._memory),
+            "disk_size": len(self.disk) if self.disk is not None else 0
+        }
@@ -1,68 +1,239 @@
-import cv2
 import numpy as np
 # Removed: from ultralytics import YOLO
 # Removed: import tensorflow as tf
 import sqlite3
-from scipy.spatial.distance import cosine
 import time
-import json
+import hashlib
 import streamlit as st
 import os
 from pathlib import Path
 import av # Needed for VideoFrame
 import queue # For communication
+import threading
+import functools
+from contextlib import contextmanager
 from insightface.model_zoo import get_model
-from insightface.app import FaceAnalysis
+from insightface.utils import face_align
+from insightface.utils.storage import ensure_available
+from db import default_db_path, get_db
+from .face_embedding_codec import decode_face_embedding, encode_face_embedding
+from .face_tracking import FaceTracker, face_quality
 
 BASE_DIR = Path(os.path.dirname(__file__)).parent # Should resolve to D:\flask
 
-def find_matching_face(embedding, threshold=0.6):
-    """Compares an embedding against the database and returns user info if matched."""
-    conn = None
-    best_match_info = None
-    max_similarity = -1.0  # Khởi tạo nhỏ nhất vì similarity nằm trong [-1, 1]
-
-    try:
-        db_path = os.path.join(BASE_DIR, 'Database.db')
-        if not os.path.exists(db_path):
-            print(f"Error: Database not found at {db_path}")
-            return None
-
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+def _embedding_digest(raw):
+    """Hash of a whole stored embedding, registered as embedding_digest() on the gallery connection"""
+    if raw is None:
+        return None
+    return hashlib.blake2b(bytes(raw) if not isinstance(raw, str) else raw.encode("utf-8"), digest_size=16).digest()
+
+
+class FaceGallery:
+    """In-memory index of enrolled face embeddings.
+
+    All embeddings live in one contiguous, L2-normalized float32 matrix so a lookup is a single
+    matrix-vector product. The index follows the customers table incrementally: refresh() is cheap
+    when the database hasn't changed and only re-reads the rows that were added, removed or edited.
+    """
+    def __init__(self, db_path, refresh_interval=2.0):
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self._conn = None
+        self._data_version = None
+        self._last_check = 0.0
+        self._reset()
+        self.reload()
+
+    def _reset(self):
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._count = 0
+        self._ids = []
+        self._names = []
+        self._rows = {}          # customer id -> row in _matrix
+        self._fingerprints = {}  # customer id -> (name, hash) of the stored embedding
+
+    def _connection(self):
+        # One long-lived connection: PRAGMA data_version only reports changes seen by the same connection
+        if self._conn is None:
+            self._conn = get_db(self.db_path).open(read_only=True)
+            self._conn.create_function("embedding_digest", 1, _embedding_digest, deterministic=True)
+        return self._conn
+
+    def __len__(self):
+        return self._count
+
+    def reload(self):
+        """Rebuilds the whole index from the customers table."""
+        with self._lock:
+            cursor = self._connection().cursor()
+            self._data_version = cursor.execute("PRAGMA data_version").fetchone()[0]
+            cursor.execute("SELECT id, name, embedding FROM customers WHERE embedding IS NOT NULL")
+            self._reset()
+            for customer_id, name, raw in cursor.fetchall():
+                self._upsert_raw(customer_id, name, raw, (name, _embedding_digest(raw)))
+            self._last_check = time.time()
+            print(f"Face gallery loaded: {self._count} enrolled faces")
+
+    def refresh(self, force=False):
+        """Applies database changes since the last refresh. Throttled to once per refresh_interval."""
+        now = time.time()
+        if not force and now - self._last_check < self.refresh_interval:
+            return
+        with self._lock:
+            self._last_check = now
+            cursor = self._connection().cursor()
+            data_version = cursor.execute("PRAGMA data_version").fetchone()[0]
+            if not force and data_version == self._data_version:
+                return
+            self._data_version = data_version
+
+            # The whole embedding is hashed: a re-enrolled face can keep the size and leading bytes
+            cursor.execute("SELECT id, name, embedding_digest(embedding) FROM customers WHERE embedding IS NOT NULL")
+            current = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+            removed = [customer_id for customer_id in self._rows if customer_id not in current]
+            changed = [customer_id for customer_id, fingerprint in current.items()
+                       if self._fingerprints.get(customer_id) != fingerprint]
+            for customer_id in removed:
+                self.remove(customer_id)
+
+            for start in range(0, len(changed), 500):
+                chunk = changed[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                cursor.execute(f"SELECT id, name, embedding FROM customers WHERE id IN ({placeholders})", chunk)
+                for customer_id, name, raw in cursor.fetchall():
+                    self._upsert_raw(customer_id, name, raw, current[customer_id])
+
+            if removed or changed:
+                print(f"Face gallery refreshed: +{len(changed)} / -{len(removed)} ({self._count} enrolled faces)")
+
+    def _upsert_raw(self, customer_id, name, raw, fingerprint):
+        embedding = decode_face_embedding(raw)
+        if embedding is None:
+            return
+        if self.upsert(customer_id, name, embedding):
+            self._fingerprints[customer_id] = fingerprint
+
+    def upsert(self, customer_id, name, embedding):
+        """Adds or replaces one customer's embedding. Returns False if the embedding is unusable."""
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(embedding)
+        if embedding.size == 0 or norm == 0 or not np.isfinite(norm):
+            return False
+
+        with self._lock:
+            if self._count == 0 and self._matrix.shape[1] != embedding.size:
+                self._matrix = np.zeros((max(16, self._matrix.shape[0]), embedding.size), dtype=np.float32)
+            if embedding.size != self._matrix.shape[1]:
+                print(f"Skipping embedding for customer {customer_id}: dimension {embedding.size} != {self._matrix.shape[1]}")
+                return False
+
+            row = self._rows.get(customer_id)
+            if row is None:
+                if self._count == self._matrix.shape[0]:
+                    grown = np.zeros((max(16, self._matrix.shape[0] * 2), self._matrix.shape[1]), dtype=np.float32)
+                    grown[:self._count] = self._matrix[:self._count]
+                    self._matrix = grown
+                row = self._count
+                self._count += 1
+                self._ids.append(customer_id)
+                self._names.append(name)
+                self._rows[customer_id] = row
+            else:
+                self._names[row] = name
+
+            self._matrix[row] = embedding / norm
+            return True
+
+    def remove(self, customer_id):
+        """Drops a customer from the index by moving the last row into its slot."""
+        with self._lock:
+            row = self._rows.pop(customer_id, None)
+            self._fingerprints.pop(customer_id, None)
+            if row is None:
+                return
+            last = self._count - 1
+            if row != last:
+                self._matrix[row] = self._matrix[last]
+                self._ids[row] = self._ids[last]
+                self._names[row] = self._names[last]
+                self._rows[self._ids[row]] = row
+            self._ids.pop()
+            self._names.pop()
+            self._count -= 1
+
+    def search(self, embedding, top_k=1, threshold=None):
+        """Returns up to top_k matches as dicts with 'id', 'name' and 'similarity', best first."""
+        if embedding is None:
+            return []
+        query = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if query.size == 0 or norm == 0:
+            return []
+
+        with self._lock:
+            if self._count == 0 or query.size != self._matrix.shape[1]:
+                return []
+            similarities = self._matrix[:self._count] @ (query / norm)
+            k = min(top_k, self._count)
+            top = np.argpartition(-similarities, k - 1)[:k]
+            top = top[np.argsort(-similarities[top])]
+            matches = []
+            for row in top:
+                similarity = float(similarities[row])
+                if threshold is not None and similarity < threshold:
+                    break
+                matches.append({'id': self._ids[row], 'name': self._names[row], 'similarity': similarity})
+            return matches
+
+
+_face_gallery = None
+_face_gallery_lock = threading.Lock()
+
+
+def get_face_gallery(db_path=None):
+    """Returns the shared FaceGallery, loading it on first use."""
+    global _face_gallery
+    with _face_gallery_lock:
+        if _face_gallery is None:
+            _face_gallery = FaceGallery(db_path or default_db_path())
+    return _face_gallery
+
+
+def save_face_embedding(customer_id, embedding, dtype="float32", db_path=None, name=None):
+    """
+    Stores a customer's face embedding in the binary format and refreshes the shared gallery.
+    With a name, the customer row is created (or renamed) first, as /register does.
+    """
+    stored = encode_face_embedding(embedding, dtype)
+    with get_db(db_path).connection() as conn:
+        with conn:
+            if name is not None:
+                conn.execute("INSERT INTO customers (id, name) VALUES (?, ?) "
+                             "ON CONFLICT(id) DO UPDATE SET name = excluded.name", (customer_id, name))
+            conn.execute("UPDATE customers SET embedding = ? WHERE id = ?", (stored, customer_id))
+        row = conn.execute("SELECT name FROM customers WHERE id = ?", (customer_id,)).fetchone()
+
+    if row is not None and _face_gallery is not None:
+        # Re-read changed rows so the gallery's fingerprints match what is stored
+        _face_gallery.refresh(force=True)
+    return row is not None
 
-        cursor.execute("SELECT embedding, name, id FROM customers WHERE embedding IS NOT NULL")
-        results = cursor.fetchall()
 
+def find_matching_face(embedding, threshold=0.6):
+    """Compares an embedding against the enrolled faces and returns user info if matched."""
+    try:
         if embedding is None or embedding.ndim != 1 or embedding.size == 0:
             return None
 
-        for db_embedding_str, name, id in results:
-            try:
-                if not db_embedding_str:
-                    continue
-                db_embedding = np.array(json.loads(db_embedding_str), dtype=np.float32)
-
-                if db_embedding.ndim != 1 or db_embedding.size == 0:
-                    continue
-
-                # Tính cosine similarity
-                similarity = np.dot(embedding, db_embedding) / (
-                    np.linalg.norm(embedding) * np.linalg.norm(db_embedding)
-                )
-
-                if similarity > max_similarity:
-                    max_similarity = similarity
-                    best_match_info = {'name': name, 'id': id, 'similarity': similarity}
-
-            except json.JSONDecodeError:
-                continue
-            except Exception as e:
-                continue
-
-        if best_match_info and max_similarity >= threshold:
-            print(f"Match found: {best_match_info['name']} (ID: {best_match_info['id']}), Similarity: {max_similarity:.4f}")
-            return {'name': best_match_info['name'], 'id': best_match_info['id']}
+        gallery = get_face_gallery()
+        gallery.refresh()
+        matches = gallery.search(embedding, top_k=1, threshold=threshold)
+        if matches:
+            best = matches[0]
+            print(f"Match found: {best['name']} (ID: {best['id']}), Similarity: {best['similarity']:.4f}")
+            return {'name': best['name'], 'id': best['id']}
 
         return None
 
@@ -72,17 +243,26 @@ def find_matching_face(embedding, threshold=0.6):
     except Exception as e:
         print(f"Unexpected error in find_matching_face: {e}")
         return None
-    finally:
-        if conn:
-            conn.close()
 
 
 
 class FaceAuthTransformer:
     """Handles face detection and recognition without Streamlit dependencies."""
-    def __init__(self, model_name="det_10g.onnx"):
-        """Initializes face detection and recognition models."""
+    def __init__(self, model_name="det_10g.onnx", rec_pack="buffalo_l", rec_model_name="w600k_r50.onnx",
+                 adaptive_detection=True, coarse_size=320, roi_size=224, roi_expand=2.0):
+        """
+        Initializes face detection and recognition models.
+
+        With adaptive_detection, a frame without a tracked face is searched at coarse_size instead of
+        640x640, and the face is then re-detected inside a box roi_expand times its size at roi_size,
+        which puts the face at roughly ArcFace's 112px scale for accurate landmarks. Frames that continue
+        a track only run the ROI detection.
+        """
         print("🟢 Initializing FaceAuthTransformer (Flask version)...")
+        self.adaptive_detection = adaptive_detection
+        self.coarse_size = (coarse_size, coarse_size)
+        self.roi_size = (roi_size, roi_size)
+        self.roi_expand = roi_expand
 
         try:
             model_dir = os.path.join(BASE_DIR, 'models')
@@ -100,12 +280,18 @@ class FaceAuthTransformer:
             raise
 
         try:
-            print("📦 Loading ArcFace (FaceAnalysis)...")
-            # Specify CPUExecutionProvider explicitly if not using GPU
-            # ArcFace models are typically handled internally by insightface, no explicit path needed usually
-            self.arcface_app = FaceAnalysis(name="buffalo_l", root=model_dir, providers=["CPUExecutionProvider"]) # Point root to model dir
+            # Only the ArcFace recognition head of the pack is needed: detection is done by RetinaFace above,
+            # and the landmark / gender-age models FaceAnalysis would also load are never used.
+            rec_dir = os.path.join(model_dir, 'models', rec_pack) # Same layout as FaceAnalysis(root=model_dir)
+            rec_model_path = os.path.join(rec_dir, rec_model_name)
+            if not os.path.exists(rec_model_path):
+                rec_dir = ensure_available('models', rec_pack, root=model_dir)
+                rec_model_path = os.path.join(rec_dir, rec_model_name)
+
+            print(f"📦 Loading ArcFace from {rec_model_path}")
+            self.rec_model = get_model(rec_model_path, providers=["CPUExecutionProvider"])
             # Use CPU context (ctx_id=-1) or 0 for GPU
-            self.arcface_app.prepare(ctx_id=-1)
+            self.rec_model.prepare(ctx_id=-1)
             print("✅ ArcFace loaded successfully.")
         except Exception as e:
             print(f"❌ Error loading ArcFace: {e}")
@@ -122,32 +308,50 @@ class FaceAuthTransformer:
 
         Returns:
             dict: Containing keys 'match' (user_info dict, False, or None), 
-                'bbox' (list [x1, y1, x2, y2] or None), and 
-                'confidence' (float or None).
+                'bbox' (list [x1, y1, x2, y2] or None), 
+                'confidence' (float or None) and
+                'timings' (per-stage milliseconds: 'detect', 'align', 'embed', 'match').
         """
-        if frame is None:
-            return {'match': None, 'bbox': None, 'confidence': None}
+        return self.match_face(self.extract_face(frame))
 
-        result = {'match': None, 'bbox': None, 'confidence': None}
+    def extract_face(self, frame, track_hint=None):
+        """
+        Runs the CPU-heavy part of recognition in a single pass: RetinaFace detection, alignment of the
+        best face using its detected landmarks, and ArcFace embedding of the aligned 112x112 crop.
+        Touches no shared state, so it is safe to run in a worker thread.
+
+        Args:
+            frame: BGR image.
+            track_hint: Optional FaceTracker.hint(). When the face continues that track without
+                better quality, alignment and embedding are skipped and 'tracked' is set.
+
+        Returns:
+            dict: Same keys as recognize_face plus 'embedding' (np.ndarray or None),
+                'quality' (float), 'tracked' (bool), 'detect_mode' (see _detect) and
+                'timings' (milliseconds spent in 'detect', 'align' and 'embed').
+                'match' is False when a face was found but no embedding could be made.
+        """
+        timings = {}
+        result = {'match': None, 'bbox': None, 'confidence': None, 'embedding': None, 'timings': timings,
+                  'quality': 0.0, 'tracked': False}
+        if frame is None:
+            return result
 
         try:
-            bboxes, landmarks = self.det_model.detect(frame, max_num=0, metric='default')
+            start = time.perf_counter()
+            bboxes, landmarks, result['detect_mode'] = self._detect(frame, track_hint)
+            timings['detect'] = (time.perf_counter() - start) * 1000
 
             if bboxes is None or len(bboxes) == 0:
                 return result
 
             # Chọn bbox có độ tự tin cao nhất
-            best_bbox = None
-            best_confidence = -1
+            best_index = int(np.argmax(bboxes[:, 4]))
+            best_bbox = bboxes[best_index]
+            best_confidence = float(best_bbox[4])
 
-            for bbox in bboxes:
-                conf = float(bbox[4])
-                if conf > best_confidence:
-                    best_confidence = conf
-                    best_bbox = bbox
-
-            if best_bbox is None or best_confidence < self.det_model.det_thresh:
-                result['bbox'] = best_bbox[:4].astype(int).tolist() if best_bbox is not None else None
+            if best_confidence < self.det_model.det_thresh:
+                result['bbox'] = best_bbox[:4].astype(int).tolist()
                 result['confidence'] = best_confidence
                 result['match'] = None
                 return result
@@ -155,39 +359,180 @@ class FaceAuthTransformer:
             x1, y1, x2, y2 = best_bbox[:4].astype(int)
             result['bbox'] = [x1, y1, x2, y2]
             result['confidence'] = best_confidence
+            result['quality'] = face_quality(result['bbox'], best_confidence)
 
-            # Cắt ảnh khuôn mặt theo bbox
-            # face_crop = frame[y1:y2, x1:x2]
-            face_crop = frame
-            if face_crop.size == 0:
-                print("❌ Empty crop region.")
-                result['match'] = False
+            if not FaceTracker.needs_embedding(track_hint, result['bbox'], result['quality']):
+                result['tracked'] = True
                 return result
 
-            # Resize về 112x112 để phù hợp với ArcFace
-            face_crop_resized = cv2.resize(face_crop, (112, 112))
-
-            # Lấy embedding từ ArcFace
-            arcface_faces = self.arcface_app.get(face_crop_resized)
-
-            if not arcface_faces:
+            if landmarks is None or len(landmarks) <= best_index:
+                print("❌ No landmarks for the detected face.")
                 result['match'] = False
                 return result
 
-            target_face = arcface_faces[0]
-            embedding = target_face.embedding
+            # Căn chỉnh khuôn mặt về 112x112 theo 5 điểm landmark (giống FaceAnalysis)
+            start = time.perf_counter()
+            aligned = face_align.norm_crop(frame, landmark=landmarks[best_index], image_size=self.rec_model.input_size[0])
+            timings['align'] = (time.perf_counter() - start) * 1000
+
+            # Lấy embedding từ ArcFace
+            start = time.perf_counter()
+            embedding = self.rec_model.get_feat(aligned).flatten()
+            timings['embed'] = (time.perf_counter() - start) * 1000
 
             if embedding is None or np.linalg.norm(embedding) == 0:
                 print("❌ ArcFace embedding extraction failed or embedding is zero.")
                 result['match'] = False
                 return result
 
-            # So khớp với cơ sở dữ liệu
-            match_info = find_matching_face(embedding)
-
-            result['match'] = match_info if match_info else False
+            result['embedding'] = embedding
             return result
 
         except Exception as e:
             print(f"❌ Error during face recognition processing: {e}")
-            return {'match': None, 'bbox': None, 'confidence': None}
+            return {'match': None, 'bbox': None, 'confidence': None, 'embedding': None, 'timings': timings,
+                    'quality': 0.0, 'tracked': False}
+
+    def _detect(self, frame, track_hint=None):
+        """
+        Returns (bboxes, landmarks, mode). Modes:
+            'full'       fixed 640x640 detection (adaptive detection off)
+            'coarse'     low-resolution full-frame search found no face
+            'coarse+roi' low-resolution search, then re-detection inside the face ROI
+            'roi'        tracked face re-detected inside its ROI only
+            'lost'       ROI detection missed the tracked face; fell back to the full-frame search
+        """
+        if not self.adaptive_detection:
+            bboxes, landmarks = self.det_model.detect(frame, max_num=0, metric='default')
+            return bboxes, landmarks, 'full'
+
+        if track_hint is not None and track_hint.get('bbox') is not None:
+            bboxes, landmarks = self._detect_in_roi(frame, track_hint['bbox'])
+            if bboxes is not None and len(bboxes) > 0:
+                return bboxes, landmarks, 'roi'
+            mode = 'lost'
+        else:
+            mode = 'coarse'
+
+        bboxes, landmarks = self.det_model.detect(frame, input_size=self.coarse_size, max_num=0, metric='default')
+        if bboxes is None or len(bboxes) == 0:
+            return bboxes, landmarks, mode
+
+        roi_bboxes, roi_landmarks = self._detect_in_roi(frame, bboxes[int(np.argmax(bboxes[:, 4])), :4])
+        if roi_bboxes is None or len(roi_bboxes) == 0:
+            return bboxes, landmarks, mode
+        return roi_bboxes, roi_landmarks, 'coarse+roi' if mode == 'coarse' else mode
+
+    def _detect_in_roi(self, frame, bbox):
+        """Detects faces in a square region roi_expand times the size of bbox, in full-frame coordinates."""
+        height, width = frame.shape[:2]
+        x1, y1, x2, y2 = [float(v) for v in bbox[:4]]
+        center_x, center_y = (x1 + x2) / 2, (y1 + y2) / 2
+        half_side = max(x2 - x1, y2 - y1) * self.roi_expand / 2
+        rx1, ry1 = int(max(0, center_x - half_side)), int(max(0, center_y - half_side))
+        rx2, ry2 = int(min(width, center_x + half_side)), int(min(height, center_y + half_side))
+        if rx2 - rx1 < 16 or ry2 - ry1 < 16:
+            return None, None
+
+        bboxes, landmarks = self.det_model.detect(frame[ry1:ry2, rx1:rx2], input_size=self.roi_size, max_num=0, metric='default')
+        if bboxes is None or len(bboxes) == 0:
+            return bboxes, landmarks
+        bboxes[:, [0, 2]] += rx1
+        bboxes[:, [1, 3]] += ry1
+        if landmarks is not None:
+            landmarks[..., 0] += rx1
+            landmarks[..., 1] += ry1
+        return bboxes, landmarks
+
+    @staticmethod
+    def match_face(result):
+        """Matches the embedding from extract_face against the gallery and drops it from the result."""
+        embedding = result.pop('embedding', None)
+        if embedding is not None:
+            # So khớp với cơ sở dữ liệu
+            start = time.perf_counter()
+            match_info = find_matching_face(embedding)
+            result.setdefault('timings', {})['match'] = (time.perf_counter() - start) * 1000
+            result['match'] = match_info if match_info else False
+        return result
+
+
+class FaceModelPool:
+    """Process-wide, bounded pool of FaceAuthTransformer instances.
+
+    Transformers are created lazily on first checkout, up to `size`; callers beyond
+    that wait for one to be returned. Loading RetinaFace/ArcFace takes seconds, so callers
+    on the eventlet hub pass `build` (e.g. tpool.execute) to run the factory off the hub.
+    """
+    def __init__(self, size=2, factory=FaceAuthTransformer):
+        self.size = max(1, size)
+        self._factory = factory
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self.checkouts = 0
+        self.waits = 0
+
+    def checkout(self, timeout=None, build=None):
+        """Borrows a transformer. Raises queue.Empty if none is free within `timeout` seconds."""
+        transformer = None
+        try:
+            transformer = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    transformer = build(self._factory) if build is not None else self._factory()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                self.waits += 1
+                transformer = self._idle.get(timeout=timeout)
+
+        with self._lock:
+            self._in_use += 1
+            self.checkouts += 1
+        return transformer
+
+    def release(self, transformer):
+        """Returns a transformer obtained from checkout()."""
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(transformer)
+
+    @contextmanager
+    def session(self, timeout=None, build=None):
+        transformer = self.checkout(timeout=timeout, build=build)
+        try:
+            yield transformer
+        finally:
+            self.release(transformer)
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'created': self._created,
+            'in_use': self._in_use,
+            'checkouts': self.checkouts,
+            'waits': self.waits
+        }
+
+
+_face_model_pool = None
+_face_model_pool_lock = threading.Lock()
+
+
+def get_face_model_pool(size=2, **transformer_options):
+    """Returns the shared FaceModelPool, creating it (without loading any model) on first call."""
+    global _face_model_pool
+    with _face_model_pool_lock:
+        if _face_model_pool is None:
+            factory = functools.partial(FaceAuthTransformer, **transformer_options)
+            _face_model_pool = FaceModelPool(size=size, factory=factory)
+    return _face_model_pool
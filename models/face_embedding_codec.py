@@ -0,0 +1,46 @@
+import json
+import struct
+
+import numpy as np
+
+# Binary layout of customers.embedding: 8-byte header followed by `dim` little-endian floats.
+#   magic (4s) | format version (B) | dtype code (B) | dim (H)
+MAGIC = b"FEMB"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sBBH")
+
+DTYPE_CODES = {1: np.dtype("<f4"), 2: np.dtype("<f2")}
+DTYPE_NAMES = {"float32": 1, "float16": 2}
+
+
+def encode_face_embedding(embedding, dtype="float32"):
+    """Packs an embedding into the binary BLOB format."""
+    code = DTYPE_NAMES[dtype]
+    values = np.asarray(embedding, dtype=DTYPE_CODES[code]).ravel()
+    return HEADER.pack(MAGIC, FORMAT_VERSION, code, values.size) + values.tobytes()
+
+
+def is_binary_embedding(value):
+    return isinstance(value, (bytes, bytearray, memoryview)) and bytes(value[:4]) == MAGIC
+
+
+def decode_face_embedding(value):
+    """Returns the embedding stored in a customers.embedding value, or None if it is unusable.
+
+    Binary BLOBs are read with np.frombuffer (no parsing, no copy); legacy JSON text rows are still accepted.
+    """
+    if value is None:
+        return None
+    try:
+        if is_binary_embedding(value):
+            _, version, code, dim = HEADER.unpack_from(value)
+            if version != FORMAT_VERSION or code not in DTYPE_CODES:
+                return None
+            return np.frombuffer(value, dtype=DTYPE_CODES[code], count=dim, offset=HEADER.size)
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            value = bytes(value).decode("utf-8")
+        if not value:
+            return None
+        return np.array(json.loads(value), dtype=np.float32)
+    except (ValueError, TypeError, struct.error, UnicodeDecodeError):
+        return None
@@ -0,0 +1,119 @@
+def bbox_iou(a, b):
+    """Intersection over union of two [x1, y1, x2, y2] boxes."""
+    if a is None or b is None:
+        return 0.0
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def face_quality(bbox, confidence, min_face=112):
+    """Detection confidence, discounted for faces smaller than the ArcFace input."""
+    if bbox is None or confidence is None:
+        return 0.0
+    short_side = min(bbox[2] - bbox[0], bbox[3] - bbox[1])
+    return float(confidence) * min(1.0, max(0, short_side) / min_face)
+
+
+class FaceTracker:
+    """
+    Follows the face of one auth session across frames.
+
+    A track is continued while consecutive detections overlap (IoU >= iou_threshold). Only a frame whose
+    own embedding matched the track's user counts as a vote; the match is confirmed after
+    consensus_frames votes, so every frame is embedded until then. Once confirmed, new frames skip
+    alignment and embedding unless the face quality improves by more than quality_margin; such tracked
+    frames only keep the track alive. A re-embedding that disagrees, a new track, or losing the face for
+    more than max_missed frames starts the count again.
+    """
+    def __init__(self, iou_threshold=0.5, quality_margin=0.05, consensus_frames=3, max_missed=2):
+        self.iou_threshold = iou_threshold
+        self.quality_margin = quality_margin
+        self.consensus_frames = max(1, consensus_frames)
+        self.max_missed = max_missed
+        self.embeddings_computed = 0
+        self.embeddings_skipped = 0
+        self.confirmed = None
+        self._reset_track()
+
+    def _reset_track(self):
+        self.bbox = None
+        self.quality = 0.0
+        self.identity = None
+        self.votes = 0
+        self.missed = 0
+
+    def hint(self):
+        """What the worker needs to search near the tracked face and decide whether to re-embed it."""
+        if self.bbox is None:
+            return None
+        matched = isinstance(self.identity, dict)
+        return {'bbox': self.bbox, 'quality': self.quality, 'matched': matched,
+                'confirming': matched and self.votes < self.consensus_frames,
+                'iou_threshold': self.iou_threshold, 'quality_margin': self.quality_margin}
+
+    @staticmethod
+    def needs_embedding(hint, bbox, quality):
+        """Called by the worker: embed unless the face continues a confirmed track without getting better."""
+        if hint is None or not hint['matched'] or hint.get('confirming'):
+            return True
+        if bbox_iou(hint['bbox'], bbox) < hint['iou_threshold']:
+            return True
+        return quality > hint['quality'] + hint['quality_margin']
+
+    def update(self, result):
+        """
+        Folds one recognition result into the track and rewrites result['match']:
+        the confirmed user info once consensus is reached, False for an unknown face,
+        None while there is no face or the match is still being confirmed.
+        """
+        bbox = result.get('bbox')
+        quality = result.get('quality', 0.0)
+        face_found = (bbox is not None and result.get('match') is not None) or result.get('tracked', False)
+
+        if not face_found:
+            self.missed += 1
+            if self.missed > self.max_missed:
+                self._reset_track()
+            result['match'] = None
+            return result
+
+        same_track = self.bbox is not None and bbox_iou(self.bbox, bbox) >= self.iou_threshold
+        if not same_track:
+            self._reset_track()
+        self.missed = 0
+        self.bbox = bbox
+
+        if result.get('tracked'):
+            # Same face, no new embedding: keeps the track alive but is no evidence of who it is
+            self.embeddings_skipped += 1
+        else:
+            self.embeddings_computed += 1
+            self.quality = max(self.quality, quality) if same_track else quality
+            match = result.get('match')
+            if isinstance(match, dict) and isinstance(self.identity, dict) and match.get('id') == self.identity.get('id'):
+                self.votes += 1
+            else:
+                self.identity = match
+                self.votes = 1 if isinstance(match, dict) else 0
+
+        if isinstance(self.identity, dict):
+            if self.votes >= self.consensus_frames:
+                self.confirmed = self.identity
+                result['match'] = self.identity
+            else:
+                result['match'] = None
+        else:
+            result['match'] = False
+        result['votes'] = self.votes
+        return result
+
+    def stats(self):
+        return {
+            'embeddings_computed': self.embeddings_computed,
+            'embeddings_skipped': self.embeddings_skipped,
+            'votes': self.votes,
+            'confirmed': self.confirmed is not None
+        }
@@ -0,0 +1,96 @@
+import threading
+
+
+class FaceWorkersBusy(Exception):
+    """Raised when the face recognition queue is full."""
+
+
+class FaceRecognitionExecutor:
+    """Runs face detection and embedding off the eventlet hub.
+
+    mode="tpool" hands FaceAuthTransformer.extract_face to eventlet's native thread pool;
+    ONNX Runtime releases the GIL, so other greenlets (Socket.IO, /chat) keep running while
+    a frame is processed. mode="inline" runs it on the hub, as before.
+    The gallery match stays on the hub: it is a single matrix-vector product.
+
+    At most `max_pending` frames may be queued or running at once across all sessions;
+    beyond that recognize() raises FaceWorkersBusy instead of queueing more work.
+    """
+    def __init__(self, model_pool, mode="tpool", threads=2, max_pending=8, pool_timeout=5.0):
+        self.model_pool = model_pool
+        self.mode = mode
+        self.max_pending = max(1, max_pending)
+        self.pool_timeout = pool_timeout
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.detect_modes = {}  # detect_mode -> [frames, total detection ms]
+
+        self._tpool = None
+        if mode == "tpool":
+            from eventlet import tpool
+            tpool.set_num_threads(max(1, threads))
+            self._tpool = tpool
+        elif mode != "inline":
+            raise ValueError(f"Unknown face worker mode: {mode}")
+
+    def recognize(self, frame, tracker=None):
+        """
+        Same contract as FaceAuthTransformer.recognize_face. May raise FaceWorkersBusy or queue.Empty.
+        With a FaceTracker, unchanged faces skip embedding and 'match' only becomes a user once confirmed.
+        """
+        track_hint = tracker.hint() if tracker is not None else None
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise FaceWorkersBusy()
+            self._pending += 1
+
+        try:
+            # A model created by this checkout is loaded in the thread pool too
+            build = self._tpool.execute if self._tpool is not None else None
+            with self.model_pool.session(timeout=self.pool_timeout, build=build) as transformer:
+                if self._tpool is not None:
+                    result = self._tpool.execute(transformer.extract_face, frame, track_hint)
+                else:
+                    result = transformer.extract_face(frame, track_hint)
+            result = transformer.match_face(result)
+            if tracker is not None:
+                result = tracker.update(result)
+            self.completed += 1
+            self._record_detection(result)
+            return result
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def embed(self, frame):
+        """Detects the best face in one still image and returns extract_face's result (with 'embedding'), for enrollment."""
+        build = self._tpool.execute if self._tpool is not None else None
+        with self.model_pool.session(timeout=self.pool_timeout, build=build) as transformer:
+            if self._tpool is not None:
+                return self._tpool.execute(transformer.extract_face, frame)
+            return transformer.extract_face(frame)
+
+    def _record_detection(self, result):
+        mode = result.get('detect_mode')
+        detect_ms = result.get('timings', {}).get('detect')
+        if mode is None or detect_ms is None:
+            return
+        totals = self.detect_modes.setdefault(mode, [0, 0.0])
+        totals[0] += 1
+        totals[1] += detect_ms
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'pending': self._pending,
+            'max_pending': self.max_pending,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'detection': {
+                mode: {'frames': frames, 'avg_ms': round(total_ms / frames, 2)}
+                for mode, (frames, total_ms) in self.detect_modes.items()
+            }
+        }
@@ -0,0 +1,220 @@
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+INDEX_KINDS = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+
+@dataclass
+class IndexSpec:
+    """FAISS index type for a vector store and its build / search parameters.
+
+    flat is exact search. hnsw is a graph index that needs no training; ef_search trades recall
+    for latency. ivf_flat and ivf_pq cluster the vectors into nlist cells and search the nprobe
+    nearest ones; ivf_pq also compresses each vector to pq_m codes of pq_bits bits.
+    """
+    kind: str = "flat"
+    nlist: int = 0                # IVF cells, 0 = about 4 * sqrt(number of vectors)
+    nprobe: int = 16              # IVF cells searched per query
+    hnsw_m: int = 32              # HNSW neighbours per node
+    ef_construction: int = 200    # HNSW candidate list while building
+    ef_search: int = 64           # HNSW candidate list while searching
+    pq_m: int = 64                # PQ sub-quantizers, must divide the embedding dimension
+    pq_bits: int = 8              # bits per PQ code
+
+    @classmethod
+    def from_config(cls, config) -> "IndexSpec":
+        return cls(
+            kind=config.vector_index_type,
+            nlist=config.vector_index_nlist,
+            nprobe=config.vector_index_nprobe,
+            hnsw_m=config.vector_index_hnsw_m,
+            ef_construction=config.vector_index_ef_construction,
+            ef_search=config.vector_index_ef_search,
+            pq_m=config.vector_index_pq_m,
+            pq_bits=config.vector_index_pq_bits
+        )
+
+    def key(self) -> str:
+        """Build parameters only; a saved store with another key is converted or rebuilt"""
+        if self.kind == "hnsw":
+            return f"hnsw:M={self.hnsw_m},efc={self.ef_construction}"
+        if self.kind == "ivf_flat":
+            return f"ivf_flat:nlist={self.nlist}"
+        if self.kind == "ivf_pq":
+            return f"ivf_pq:nlist={self.nlist},m={self.pq_m},bits={self.pq_bits}"
+        return "flat"
+
+
+def _nlist(spec: IndexSpec, n: int) -> int:
+    nlist = spec.nlist or int(4 * math.sqrt(n))
+    # k-means wants at least 39 training points per cell
+    return max(1, min(nlist, n // 39))
+
+
+def buildable_kind(spec: IndexSpec, dim: int, n: int, verbose: bool = False) -> str:
+    """Index type new_index builds for spec from n vectors: flat when spec's type cannot be trained on them"""
+    kind = spec.kind if spec.kind in INDEX_KINDS else "flat"
+    if kind != spec.kind and verbose:
+        print(f"Unknown vector index type {spec.kind!r}; using flat")
+    if kind == "ivf_pq" and (dim % spec.pq_m or n < 39 * 2 ** spec.pq_bits):
+        if verbose:
+            print(f"ivf_pq needs pq_m dividing {dim} and {39 * 2 ** spec.pq_bits}+ vectors to train (have {n}); using flat")
+        kind = "flat"
+    if kind in ("ivf_flat", "ivf_pq") and n < 39:
+        if verbose:
+            print(f"{kind} needs at least 39 vectors to train (have {n}); using flat")
+        kind = "flat"
+    return kind
+
+
+def kind_key(spec: IndexSpec, kind: str) -> str:
+    """IndexSpec.key() of the index actually built for spec, which may be a flat fallback"""
+    return spec.key() if kind == spec.kind else IndexSpec(kind=kind).key()
+
+
+def new_index(spec: IndexSpec, dim: int, train_vectors: Optional[np.ndarray] = None):
+    """Empty (trained) index for spec; falls back to flat when there are too few vectors to train"""
+    n = 0 if train_vectors is None else len(train_vectors)
+    kind = buildable_kind(spec, dim, n, verbose=True)
+
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, spec.hnsw_m)
+        index.hnsw.efConstruction = spec.ef_construction
+    elif kind in ("ivf_flat", "ivf_pq"):
+        nlist = _nlist(spec, n)
+        coarse = f"IVF{nlist},Flat" if kind == "ivf_flat" else f"IVF{nlist},PQ{spec.pq_m}x{spec.pq_bits}"
+        index = faiss.index_factory(dim, coarse)
+        sample = train_vectors
+        limit = max(256 * nlist, 64 * 2 ** spec.pq_bits)
+        if n > limit:
+            sample = train_vectors[np.random.default_rng(0).choice(n, limit, replace=False)]
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+    else:
+        index = faiss.IndexFlatL2(dim)
+    configure_search(index, spec)
+    return index
+
+
+def make_index(spec: IndexSpec, vectors: np.ndarray):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = new_index(spec, vectors.shape[1], vectors)
+    index.add(vectors)
+    return index
+
+
+def configure_search(index, spec: IndexSpec):
+    """Apply the query-time parameters (nprobe, efSearch); they can change without a rebuild"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(spec.nprobe, ivf.nlist)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = spec.ef_search
+
+
+def index_kind(index) -> str:
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return "ivf_pq" if isinstance(faiss.downcast_index(ivf), faiss.IndexIVFPQ) else "ivf_flat"
+    return "flat"
+
+
+def docstore_documents(documents: List[Dict[str, Any]]) -> Dict[str, Document]:
+    return {doc["key"]: Document(id=doc["key"], page_content=doc["content"], metadata=doc["metadata"])
+            for doc in documents}
+
+
+def add_documents(store: FAISS, documents: List[Dict[str, Any]], vectors: np.ndarray):
+    """Add embedded documents under their keys; IVF indexes get explicit ids so removals never renumber"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    ivf = faiss.try_extract_index_ivf(store.index)
+    if ivf is not None:
+        start = max(store.index_to_docstore_id, default=-1) + 1
+        store.index.add_with_ids(vectors, np.arange(start, start + len(vectors), dtype=np.int64))
+    else:
+        start = store.index.ntotal
+        store.index.add(vectors)
+    store.docstore.add(docstore_documents(documents))
+    store.index_to_docstore_id.update({start + i: doc["key"] for i, doc in enumerate(documents)})
+
+
+def reconstruct_ids(index, ids: List[int]) -> np.ndarray:
+    """Vectors stored under these faiss ids (decoded approximations for ivf_pq)"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        # Ids stop being sequential after removals, so map them with a hash table
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+    try:
+        return index.reconstruct_batch(np.asarray(ids, dtype=np.int64))
+    finally:
+        if ivf is not None:
+            ivf.set_direct_map_type(faiss.DirectMap.NoMap)
+
+
+def stored_vectors(store: FAISS) -> Optional[Tuple[List[int], np.ndarray]]:
+    """(faiss ids, exact vectors) of a store, or None when the index only keeps compressed codes"""
+    if index_kind(store.index) == "ivf_pq":
+        return None
+    ids = sorted(store.index_to_docstore_id)
+    return ids, reconstruct_ids(store.index, ids) if ids else None
+
+
+def sample_mean(store: FAISS, size: int = 2000) -> Optional[np.ndarray]:
+    """Mean of up to size stored vectors, for choosing which store to search"""
+    ids = sorted(store.index_to_docstore_id)
+    if not ids:
+        return None
+    if len(ids) > size:
+        ids = np.random.default_rng(0).choice(ids, size, replace=False).tolist()
+    return reconstruct_ids(store.index, ids).mean(axis=0)
+
+
+def remove_documents(store: FAISS, doc_ids: List[str]):
+    """Remove documents by docstore id with whatever the index type supports.
+
+    Flat indexes compact on removal (FAISS.delete renumbers the id map), IVF indexes remove by
+    explicit id, HNSW cannot remove at all so it is rebuilt from its stored vectors.
+    """
+    if not doc_ids:
+        return
+    kind = index_kind(store.index)
+    if kind == "flat":
+        store.delete(doc_ids)
+        return
+    reversed_index = {doc_id: i for i, doc_id in store.index_to_docstore_id.items()}
+    positions = {reversed_index[doc_id] for doc_id in doc_ids}
+    if kind == "hnsw":
+        keep = [i for i in sorted(store.index_to_docstore_id) if i not in positions]
+        hnsw = store.index.hnsw
+        index = faiss.IndexHNSWFlat(store.index.d, hnsw.nb_neighbors(1))
+        index.hnsw.efConstruction = hnsw.efConstruction
+        index.hnsw.efSearch = hnsw.efSearch
+        if keep:
+            index.add(store.index.reconstruct_batch(np.array(keep, dtype=np.int64)))
+        store.index_to_docstore_id = {j: store.index_to_docstore_id[i] for j, i in enumerate(keep)}
+        store.index = index
+    else:
+        store.index.remove_ids(np.array(sorted(positions), dtype=np.int64))
+        for i in positions:
+            del store.index_to_docstore_id[i]
+    store.docstore.delete(doc_ids)
+
+
+def reindex_store(store: FAISS, spec: IndexSpec) -> Optional[FAISS]:
+    """Same documents under a different index type, or None if the vectors must be re-embedded"""
+    saved = stored_vectors(store)
+    if saved is None:
+        return None
+    ids, vectors = saved
+    if vectors is None:
+        return None
+    index = make_index(spec, vectors)
+    return FAISS(store.embedding_function, index, store.docstore,
+                 {j: store.index_to_docstore_id[i] for j, i in enumerate(ids)})
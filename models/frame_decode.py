@@ -0,0 +1,85 @@
+import base64
+import struct
+
+import cv2
+import numpy as np
+
+# cv2.imdecode can downscale JPEGs by 2/4/8 while decoding (the DCT is only partially evaluated),
+# which is much cheaper than decoding at full size and resizing afterwards.
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# JPEG start-of-frame markers that carry the image dimensions
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_size(buf):
+    """Returns (width, height) from a JPEG header without decoding it, or None if buf isn't a JPEG."""
+    data = memoryview(buf)
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    pos = 2
+    while pos + 9 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # markers without a length field
+            pos += 2
+            continue
+        length = struct.unpack_from(">H", data, pos + 2)[0]
+        if marker in _SOF_MARKERS:
+            height, width = struct.unpack_from(">HH", data, pos + 5)
+            return width, height
+        pos += 2 + length
+    return None
+
+
+def decode_image_from_base64(base64_string):
+    """Decodes a base64 image string (data URL) into an OpenCV image."""
+    frame, _ = decode_frame(base64_string)
+    return frame
+
+
+def decode_frame(payload, min_side=0):
+    """
+    Decodes a video frame sent by the browser.
+
+    Args:
+        payload: Raw encoded bytes (binary Socket.IO attachment) or a base64 data URL string.
+        min_side: Smallest long side the caller needs. JPEGs at least 2x larger than this are
+            decoded at reduced scale. 0 always decodes at full resolution.
+
+    Returns:
+        tuple: (image, scale) where image is a BGR array (or None on failure) and scale converts
+            coordinates in the decoded image back to the original frame.
+    """
+    try:
+        if isinstance(payload, str):
+            comma = payload.find(',')
+            payload = base64.b64decode(payload[comma + 1:] if comma >= 0 else payload)
+        # Wraps the received buffer without copying it
+        buf = np.frombuffer(payload, dtype=np.uint8)
+
+        flag, factor = cv2.IMREAD_COLOR, 1
+        size = jpeg_size(buf) if min_side else None
+        if size:
+            long_side = max(size)
+            for candidate, reduced_flag in _REDUCED_FLAGS:
+                if long_side // candidate >= min_side:
+                    flag, factor = reduced_flag, candidate
+                    break
+
+        img = cv2.imdecode(buf, flag)
+        if img is None:
+            return None, 1.0
+        scale = size[0] / img.shape[1] if size and factor != 1 else 1.0
+        return img, scale
+    except Exception as e:
+        print(f"Error decoding frame: {e}")
+        return None, 1.0
@@ -0,0 +1,115 @@
+import time
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from .lexical_index import reciprocal_rank_fusion
+from .vector_store import PartitionedVectorStore
+
+
+class HybridRetriever:
+    """Row store retrieval that fuses FAISS results with BM25 results by reciprocal rank.
+
+    The lexical indexes come from the store sync (one per partition, kept next to index.faiss), so
+    they always cover the same documents as the vectors. Exact product / store names and numbers
+    that mean-pooled embeddings blur are found by BM25 in every partition, not only in the ones the
+    partition selector picked, and a question naming a product or store in any partition gets it from
+    the name table. BM25 itself only runs over the partitions the selector chose for the vector search,
+    so it cannot bring back partitions the selector ruled out. Each partition has its own IDF and average
+    length, so BM25 scores of different partitions are not comparable: every searched partition's ranking
+    is its own RRF list. A question that is exactly a document name is answered from the name table
+    without embedding it (the fast path).
+    """
+
+    def __init__(self, store_sync, rrf_k: int = 60, candidates: int = 20, min_lexical_ratio: float = 0.1):
+        self.store_sync = store_sync
+        self.rrf_k = rrf_k
+        self.candidates = candidates
+        # Lexical hits scoring below this fraction of the best one in their partition matched only common
+        # tokens; RRF would give them full rank credit, so they are dropped
+        self.min_lexical_ratio = min_lexical_ratio
+        self.searches = 0
+        self.fast_path_hits = 0
+        self.lexical_only = 0
+        self.total_ms = 0.0
+        self.fast_path_ms = 0.0
+
+    @staticmethod
+    def _key(doc: Document) -> str:
+        return doc.id or doc.page_content
+
+    @staticmethod
+    def _docstore(vector_store, partition: Optional[str]):
+        if isinstance(vector_store, PartitionedVectorStore):
+            store = vector_store.stores.get(partition)
+            return store.docstore if store is not None else None
+        return vector_store.docstore
+
+    def _resolve(self, vector_store, hits: List[Tuple[Optional[str], str]]) -> List[Document]:
+        docs = []
+        for partition, doc_id in hits:
+            docstore = self._docstore(vector_store, partition)
+            doc = docstore.search(doc_id) if docstore is not None else None
+            if isinstance(doc, Document):
+                docs.append(doc)
+        return docs
+
+    def search(self, vector_store, query: str, k: int = 4) -> List[Document]:
+        start = time.perf_counter()
+        indexes = self.store_sync.lexical_indexes()
+
+        exact = [(partition, doc_id) for partition, index in indexes.items() for doc_id in index.exact_name(query)]
+        if exact:
+            docs = self._resolve(vector_store, exact)[:k]
+            if docs:
+                elapsed = (time.perf_counter() - start) * 1000
+                self.searches += 1
+                self.fast_path_hits += 1
+                self.fast_path_ms += elapsed
+                self.total_ms += elapsed
+                return docs
+
+        partitions = None
+        if isinstance(vector_store, PartitionedVectorStore):
+            vector = vector_store.embeddings.embed_query(query)
+            partitions = vector_store.select_partitions(query, vector)
+            scored = vector_store.similarity_search_with_score_by_vector(vector, self.candidates, partitions)
+        else:
+            scored = vector_store.similarity_search_with_score(query, k=self.candidates)
+        vector_docs = [doc for doc, _ in scored]
+        lexical_lists = []
+        for partition, index in indexes.items():
+            if partitions is not None and partition not in partitions:
+                continue
+            hits = index.search(query, self.candidates)
+            if hits:
+                cutoff = hits[0][1] * self.min_lexical_ratio
+                lexical_lists.append(self._resolve(vector_store, [(partition, doc_id) for doc_id, score in hits
+                                                                  if score >= cutoff]))
+        named = [(partition, doc_id) for partition, index in indexes.items() for doc_id in index.names_in(query)]
+        named_docs = self._resolve(vector_store, named)
+
+        by_key: Dict[str, Document] = {}
+        rankings = []
+        for docs in [vector_docs, named_docs] + lexical_lists:
+            rankings.append([self._key(doc) for doc in docs])
+            for doc in docs:
+                by_key.setdefault(self._key(doc), doc)
+        fused = [by_key[key] for key, _ in reciprocal_rank_fusion(rankings, self.rrf_k)[:k]]
+
+        vector_keys = set(rankings[0])
+        self.lexical_only += sum(1 for doc in fused if self._key(doc) not in vector_keys)
+        self.searches += 1
+        self.total_ms += (time.perf_counter() - start) * 1000
+        return fused
+
+    def stats(self) -> dict:
+        regular = self.searches - self.fast_path_hits
+        return {
+            "searches": self.searches,
+            "fast_path_hits": self.fast_path_hits,
+            "avg_fast_path_ms": self.fast_path_ms / self.fast_path_hits if self.fast_path_hits else 0.0,
+            "avg_hybrid_ms": (self.total_ms - self.fast_path_ms) / regular if regular else 0.0,
+            "lexical_only_results": self.lexical_only,
+            "indexed_documents": sum(len(index) for index in self.store_sync.lexical_indexes().values())
+        }
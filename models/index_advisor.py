@@ -0,0 +1,170 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from db import get_db
+from utils import sql_table_aliases
+
+_log_lock = threading.Lock()
+
+
+def record_sql(log_path: str, sql: str, elapsed_ms: float = 0.0, rows: int = 0, source: str = "generated"):
+    """Append one executed query to the JSONL log read by the index advisor"""
+    if not log_path:
+        return
+    entry = {"ts": time.time(), "sql": sql, "elapsed_ms": round(elapsed_ms, 2), "rows": rows, "source": source}
+    try:
+        with _log_lock:
+            os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+            with open(log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except Exception as e:
+        print(f"Error recording SQL for the index advisor: {e}")
+
+
+def read_sql_log(log_path: str) -> List[dict]:
+    entries = []
+    if not os.path.exists(log_path):
+        return entries
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return entries
+
+
+@dataclass
+class IndexProposal:
+    table: str
+    columns: Tuple[str, ...]
+    queries: int = 0                      # distinct logged queries that would use it
+    executions: int = 0                   # logged executions of those queries
+    reasons: Set[str] = field(default_factory=set)
+
+    @property
+    def name(self) -> str:
+        return f"idx_{self.table.lower()}_{'_'.join(c.lower() for c in self.columns)}"
+
+    def create_statement(self) -> str:
+        return f"CREATE INDEX IF NOT EXISTS {self.name} ON {self.table}({', '.join(self.columns)});"
+
+
+class IndexAdvisor:
+    """Finds full scans of large tables in logged SQL and proposes the indexes that remove them.
+
+    EXPLAIN QUERY PLAN tells which tables are scanned. Candidate columns come from the query text:
+    columns compared with constants (filters) and columns in join equalities, on tables with at least
+    min_rows rows that have no index starting with that column. The SQL parsing is a heuristic aimed at
+    the single-statement SELECTs the LLM produces, not a full SQL parser.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, min_rows: int = 10000):
+        self.db_path = db_path
+        self.min_rows = min_rows
+        self._schema: Optional[Dict[str, dict]] = None
+
+    def _load_schema(self, conn) -> Dict[str, dict]:
+        schema = {}
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")]
+        for table in tables:
+            columns = conn.execute(f"PRAGMA table_info({table})").fetchall()
+            rowid_pk = [c[1] for c in columns if c[5] == 1 and c[2].upper() == "INTEGER"]
+            leading = set(rowid_pk)
+            for index in conn.execute(f"PRAGMA index_list({table})").fetchall():
+                info = conn.execute(f"PRAGMA index_info({index[1]})").fetchall()
+                if info:
+                    leading.add(min(info, key=lambda r: r[0])[2])
+            schema[table.lower()] = {
+                "name": table,
+                "columns": {c[1].lower(): c[1] for c in columns},
+                "indexed": {c.lower() for c in leading if c},
+                "rows": conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+            }
+        return schema
+
+    def _resolve(self, ident: str, aliases: Dict[str, str], schema: Dict[str, dict]) -> Optional[Tuple[str, str]]:
+        """'o.Customer_id' or 'Customer_id' -> (table key, column key)"""
+        ident = ident.lower()
+        if "." in ident:
+            qualifier, column = ident.split(".", 1)
+            table = aliases.get(qualifier)
+            if table and column in schema[table]["columns"]:
+                return table, column
+            return None
+        owners = {t for t in set(aliases.values()) if ident in schema[t]["columns"]}
+        return (owners.pop(), ident) if len(owners) == 1 else None
+
+    def analyze_query(self, sql: str) -> dict:
+        """Plan, scanned large tables and candidate (table, column) pairs for one query"""
+        with get_db(self.db_path).connection(read_only=True) as conn:
+            if self._schema is None:
+                self._schema = self._load_schema(conn)
+            # Parameterized queries are planned with NULLs bound to their "?" placeholders
+            placeholders = re.sub(r"'[^']*'", "", sql).count("?")
+            plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, [None] * placeholders).fetchall()]
+        schema = self._schema
+        aliases = sql_table_aliases(sql, schema)
+
+        scanned = set()
+        for step in plan:
+            match = re.match(r"SCAN (?:TABLE )?(\w+)(?: AS (\w+))?", step)
+            if match and "COVERING INDEX" not in step:
+                table = aliases.get((match.group(2) or match.group(1)).lower())
+                if table:
+                    scanned.add(table)
+        large_scans = sorted(t for t in scanned if schema[t]["rows"] >= self.min_rows)
+
+        candidates = OrderedDict()
+        ident = r"[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)?"
+        for match in re.finditer(rf"({ident})\s*(=|<=|>=|<|>|\bIN\b|\bLIKE\b|\bBETWEEN\b)\s*({ident}|'[^']*'|-?\d+(?:\.\d+)?|\?|\()", sql, re.I):
+            left, right = match.group(1), match.group(3)
+            left_col = self._resolve(left, aliases, schema)
+            right_col = self._resolve(right, aliases, schema) if re.match(ident, right) and not right.isdigit() else None
+            if left_col and right_col:
+                for table, column in (left_col, right_col):
+                    candidates.setdefault((table, column), "join")
+            elif left_col and match.group(2).upper() != "LIKE":  # LIKE '%x%' cannot use a b-tree index
+                kind = "filter" if match.group(2) == "=" or match.group(2).upper() == "IN" else "range"
+                candidates.setdefault(left_col, kind)
+
+        missing = [
+            (table, schema[table]["columns"][column], kind)
+            for (table, column), kind in candidates.items()
+            if schema[table]["rows"] >= self.min_rows and column not in schema[table]["indexed"]
+        ]
+        return {
+            "sql": sql,
+            "plan": plan,
+            "large_scans": [schema[t]["name"] for t in large_scans],
+            "missing": [(schema[t]["name"], c, k) for t, c, k in missing] if large_scans else []
+        }
+
+    def advise(self, queries: Iterable[str]) -> Tuple[List[dict], List[IndexProposal]]:
+        """Analyze queries (duplicates count as executions) and rank index proposals"""
+        counts = Counter(" ".join(q.split()) for q in queries if q and q.strip())
+        reports, proposals = [], OrderedDict()
+        for sql, executions in counts.most_common():
+            try:
+                report = self.analyze_query(sql)
+            except Exception as e:
+                reports.append({"sql": sql, "error": str(e), "executions": executions})
+                continue
+            report["executions"] = executions
+            reports.append(report)
+            for table, column, kind in report["missing"]:
+                proposal = proposals.setdefault((table, column), IndexProposal(table, (column,)))
+                proposal.queries += 1
+                proposal.executions += executions
+                proposal.reasons.add(kind)
+        ranked = sorted(proposals.values(), key=lambda p: (-p.executions, -p.queries, p.name))
+        return reports, ranked
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+LEXICAL_NAME = "lexical.json"
+LEXICAL_VERSION = 1
+
+# Row documents keep their columns in metadata["data"]; these hold the name of the entity
+NAME_COLUMNS = ("Name_Product", "Name_Store", "Name_Cat")
+
+# Question and function syllables; they are left out of the unigrams (bigrams keep them)
+STOPWORDS = {
+    "có", "không", "nào", "gì", "là", "của", "và", "những", "các", "cho", "tôi", "bạn", "với", "bao", "nhiêu",
+    "thì", "được", "món", "nhé", "ạ", "ơi", "hãy", "mấy", "ở", "đâu", "này", "đó", "một", "muốn", "cần", "em", "anh", "chị"
+}
+
+_WORD = re.compile(r"\w+")
+_THOUSANDS = re.compile(r"(?<=\d)[.,](?=\d{3}(?!\d))")
+_DIGIT_LETTER = re.compile(r"(?<=\d)(?=[^\W\d_])|(?<=[^\W\d_])(?=\d)")
+
+
+def fold(text: str) -> str:
+    """Strip Vietnamese diacritics ("cà phê" -> "ca phe") for customers typing without accents"""
+    text = unicodedata.normalize("NFD", text).replace("đ", "d").replace("Đ", "D")
+    return "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+
+
+def syllables(text: str) -> List[str]:
+    """Lower-case syllables; thousands separators are dropped so prices match the stored numbers.
+
+    >>> syllables("24.000đ")
+    ['24000', 'đ']
+    >>> syllables("Giá 1.250.000đ, 24.000 đ hay 3,5kg?")
+    ['giá', '1250000', 'đ', '24000', 'đ', 'hay', '3', '5', 'kg']
+    """
+    text = unicodedata.normalize("NFC", text).lower()
+    text = _DIGIT_LETTER.sub(" ", _THOUSANDS.sub("", text))
+    return _WORD.findall(text)
+
+
+def tokenize(text: str) -> List[str]:
+    """Syllables and syllable bigrams, each also without diacritics when that differs.
+
+    Vietnamese words are mostly two syllables ("cửa hàng"), so bigrams stand in for word
+    segmentation; the folded copies let "ca phe sua" match "cà phê sữa".
+    """
+    words = syllables(text)
+    tokens = [word for word in words if word not in STOPWORDS] + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    return tokens + [folded for folded, token in ((fold(t), t) for t in tokens) if folded != token]
+
+
+def name_key(text: str) -> str:
+    return " ".join(fold(word) for word in syllables(text))
+
+
+def document_name(metadata: Dict[str, Any]) -> Optional[str]:
+    if metadata.get("name"):
+        return str(metadata["name"])
+    data = metadata.get("data") or {}
+    return next((str(data[col]) for col in NAME_COLUMNS if data.get(col)), None)
+
+
+def manifest_digest(manifest: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Fingerprint of the documents in a store's manifest; a lexical index saved for another one is rebuilt"""
+    if not manifest:
+        return None
+    entries = sorted((key, entry.get("hash", "")) for key, entry in manifest.get("documents", {}).items())
+    return hashlib.sha256(json.dumps(entries).encode("utf-8")).hexdigest()[:32]
+
+
+class LexicalIndex:
+    """In-memory BM25 inverted index over the documents of one vector store.
+
+    Keys are docstore ids, so hits resolve to the same Document objects the FAISS store returns.
+    Document names (metadata "name") are also kept in a folded-name table for exact-name lookups
+    that need no embedding at all.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids: List[str] = []
+        self.lengths: List[int] = []
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.names: Dict[str, List[str]] = {}
+        self.max_name_words = 0
+        self.digest: Optional[str] = None
+
+    @classmethod
+    def from_docstore(cls, docstore, digest: Optional[str] = None) -> "LexicalIndex":
+        index = cls()
+        for doc_id, doc in docstore._dict.items():
+            index.add(doc_id, doc.page_content, document_name(doc.metadata))
+        index.digest = digest
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, doc_id: str, text: str, name: Optional[str] = None):
+        position = len(self.ids)
+        tokens = tokenize(text)
+        self.ids.append(doc_id)
+        self.lengths.append(len(tokens))
+        for token, count in Counter(tokens).items():
+            self.postings.setdefault(token, {})[position] = count
+        if name:
+            key = name_key(name)
+            if key:
+                self.names.setdefault(key, []).append(doc_id)
+                self.max_name_words = max(self.max_name_words, len(key.split()))
+
+    def search(self, query: str, k: int = 20) -> List[Tuple[str, float]]:
+        """(doc id, BM25 score) of the k best matching documents"""
+        if not self.ids:
+            return []
+        n = len(self.ids)
+        avg_length = sum(self.lengths) / n
+        scores: Dict[int, float] = {}
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for position, tf in posting.items():
+                norm = tf + self.k1 * (1 - self.b + self.b * self.lengths[position] / avg_length)
+                scores[position] = scores.get(position, 0.0) + idf * tf * (self.k1 + 1) / norm
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.ids[position], score) for position, score in best]
+
+    def exact_name(self, query: str) -> List[str]:
+        """Documents whose name is the whole query (ignoring case, diacritics and punctuation)"""
+        return list(self.names.get(name_key(query), []))
+
+    def names_in(self, query: str) -> List[str]:
+        """Documents whose name (two syllables or more) appears in the query, longest names first"""
+        words = name_key(query).split()
+        found, covered = [], set()
+        for size in range(min(self.max_name_words, len(words)), 1, -1):
+            for start in range(len(words) - size + 1):
+                span = range(start, start + size)
+                if covered.intersection(span):
+                    continue
+                ids = self.names.get(" ".join(words[start:start + size]))
+                if ids:
+                    found.extend(ids)
+                    covered.update(span)
+        return found
+
+    def save(self, path: str):
+        data = {
+            "version": LEXICAL_VERSION, "digest": self.digest, "k1": self.k1, "b": self.b,
+            "ids": self.ids, "lengths": self.lengths, "names": self.names,
+            "postings": {token: [[p, tf] for p, tf in posting.items()] for token, posting in self.postings.items()}
+        }
+        file_path = os.path.join(path, LEXICAL_NAME)
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, file_path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["LexicalIndex"]:
+        file_path = os.path.join(path, LEXICAL_NAME)
+        if not os.path.exists(file_path):
+            return None
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") != LEXICAL_VERSION:
+                return None
+            index = cls(data["k1"], data["b"])
+            index.ids, index.lengths, index.names = data["ids"], data["lengths"], data["names"]
+            index.postings = {token: {p: tf for p, tf in posting} for token, posting in data["postings"].items()}
+            index.max_name_words = max((len(name.split()) for name in index.names), default=0)
+            index.digest = data.get("digest")
+            return index
+        except Exception as e:
+            print(f"Error reading {file_path}: {e}")
+            return None
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Fuse ranked id lists: each id scores sum(1 / (k + rank)) over the lists it appears in"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,63 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+
+class PartitionSelector:
+    """Chooses which partitions (one per document source) of the row vector store a question searches.
+
+    Partitions built from a table whose name, columns or keywords appear in the question
+    (SchemaCache.matched_tables) are always searched; partition_tables maps entity partitions to the
+    tables they join, any other partition is a table of its own. Remaining slots up to max_partitions go to the partitions whose centroid is
+    closest to the question embedding, so a question about opening hours stays in Store and never
+    scans the order lines. Centroids and the question vector come centered and unit-length from
+    PartitionedVectorStore, so the score is a plain dot product.
+    """
+
+    def __init__(self, schema_cache=None, max_partitions: int = 2,
+                 partition_tables: Optional[Dict[str, Iterable[str]]] = None):
+        self.schema_cache = schema_cache
+        self.max_partitions = max_partitions
+        self.partition_tables = {name: set(tables) for name, tables in (partition_tables or {}).items()}
+        self.selections = 0
+        self.keyword_picks = 0
+        self.centroid_picks = 0
+        self.searched = Counter()
+
+    def select(self, query: str, vector: Optional[np.ndarray], centroids: Dict[str, Optional[np.ndarray]]) -> List[str]:
+        available = list(centroids)
+        matched = []
+        if self.schema_cache is not None:
+            try:
+                tables = self.schema_cache.matched_tables(query)
+                matched = [name for name in available if self.partition_tables.get(name, {name}) & tables]
+            except Exception as e:
+                print(f"Error matching partitions by keyword: {e}")
+
+        slots = max(0, self.max_partitions - len(matched))
+        ranked = []
+        if slots and vector is not None:
+            query_vector = np.asarray(vector, dtype=np.float32)
+            scores = {name: float(centroid @ query_vector) for name, centroid in centroids.items()
+                      if centroid is not None and name not in matched}
+            ranked = sorted(scores, key=scores.get, reverse=True)[:slots]
+
+        selected = matched + ranked
+        if not selected:
+            # No keyword hit and no centroid to compare with: search everything
+            selected = available
+        self.selections += 1
+        self.keyword_picks += len(matched)
+        self.centroid_picks += len(ranked)
+        self.searched.update(selected)
+        return selected
+
+    def stats(self) -> dict:
+        return {
+            "selections": self.selections,
+            "keyword_picks": self.keyword_picks,
+            "centroid_picks": self.centroid_picks,
+            "avg_partitions": sum(self.searched.values()) / self.selections if self.selections else 0.0,
+            "searched": dict(self.searched)
+        }
@@ -43,7 +43,7 @@ class PromptManager:
         user_name = user_info.get('name', 'Khách hàng ẩn danh') if user_info else 'Khách hàng ẩn danh'
         user_info_text = f"Thông tin người dùng: {user_info}" if user_info else ""
         purchase_history_text = "\nLịch sử mua hàng gần đây:\n" + "\n".join(
-            [f"- {item['date']}: {item['product']} (SL: {item['quantity']}, Giá: {item['price']}đ, Đánh giá: {item['rate']}⭐)"
+            [f"- {item['date']}: {item['product']} ({item['prep']}, SL: {item['quantity']}, Giá: {item['price']}đ)"
              for item in purchase_history]) if purchase_history else ""
         
         return f"""
@@ -93,7 +93,7 @@ class PromptManager:
         user_name = user_info.get('name', 'Khách hàng ẩn danh') if user_info else 'Khách hàng ẩn danh'
         user_info_text = f"Thông tin người dùng: {user_info}" if user_info else ""
         purchase_history_text = "\nLịch sử mua hàng gần đây:\n" + "\n".join(
-            [f"- {item['date']}: {item['product']} (SL: {item['quantity']}, Giá: {item['price']}đ, Đánh giá: {item['rate']}⭐)"
+            [f"- {item['date']}: {item['product']} ({item['prep']}, SL: {item['quantity']}, Giá: {item['price']}đ)"
              for item in purchase_history]) if purchase_history else ""
 
         return f"""
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Labeled example queries for the nearest-centroid router.
+# "sql": needs exact data, calculations, filtering or aggregation over the database.
+# "vector": descriptive / semantic questions answered from the vector store.
+ROUTER_EXAMPLES: Dict[str, List[str]] = {
+    "sql": [
+        "Tính tổng doanh thu tháng 5",
+        "Liệt kê 3 sản phẩm bán chạy nhất tuần trước",
+        "Có bao nhiêu đơn hàng được giao trong ngày hôm qua?",
+        "Cho tôi danh sách các loại trà sữa giá dưới 50 nghìn đồng",
+        "So sánh doanh số giữa chi nhánh A và B",
+        "Mặt hàng nào được bán nhiều nhất?",
+        "Món nào bán chạy nhất?",
+        "Cà phê nào có giá dưới 30000?",
+        "Đồ uống nào có lượng calo thấp nhất?",
+        "Có bao nhiêu loại đồ uống trong danh mục Coffee?",
+        "Giá trung bình của các món Frappuccino là bao nhiêu?",
+        "Liệt kê các món có caffeine trên 100mg",
+        "Tôi đã mua bao nhiêu đơn hàng?",
+        "Tổng số tiền tôi đã chi là bao nhiêu?",
+        "Sắp xếp các món theo giá từ thấp đến cao",
+        "Món nào rẻ nhất trong cửa hàng?",
+        "Đếm số khách hàng đã đặt hàng tại Store 1",
+        "Những món nào có đường dưới 10g?",
+        "Size Grande của Caffè Latte giá bao nhiêu?",
+        "Top 5 đồ uống được đánh giá cao nhất",
+    ],
+    "vector": [
+        "Trà sữa trân châu đường đen có vị như thế nào?",
+        "Cửa hàng mình có chỗ để xe máy không?",
+        "Giải thích cách pha cà phê phin",
+        "Cho tôi gợi ý đồ uống giải nhiệt mùa hè",
+        "Thành phần dinh dưỡng của món Caffè Mocha là gì?",
+        "Giờ mở cửa của chi nhánh Store 2?",
+        "Địa chỉ cửa hàng ở đâu?",
+        "Caffè Latte là gì?",
+        "Món nào hợp với người thích vị ngọt?",
+        "Tư vấn cho tôi một món ít caffeine để uống buổi tối",
+        "Danh mục Classic Espresso Drinks gồm những gì?",
+        "Mô tả món Brewed Coffee",
+        "Tôi nên uống gì khi trời lạnh?",
+        "Bạn có thể làm gì?",
+        "Bạn là ai?",
+        "Hôm nay tôi thấy hơi mệt",
+        "Số điện thoại của cửa hàng là gì?",
+        "Frappuccino khác gì với cà phê đá xay thông thường?",
+        "Gợi ý món phù hợp với sở thích của tôi",
+        "Kể chuyện cười đi",
+    ],
+}
+
+# Short social messages answered without any model call
+GREETING_PATTERNS = [
+    r"(xin )?ch[aà]o( (bạn|shop|em|anh|chị|ad|admin|mọi người))?",
+    r"(hello|hi|hey|alo)( (bạn|shop|em|there))?",
+    r"(good )?(morning|afternoon|evening)",
+]
+THANKS_PATTERNS = [
+    r"(c[aả]m ơn|cám ơn|thank you|thanks|thank|tks|thx)( (bạn|shop|em|nhé|nha|nhiều|rất nhiều|so much))*",
+    r"(ok|oke|okay|được rồi|tuyệt|tuyệt vời)( (cảm ơn|nhé|nha))*",
+]
+GOODBYE_PATTERNS = [
+    r"(tạm biệt|bye|goodbye|hẹn gặp lại)( (bạn|shop|nhé|nha))*",
+]
+
+SOCIAL_REPLIES = {
+    "greeting": "Xin chào{name}! Mình có thể giúp gì cho bạn hôm nay? Bạn có thể hỏi về đồ uống, giá cả hoặc cửa hàng nhé.",
+    "thanks": "Không có gì{name}! Nếu cần thêm thông tin gì, bạn cứ hỏi mình nhé.",
+    "goodbye": "Tạm biệt{name}! Hẹn gặp lại bạn lần sau.",
+}
+
+
+@dataclass
+class RouteDecision:
+    """Routing outcome for one query"""
+    route: str          # "sql", "vector", "greeting", "thanks" or "goodbye"
+    confidence: float   # centroid margin for the classifier, 1.0 for fast-path matches
+    source: str         # "fast_path", "classifier" or "uncertain" (caller should fall back to the LLM)
+    elapsed_ms: float = 0.0
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFC", text).lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+class QueryRouter:
+    """Chooses SQL vs vector answering locally, with a nearest-centroid classifier over query embeddings.
+
+    Centroids are computed from ROUTER_EXAMPLES after centering on the mean example embedding (mean-pooled
+    PhoBERT vectors all point in a similar direction, so raw cosine barely separates classes). They are
+    cached on disk, keyed by the embedding namespace and the examples.
+    """
+
+    def __init__(self, embeddings, namespace: str, min_margin: float = 0.05,
+                 cache_path: Optional[str] = None, examples: Optional[Dict[str, List[str]]] = None):
+        self.embeddings = embeddings
+        self.namespace = namespace
+        self.min_margin = min_margin
+        self.cache_path = cache_path
+        self.examples = examples or ROUTER_EXAMPLES
+        self._fast_paths = [
+            (route, re.compile(rf"^(?:{'|'.join(patterns)})$"))
+            for route, patterns in (("greeting", GREETING_PATTERNS), ("thanks", THANKS_PATTERNS), ("goodbye", GOODBYE_PATTERNS))
+        ]
+        self.labels: List[str] = sorted(self.examples)
+        self.center, self.centroids = self._fit()
+        self.counts: Dict[str, int] = {}
+
+    def _cache_key(self) -> str:
+        payload = json.dumps({"namespace": self.namespace, "examples": self.examples}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _fit(self):
+        key = self._cache_key()
+        if self.cache_path and os.path.exists(self.cache_path):
+            try:
+                cached = np.load(self.cache_path, allow_pickle=False)
+                if str(cached["key"]) == key:
+                    return cached["center"], cached["centroids"]
+            except Exception as e:
+                print(f"Error loading router centroids: {e}. Recomputing.")
+
+        texts, labels = [], []
+        for label in self.labels:
+            texts.extend(self.examples[label])
+            labels.extend([label] * len(self.examples[label]))
+        vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        center = vectors.mean(axis=0)
+        vectors = self._unit(vectors - center)
+        centroids = np.stack([
+            self._unit(vectors[[i for i, l in enumerate(labels) if l == label]].mean(axis=0))
+            for label in self.labels
+        ])
+
+        if self.cache_path:
+            try:
+                np.savez(self.cache_path, key=np.array(key), center=center, centroids=centroids)
+            except Exception as e:
+                print(f"Error saving router centroids: {e}")
+        print(f"Query router fitted on {len(texts)} examples")
+        return center, centroids
+
+    @staticmethod
+    def _unit(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    @staticmethod
+    def social_reply(route: str, user_info: Optional[dict] = None) -> str:
+        """Canned reply for a fast-path route, addressed by name when the user is known"""
+        name = f" {user_info['name']}" if user_info and user_info.get("name") else ""
+        return SOCIAL_REPLIES[route].format(name=name)
+
+    def fast_path(self, query: str) -> Optional[str]:
+        """Returns "greeting", "thanks" or "goodbye" for purely social messages, else None"""
+        normalized = _normalize(query)
+        for route, pattern in self._fast_paths:
+            if pattern.match(normalized):
+                return route
+        return None
+
+    def classify(self, query: str):
+        """Returns (label, margin between the best and second-best centroid similarity)"""
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        scores = self.centroids @ self._unit(vector - self.center)
+        order = np.argsort(-scores)
+        margin = float(scores[order[0]] - scores[order[1]]) if len(order) > 1 else 1.0
+        return self.labels[order[0]], margin
+
+    def route(self, query: str) -> RouteDecision:
+        start = time.perf_counter()
+        fast = self.fast_path(query)
+        if fast is not None:
+            decision = RouteDecision(fast, 1.0, "fast_path")
+        else:
+            label, margin = self.classify(query)
+            decision = RouteDecision(label, margin, "classifier" if margin >= self.min_margin else "uncertain")
+        decision.elapsed_ms = (time.perf_counter() - start) * 1000
+
+        counter = f"{decision.source}:{decision.route}"
+        self.counts[counter] = self.counts.get(counter, 0) + 1
+        return decision
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counts)
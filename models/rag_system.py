@@ -1,52 +1,254 @@
-from typing import List
+from typing import List, Optional
 from langchain_community.vectorstores import FAISS
 from langchain_google_genai import ChatGoogleGenerativeAI
 import os
 
-import sqlite3
 import streamlit as st
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.embeddings import Embeddings 
 
 from transformers import AutoModel, AutoTokenizer
 import torch
+import numpy as np
 from config import Config
+from db import get_db
 from utils import (
-    load_table_data,
+    ENTITY_SOURCES,
+    load_vector_documents,
+    parse_document_sources,
+    load_product_descriptions,
     execute_sql_query,
     format_sql_results,
-    validate_sql_query,
+    check_sql_query,
     get_purchase_history
 )
 from .chat_history import ChatHistory
 from .prompts import PromptManager
+from .embedding_cache import QueryEmbeddingCache
+from .query_router import QueryRouter
+from .schema_cache import SchemaCache
+from .sql_cache import SQLPlanCache
+from .index_advisor import record_sql
+from .vector_store import PartitionedStoreSync, PartitionedVectorStore, VectorStoreSync
+from .hybrid_search import HybridRetriever
+from .faiss_index import IndexSpec
+from .partition_selector import PartitionSelector
 class PhoBERTEmbeddings(Embeddings):
-    def __init__(self, model_name: str = "vinai/phobert-base"):
+    # Tensor type handed to _encode; subclasses that don't run torch override it
+    return_tensors = "pt"
+
+    def __init__(self, model_name: str = "vinai/phobert-base", batch_size: int = 32, max_batch_tokens: int = 8192,
+                 query_cache: Optional[QueryEmbeddingCache] = None):
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModel.from_pretrained(model_name)
         # Set a default max length
         self.max_length = 256 
+        # batch_size <= 1 keeps the original one-forward-pass-per-text path
+        self.batch_size = batch_size
+        # Upper bound on padded tokens (rows * longest row) per forward pass
+        self.max_batch_tokens = max_batch_tokens
+        self.query_cache = query_cache
+        self._load_model(model_name)
+
+    def _load_model(self, model_name: str):
+        """Load what _encode runs; the tokenizer and batching setup above are shared by every backend"""
+        self.model = AutoModel.from_pretrained(model_name)
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.batch_size <= 1:
+            return self._embed_documents_sequential(texts)
+        return self._embed_documents_batched(texts)
+
+    def _embed_documents_sequential(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts one forward pass at a time"""
         embeddings = []
         for text in texts:
             # Add max_length to tokenizer call
-            inputs = self.tokenizer(text, return_tensors="pt", truncation=True, padding=True, max_length=self.max_length)
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-            # Ensure output is correctly handled, even if sequence length is 1 after mean
-            mean_emb = outputs.last_hidden_state.mean(dim=1).squeeze(0).numpy() 
+            inputs = self.tokenizer(text, return_tensors=self.return_tensors, truncation=True, padding=True, max_length=self.max_length)
+            mean_emb = self._encode(inputs)[0]
             embeddings.append(mean_emb.tolist())
         return embeddings
 
-    def embed_query(self, text: str) -> List[float]:
-        # Add max_length to tokenizer call
-        inputs = self.tokenizer(text, return_tensors="pt", truncation=True, padding=True, max_length=self.max_length)
+    def _embed_documents_batched(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts in padded batches of similar token length"""
+        if not texts:
+            return []
+
+        # Tokenize once without padding, then sort by length so each batch pads as little as possible
+        encodings = self.tokenizer(list(texts), truncation=True, max_length=self.max_length)
+        lengths = [len(ids) for ids in encodings["input_ids"]]
+        order = sorted(range(len(texts)), key=lambda i: lengths[i])
+
+        embeddings: List[List[float]] = [None] * len(texts)
+        for batch in self._length_buckets(order, lengths):
+            inputs = self.tokenizer.pad(
+                {
+                    "input_ids": [encodings["input_ids"][i] for i in batch],
+                    "attention_mask": [encodings["attention_mask"][i] for i in batch],
+                },
+                padding=True,
+                return_tensors=self.return_tensors
+            )
+            pooled = self._encode(inputs)
+            for i, emb in zip(batch, pooled):
+                embeddings[i] = emb.tolist()
+        return embeddings
+
+    def _length_buckets(self, order: List[int], lengths: List[int]) -> List[List[int]]:
+        """Pack length-sorted indices into batches bounded by batch_size and max_batch_tokens"""
+        batches = []
+        current = []
+        for i in order:
+            # order is ascending, so lengths[i] is the padded length of the batch if i joins it
+            if current and (len(current) >= self.batch_size or (len(current) + 1) * lengths[i] > self.max_batch_tokens):
+                batches.append(current)
+                current = []
+            current.append(i)
+        if current:
+            batches.append(current)
+        return batches
+
+    def _encode(self, inputs) -> np.ndarray:
+        """Run one forward pass and return attention-mask-aware mean pooled embeddings"""
         with torch.no_grad():
             outputs = self.model(**inputs)
-        # Ensure output is correctly handled
-        mean_emb = outputs.last_hidden_state.mean(dim=1).squeeze(0).numpy()
-        return mean_emb.tolist()
+        mask = inputs["attention_mask"].unsqueeze(-1).to(outputs.last_hidden_state.dtype)
+        summed = (outputs.last_hidden_state * mask).sum(dim=1)
+        counts = mask.sum(dim=1).clamp(min=1)
+        return (summed / counts).numpy()
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.query_cache is not None:
+            cached = self.query_cache.get(text)
+            if cached is not None:
+                return cached
+
+        # Add max_length to tokenizer call
+        inputs = self.tokenizer(text, return_tensors=self.return_tensors, truncation=True, padding=True, max_length=self.max_length)
+        embedding = self._encode(inputs)[0].tolist()
+
+        if self.query_cache is not None:
+            self.query_cache.put(text, embedding)
+        return embedding
+
+
+class _LastHiddenState(torch.nn.Module):
+    """Export wrapper exposing only last_hidden_state with explicit keyword inputs"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+
+class PhoBERTOnnxEmbeddings(PhoBERTEmbeddings):
+    """PhoBERT embeddings served by ONNX Runtime, optionally int8-quantized"""
+
+    return_tensors = "np"
+
+    def __init__(self, model_name: str = "vinai/phobert-base", model_dir: str = "onnx_models", quantize: bool = True,
+                 intra_op_threads: int = 0, batch_size: int = 32, max_batch_tokens: int = 8192,
+                 query_cache: Optional[QueryEmbeddingCache] = None):
+        self.model_dir = model_dir
+        self.quantize = quantize
+        self.intra_op_threads = intra_op_threads
+        super().__init__(model_name, batch_size=batch_size, max_batch_tokens=max_batch_tokens, query_cache=query_cache)
+
+    def _load_model(self, model_name: str):
+        """Create the ONNX Runtime session (exporting the model first if needed) instead of the torch model"""
+        import onnxruntime as ort
+
+        model_path = self._ensure_onnx_model(model_name, self.model_dir, self.quantize)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = self.intra_op_threads or os.cpu_count() or 1
+        options.inter_op_num_threads = 1
+        # Don't busy-wait between calls; the web server shares these cores
+        options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        print(f"ONNX embedder loaded from {model_path} ({options.intra_op_num_threads} threads)")
+
+    def _ensure_onnx_model(self, model_name: str, model_dir: str, quantize: bool) -> str:
+        """Export the model to ONNX (and quantize it) the first time, then reuse the files"""
+        os.makedirs(model_dir, exist_ok=True)
+        base_name = model_name.replace("/", "__")
+        fp32_path = os.path.join(model_dir, f"{base_name}.onnx")
+        int8_path = os.path.join(model_dir, f"{base_name}.int8.onnx")
+
+        if not os.path.exists(fp32_path):
+            print(f"Exporting {model_name} to ONNX at {fp32_path}")
+            model = AutoModel.from_pretrained(model_name)
+            model.eval()
+            dummy = self.tokenizer("xin chào", return_tensors="pt")
+            tmp_path = fp32_path + ".tmp"
+            with torch.no_grad():
+                torch.onnx.export(
+                    _LastHiddenState(model).eval(),
+                    (dummy["input_ids"], dummy["attention_mask"]),
+                    tmp_path,
+                    input_names=["input_ids", "attention_mask"],
+                    output_names=["last_hidden_state"],
+                    dynamic_axes={
+                        "input_ids": {0: "batch", 1: "sequence"},
+                        "attention_mask": {0: "batch", 1: "sequence"},
+                        "last_hidden_state": {0: "batch", 1: "sequence"}
+                    },
+                    opset_version=14,
+                    dynamo=False
+                )
+            os.replace(tmp_path, fp32_path)
+            del model
+
+        if not quantize:
+            return fp32_path
+
+        if not os.path.exists(int8_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            print(f"Quantizing {fp32_path} to int8")
+            tmp_path = int8_path + ".tmp"
+            quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+            os.replace(tmp_path, int8_path)
+        return int8_path
+
+    def _encode(self, inputs) -> np.ndarray:
+        """Run the ONNX session and return attention-mask-aware mean pooled embeddings"""
+        feeds = {
+            "input_ids": np.asarray(inputs["input_ids"], dtype=np.int64),
+            "attention_mask": np.asarray(inputs["attention_mask"], dtype=np.int64)
+        }
+        hidden = self.session.run(["last_hidden_state"], feeds)[0]
+        mask = feeds["attention_mask"][..., None].astype(hidden.dtype)
+        return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1)
+
+
+def create_embeddings(config: Config, query_cache: Optional[QueryEmbeddingCache] = None) -> PhoBERTEmbeddings:
+    """Embedder for the configured backend ("torch" or "onnx"); also used by the build_index workers"""
+    if config.embedding_backend == "onnx":
+        return PhoBERTOnnxEmbeddings(
+            config.embedding_model,
+            model_dir=config.onnx_model_dir,
+            quantize=config.onnx_quantize,
+            intra_op_threads=config.onnx_intra_op_threads,
+            batch_size=config.embedding_batch_size,
+            max_batch_tokens=config.embedding_max_batch_tokens,
+            query_cache=query_cache
+        )
+    return PhoBERTEmbeddings(
+        config.embedding_model,
+        batch_size=config.embedding_batch_size,
+        max_batch_tokens=config.embedding_max_batch_tokens,
+        query_cache=query_cache
+    )
+
+
+def embedding_namespace(config: Config) -> str:
+    """Identifies the vectors an embedder produces; cached vectors are only valid within one namespace"""
+    if config.embedding_backend == "onnx":
+        return f"{config.embedding_model}:onnx{'-int8' if config.onnx_quantize else ''}"
+    return config.embedding_model
 
 
 class OptimizedRAGSystem:
@@ -57,7 +259,7 @@ class OptimizedRAGSystem:
     
     def _initialize_components(self):
         """Khởi tạo các thành phần chính"""
-        self.embeddings = PhoBERTEmbeddings()
+        self.embeddings = self._create_embeddings()
 
         self.llm = ChatGoogleGenerativeAI(
             model=self.config.llm_model,
@@ -65,96 +267,145 @@ class OptimizedRAGSystem:
             google_api_key=self.config.google_api_key
         )
         
+        self.schema_cache = SchemaCache(self.config.db_path)
+        self.row_store_sync = self._create_row_store_sync()
+        self.hybrid = (HybridRetriever(self.row_store_sync, rrf_k=self.config.hybrid_rrf_k,
+                                       candidates=self.config.hybrid_candidates)
+                       if self.config.hybrid_search else None)
+        self.description_store_sync = VectorStoreSync(
+            self.config.description_vector_store_path, self.embeddings, self._embedding_namespace(),
+            lambda: load_product_descriptions(self.config.db_path), name="Description vector store",
+            index_spec=IndexSpec.from_config(self.config)
+        )
         self.vector_store = self._initialize_vector_store()
         self.description_vector_store = self._initialize_description_vector_store()
+        self.router = self._create_router()
+        self.sql_cache = self._create_sql_cache()
+        self.llm_route_calls = 0
+
+    def _create_row_store_sync(self):
+        """Row store: one index per document source searched through a partition selector, or a single index"""
+        sources = parse_document_sources(self.config.vector_document_sources)
+        load_documents = lambda: load_vector_documents(self.config.db_path, sources)
+        if self.config.vector_store_partitioned:
+            return PartitionedStoreSync(
+                self.config.vector_store_path, self.embeddings, self._embedding_namespace(),
+                load_documents, name="Vector store",
+                index_spec=IndexSpec.from_config(self.config),
+                selector=PartitionSelector(
+                    self.schema_cache, max_partitions=self.config.vector_partitions_max,
+                    partition_tables={name: tables for name, (_, tables) in ENTITY_SOURCES.items()}
+                ),
+                lexical=self.config.hybrid_search
+            )
+        return VectorStoreSync(
+            self.config.vector_store_path, self.embeddings, self._embedding_namespace(),
+            load_documents, name="Vector store",
+            index_spec=IndexSpec.from_config(self.config), lexical=self.config.hybrid_search
+        )
 
-    def _initialize_vector_store(self) -> FAISS:
-        """Load vector store or create new if not found"""
-        if os.path.exists(self.config.vector_store_path):
-            try:
-                return FAISS.load_local(
-                    self.config.vector_store_path,
-                    self.embeddings,
-                    allow_dangerous_deserialization=True
-                )
-            except Exception as e:
-                print(f"Error loading vector store: {e}")
-                return self._create_new_vector_store()
-        return self._create_new_vector_store()
+    def _create_embeddings(self) -> PhoBERTEmbeddings:
+        """Create the embedder for the configured backend ("torch" or "onnx")"""
+        return create_embeddings(self.config, query_cache=self._create_query_cache())
+
+    def _embedding_namespace(self) -> str:
+        """Identifies the vectors an embedder produces; cached vectors are only valid within one namespace"""
+        return embedding_namespace(self.config)
+
+    def _create_query_cache(self) -> Optional[QueryEmbeddingCache]:
+        """Create the query embedding cache, namespaced by embedding model so a model change invalidates it"""
+        if self.config.query_cache_size <= 0 and not self.config.query_cache_dir:
+            return None
+        return QueryEmbeddingCache(
+            namespace=self._embedding_namespace(),
+            max_size=self.config.query_cache_size,
+            disk_dir=self.config.query_cache_dir or None,
+            disk_size=self.config.query_cache_disk_size,
+            ttl=self.config.query_cache_ttl
+        )
 
-    def _create_new_vector_store(self) -> FAISS:
-        """Create a new FAISS vector store"""
+    def _create_router(self) -> Optional[QueryRouter]:
+        """Create the local SQL/vector router; None means every query goes through _needs_calculation"""
+        if not self.config.router_enabled:
+            return None
         try:
-            os.makedirs(self.config.vector_store_path, exist_ok=True)
-            documents = load_table_data(self.config.db_path)
-            if not documents:
-                print("No documents loaded from database")
-                return None
-            texts = [doc["content"] for doc in documents]
-            metadatas = [doc["metadata"] for doc in documents]
-
-            print(f"Creating vector store with {len(texts)} documents")
-            vector_store = FAISS.from_texts(
-                texts=texts,
-                embedding=self.embeddings,
-                metadatas=metadatas
+            return QueryRouter(
+                self.embeddings,
+                namespace=self._embedding_namespace(),
+                min_margin=self.config.router_min_margin,
+                cache_path=self.config.router_cache_path or None
             )
-            vector_store.save_local(self.config.vector_store_path)
-            print("Vector store created and saved successfully")
-            return vector_store
+        except Exception as e:
+            print(f"Error creating query router: {e}. Falling back to LLM routing.")
+            return None
 
+    def _create_sql_cache(self) -> Optional[SQLPlanCache]:
+        """Cache of generated SQL; namespaced by embedding and LLM model since both shape its entries"""
+        if not self.config.sql_cache_dir or self.config.sql_cache_size <= 0:
+            return None
+        try:
+            return SQLPlanCache(
+                self.config.sql_cache_dir,
+                namespace=f"{self._embedding_namespace()}|{self.config.llm_model}",
+                embeddings=self.embeddings,
+                max_size=self.config.sql_cache_size,
+                ttl=self.config.sql_cache_ttl,
+                semantic=self.config.sql_cache_semantic,
+                similarity_threshold=self.config.sql_cache_similarity
+            )
         except Exception as e:
-            print(f"Error creating vector store: {e}")
+            print(f"Error opening SQL plan cache: {e}. Generating SQL for every query.")
             return None
 
+    def get_metrics(self) -> dict:
+        """Runtime counters for the RAG pipeline"""
+        query_cache = self.embeddings.query_cache
+        return {
+            "query_embedding_cache": query_cache.stats() if query_cache is not None else None,
+            "router": {
+                "decisions": self.router.stats() if self.router is not None else None,
+                "llm_fallbacks": self.llm_route_calls
+            },
+            "vector_store_sync": {
+                "vector_store": self.row_store_sync.last_sync,
+                "description_vector_store": self.description_store_sync.last_sync
+            },
+            "vector_partitions": (self.vector_store.stats()
+                                  if isinstance(self.vector_store, PartitionedVectorStore) else None),
+            "hybrid_search": self.hybrid.stats() if self.hybrid is not None else None,
+            "schema_cache": self.schema_cache.stats(),
+            "db_pool": get_db(self.config.db_path).stats(),
+            "sql_plan_cache": self.sql_cache.stats() if self.sql_cache is not None else None
+        }
+
+    def _initialize_vector_store(self):
+        """Load vector store (synced with the database unless VECTOR_STORE_SYNC=off) or create new if not found"""
+        return self._open_store(self.row_store_sync)
+
     def _initialize_description_vector_store(self) -> FAISS:
         """Initialize or create description vector store"""
-        if os.path.exists(self.config.description_vector_store_path):
-            try:
-                return FAISS.load_local(
-                    self.config.description_vector_store_path,
-                    self.embeddings,
-                    allow_dangerous_deserialization=True
-                )
-            except Exception as e:
-                print(f"Error loading description vector store: {e}")
-                return self._create_description_vector_store()
-        return self._create_description_vector_store()
+        return self._open_store(self.description_store_sync)
 
-    def _create_description_vector_store(self) -> FAISS:
-        """Create FAISS vector store for product descriptions"""
+    def _open_store(self, store_sync):
         try:
-            os.makedirs(self.config.description_vector_store_path, exist_ok=True)
-            conn = sqlite3.connect(self.config.db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT Name_Product, Descriptions FROM Product;")
-            products = cursor.fetchall()
-            conn.close()
-
-            if not products:
-                print("No product descriptions found.")
+            if not self.config.vector_store_build_on_start and not store_sync.exists():
+                print(f"{store_sync.name} not found at {store_sync.path}. Build it with: python -m scripts.build_index")
                 return None
-
-            descriptions = [
-                f"{product[1]}" for product in products
-            ]
-            metadatas = [
-                {"name": product[0], "description": product[1]} for product in products
-            ]
-
-            vector_store = FAISS.from_texts(
-                texts=descriptions,
-                embedding=self.embeddings,
-                metadatas=metadatas
-            )
-            vector_store.save_local(self.config.description_vector_store_path)
-            print("Description vector store created and saved successfully.")
-            return vector_store
-
+            if self.config.vector_store_sync == "startup":
+                return store_sync.sync()
+            return store_sync.load() or store_sync.build()
         except Exception as e:
-            print(f"Error creating description vector store: {e}")
+            print(f"Error preparing {store_sync.name}: {e}")
             return None
-   
+
+    def sync_vector_stores(self) -> dict:
+        """Re-embed only rows added or changed since the last sync and drop deleted ones, in both stores"""
+        self.vector_store = self.row_store_sync.sync(self.vector_store) or self.vector_store
+        self.description_vector_store = (
+            self.description_store_sync.sync(self.description_vector_store) or self.description_vector_store
+        )
+        return {"vector_store": self.row_store_sync.last_sync, "description_vector_store": self.description_store_sync.last_sync}
+
     def _needs_calculation(self, query: str, user_key: str) -> bool:
         """Check if query requires calculation using LLM"""
         prompt = f"""
@@ -220,77 +471,14 @@ class OptimizedRAGSystem:
             ]
             return any(keyword in query.lower() for keyword in calculation_keywords)
     
-    def _get_database_schema(self) -> str:
-        """Get database schema information"""
+    def _get_database_schema(self, query: Optional[str] = None) -> str:
+        """Get database schema information (cached until PRAGMA schema_version changes)"""
         try:
-            conn = sqlite3.connect(self.config.db_path)
-            cursor = conn.cursor()
-            
-            # Get all tables
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            tables = cursor.fetchall()
-            
-            schema_info = []
-            for table in tables:
-                table_name = table[0]
-                
-                # Get table schema
-                cursor.execute(f"PRAGMA table_info({table_name})")
-                columns = cursor.fetchall()
-                
-                # Get foreign keys
-                cursor.execute(f"PRAGMA foreign_key_list({table_name})")
-                foreign_keys = cursor.fetchall()
-                
-                # Get indexes (including primary keys)
-                cursor.execute(f"PRAGMA index_list({table_name})")
-                indexes = cursor.fetchall()
-                
-                # Format column information
-                column_info = []
-                for col in columns:
-                    col_name = col[1]
-                    col_type = col[2]
-                    is_pk = col[5] == 1  # Check if column is primary key
-                    pk_info = " (PRIMARY KEY)" if is_pk else ""
-                    column_info.append(f"{col_name} ({col_type}){pk_info}")
-                
-                # Format foreign key information
-                fk_info = []
-                for fk in foreign_keys:
-                    ref_table = fk[2]  # Referenced table
-                    from_col = fk[3]   # Column in this table
-                    to_col = fk[4]     # Column in referenced table
-                    fk_info.append(f"FOREIGN KEY ({from_col}) REFERENCES {ref_table}({to_col})")
-                
-                # Format index information
-                index_info = []
-                for idx in indexes:
-                    idx_name = idx[1]
-                    is_unique = idx[2] == 1
-                    if not idx_name.startswith('sqlite_autoindex'):  # Skip auto-generated indexes
-                        index_info.append(f"{'UNIQUE ' if is_unique else ''}INDEX {idx_name}")
-                
-                # Combine all information
-                table_info = [f"Bảng {table_name}:"]
-                table_info.extend(column_info)
-                if fk_info:
-                    table_info.append("\nKhóa ngoại:")
-                    table_info.extend(fk_info)
-                if index_info:
-                    table_info.append("\nChỉ mục:")
-                    table_info.extend(index_info)
-                
-                schema_info.append("\n".join(table_info))
-            
-            conn.close()
-            return "\n\n".join(schema_info)
-            
+            return self.schema_cache.describe(query, compact=self.config.sql_compact_schema)
         except Exception as e:
             print(f"Error getting database schema: {e}")
             return ""
 
-    
     def _answer_with_vector(self, user_key: str, query: str, user_info: dict, purchase_history: list, is_image_upload: bool = False) -> str:
         """Answer query using vector search, with a special prompt for image uploads"""
         try:
@@ -300,13 +488,18 @@ class OptimizedRAGSystem:
                     return "Không thể tìm kiếm vì vector store mô tả chưa sẵn sàng."
                 vector_store = self.description_vector_store
             else:
+                if not self.vector_store:
+                    return "Không thể tìm kiếm vì vector store chưa sẵn sàng."
                 vector_store = self.vector_store
 
-            # Truy xuất tài liệu liên quan
-            docs = vector_store.similarity_search(
-                query,
-                k=self.config.top_k_results
-            )
+            # Truy xuất tài liệu liên quan (vector + BM25 cho kho dữ liệu chính)
+            if self.hybrid is not None and not is_image_upload:
+                docs = self.hybrid.search(vector_store, query, k=self.config.top_k_results)
+            else:
+                docs = vector_store.similarity_search(
+                    query,
+                    k=self.config.top_k_results
+                )
             if is_image_upload:
                 context = [
                     f"Tên: {doc.metadata['name']}, Mô tả: {doc.page_content}"
@@ -333,30 +526,71 @@ class OptimizedRAGSystem:
             return f"Lỗi khi xử lý câu hỏi: {str(e)}"
 
     
+    def _check_sql(self, sql: str):
+        """Authorizer + query-plan cost gate for generated SQL"""
+        return check_sql_query(
+            self.config.db_path,
+            sql,
+            max_rows=self.config.sql_max_rows,
+            large_table_rows=self.config.sql_large_table_rows,
+            max_scan_rows=self.config.sql_max_scan_rows
+        )
+
     def _answer_with_sql(self, user_key: str, query: str, user_info: dict, purchase_history: list) -> str:
         """Answer query using SQL"""
         try:
-            # 1. Tạo prompt để sinh câu lệnh SQL từ LLM
-            sql_prompt = PromptManager.get_sql_generation_prompt(query, self._get_database_schema())
+            schema_info = self._get_database_schema(query)
+            schema_hash = self.schema_cache.schema_hash
+
+            # 1. Dùng lại câu SQL đã sinh cho câu hỏi giống / gần giống (vẫn phải qua validate)
+            sql_query_string, cache_kind, gate = (None, None, None)
+            if self.sql_cache is not None:
+                sql_query_string, cache_kind = self.sql_cache.get(query, schema_hash)
+                if sql_query_string is not None:
+                    gate = self._check_sql(sql_query_string)
+                    if not gate:
+                        self.sql_cache.discard(sql_query_string)
+                        sql_query_string, cache_kind = (None, None)
+
+            if sql_query_string is not None:
+                print(f"Cached SQL query ({cache_kind}):", sql_query_string)
+            else:
+                # 2. Tạo prompt để sinh câu lệnh SQL từ LLM
+                sql_prompt = PromptManager.get_sql_generation_prompt(query, schema_info)
 
-            # 2. Gọi LLM sinh câu lệnh SQL
-            sql_query_response = self.llm.invoke(sql_prompt)
+                # 3. Gọi LLM sinh câu lệnh SQL
+                sql_query_response = self.llm.invoke(sql_prompt)
 
-            # 3. Lấy đúng phần nội dung SQL (không lấy cả metadata)
-            sql_query_string = sql_query_response.content.strip() if hasattr(sql_query_response, 'content') else str(sql_query_response).strip()
-            print("Generated SQL query:", sql_query_string)
+                # 4. Lấy đúng phần nội dung SQL (không lấy cả metadata)
+                sql_query_string = sql_query_response.content.strip() if hasattr(sql_query_response, 'content') else str(sql_query_response).strip()
+                print("Generated SQL query:", sql_query_string)
 
-            if not validate_sql_query(sql_query_string):
-                return "Xin lỗi, tôi không thể thực hiện truy vấn này vì lý do an toàn hoặc truy vấn không hợp lệ."
+                # Kiểm tra quyền truy cập bảng và chi phí (EXPLAIN QUERY PLAN) trước khi chạy
+                gate = self._check_sql(sql_query_string)
+                if not gate:
+                    return "Xin lỗi, tôi không thể thực hiện truy vấn này vì lý do an toàn hoặc truy vấn không hợp lệ."
 
             # 5. Thực thi câu lệnh SQL
             results = execute_sql_query(
                 self.config.db_path,
-                sql_query_string,
-                self.config.db_timeout
+                gate.query,
+                self.config.db_timeout,
+                max_rows=self.config.sql_max_rows,
+                time_budget_ms=self.config.sql_time_budget_ms,
+                max_bytes=self.config.sql_max_bytes
             )
 
-      
+            if gate.rewritten and results.total_rows >= gate.row_cap:
+                results.total_exact = False
+
+            if results.error is None:
+                record_sql(self.config.sql_log_path, sql_query_string, results.elapsed_ms, results.total_rows,
+                           source=cache_kind or "generated")
+
+            # Only SQL that ran cleanly and produced rows is remembered
+            if self.sql_cache is not None and cache_kind is None and results and results.error is None:
+                self.sql_cache.put(query, schema_hash, sql_query_string)
+
             formatted_results = format_sql_results(results)    
             recent_history = self.chat_history.get_recent_history(user_key)
 
@@ -379,14 +613,25 @@ class OptimizedRAGSystem:
     def answer_query(self, user_key: str, query: str) -> str:
         """Process query and return answer"""
         try:
+            decision = self.router.route(query) if self.router is not None else None
+            if decision is not None and decision.source == "fast_path":
+                # Chào hỏi / cảm ơn: trả lời ngay, không cần LLM
+                response = self.router.social_reply(decision.route, self._get_user_info(user_key))
+                self.chat_history.add_chat(user_key, query, response)
+                return response
+
+            if decision is not None and decision.source == "classifier":
+                needs_sql = decision.route == "sql"
+                print(f"Router decision: {decision.route} (margin {decision.confidence:.3f}, {decision.elapsed_ms:.1f} ms)")
+            else:
+                self.llm_route_calls += 1
+                needs_sql = self._needs_calculation(query, user_key)
+                print(f"LLM decision: {'1' if needs_sql else '0'}")
 
-            needs_sql = self._needs_calculation(query, user_key)
-            print(f"LLM decision: {'1' if needs_sql else '0'}")  
-            
             # Fetch user information and purchase history
             user_info = self._get_user_info(user_key)
             purchase_history = get_purchase_history(user_key)
-            
+
             if needs_sql:
                 response = self._answer_with_sql(user_key, query, user_info, purchase_history)
             else:
@@ -407,20 +652,9 @@ class OptimizedRAGSystem:
             return None
 
         try:
-
-            db_path = os.path.join(os.path.dirname(__file__), '..', 'Database.db')
-            if not os.path.exists(db_path):
-                db_path = os.path.join(os.path.dirname(__file__), 'Database.db')
-                if not os.path.exists(db_path):
-                    print(f"Database file not found at expected locations.")
-                    return None
-
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            query = "SELECT id, name, sex FROM Customers WHERE id = ?"
-            cursor.execute(query, (user_key,))
-            result = cursor.fetchone()
-            conn.close()
+            with get_db(self.config.db_path).connection() as conn:
+                query = "SELECT id, name, sex FROM Customers WHERE id = ?"
+                result = conn.execute(query, (user_key,)).fetchone()
 
             if result:
                 return {"id": result[0], "name": result[1], "sex": result[2]}
@@ -437,17 +671,3 @@ class OptimizedRAGSystem:
             self.chat_history.clear_history(user_key)
         except Exception as e:
             print(f"Error clearing chat history for {user_key}: {e}")
-
-    def _initialize_description_vector_store(self) -> FAISS:
-        """Initialize description vector store if exists, otherwise create it"""
-        if os.path.exists(self.config.description_vector_store_path):
-            try:
-                return FAISS.load_local(
-                    self.config.description_vector_store_path,
-                    self.embeddings,
-                    allow_dangerous_deserialization=True
-                )
-            except Exception as e:
-                print(f"Error loading description vector store: {e}")
-        
-        return self._create_description_vector_store()
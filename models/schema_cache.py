@@ -0,0 +1,161 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import deque
+from typing import Dict, List, Optional, Set
+
+from db import get_db
+from utils import COLUMN_NAME_MAPPING
+
+# Vietnamese words users write for each table (column names are matched separately)
+TABLE_KEYWORDS: Dict[str, List[str]] = {
+    "Categories": ["danh mục", "loại", "nhóm", "category"],
+    "Product": ["sản phẩm", "món", "đồ uống", "thức uống", "nước", "cà phê", "trà", "product", "drink"],
+    "Variant": ["giá", "size", "kích cỡ", "calo", "đường", "caffeine", "protein", "vitamin", "chất xơ",
+                "dinh dưỡng", "bán chạy", "rẻ", "đắt", "price"],
+    "Store": ["cửa hàng", "chi nhánh", "địa chỉ", "giờ mở cửa", "số điện thoại", "store"],
+    "Orders": ["đơn hàng", "đặt hàng", "mua", "doanh thu", "doanh số", "ngày", "tháng", "order"],
+    "Order_detail": ["số lượng", "bán", "doanh thu", "doanh số", "bán chạy", "mua"],
+    "customers": ["khách hàng", "khách", "tôi", "tuổi", "giới tính", "customer"],
+    "Customer_preferences": ["sở thích", "ưa thích", "yêu thích", "giá tối đa"],
+}
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFC", text).lower()
+    return " " + " ".join(re.sub(r"[^\w\s]", " ", text).split()) + " "
+
+
+class SchemaCache:
+    """Database schema text for SQL generation, rebuilt only when PRAGMA schema_version changes"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.version: Optional[int] = None
+        self.tables: Dict[str, dict] = {}
+        self.full_text = ""
+        self.schema_hash = ""
+        self.rebuilds = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        """Re-read the schema if it changed since the last call; one cheap PRAGMA otherwise"""
+        with get_db(self.db_path).connection(read_only=True) as conn:
+            version = conn.execute("PRAGMA schema_version").fetchone()[0]
+            if version == self.version:
+                return
+            self.tables = self._read_tables(conn)
+        self.full_text = "\n\n".join(table["text"] for table in self.tables.values())
+        self.schema_hash = hashlib.sha256(self.full_text.encode("utf-8")).hexdigest()[:16]
+        self.version = version
+        self.rebuilds += 1
+
+    @staticmethod
+    def _read_tables(conn: sqlite3.Connection) -> Dict[str, dict]:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' "
+                       "AND name != 'schema_migrations'")
+        tables = {}
+        for (table_name,) in cursor.fetchall():
+            columns = cursor.execute(f"PRAGMA table_info({table_name})").fetchall()
+            foreign_keys = cursor.execute(f"PRAGMA foreign_key_list({table_name})").fetchall()
+            indexes = cursor.execute(f"PRAGMA index_list({table_name})").fetchall()
+
+            column_info = [f"{col[1]} ({col[2]}){' (PRIMARY KEY)' if col[5] == 1 else ''}" for col in columns]
+            # fk: (id, seq, referenced table, column in this table, column in referenced table, ...)
+            fk_info = [f"FOREIGN KEY ({fk[3]}) REFERENCES {fk[2]}({fk[4]})" for fk in foreign_keys]
+            index_info = [
+                f"{'UNIQUE ' if idx[2] == 1 else ''}INDEX {idx[1]}"
+                for idx in indexes if not idx[1].startswith('sqlite_autoindex')  # Skip auto-generated indexes
+            ]
+
+            table_info = [f"Bảng {table_name}:"]
+            table_info.extend(column_info)
+            if fk_info:
+                table_info.append("\nKhóa ngoại:")
+                table_info.extend(fk_info)
+            if index_info:
+                table_info.append("\nChỉ mục:")
+                table_info.extend(index_info)
+
+            keywords = {table_name.lower()} | {k.lower() for k in TABLE_KEYWORDS.get(table_name, [])}
+            for col in columns:
+                keywords.add(col[1].lower())
+                keywords.update(part for part in col[1].lower().split("_") if len(part) > 2 and part != "id")
+                if col[1] in COLUMN_NAME_MAPPING and not col[1].lower().endswith("id"):
+                    keywords.add(COLUMN_NAME_MAPPING[col[1]].lower())
+
+            tables[table_name] = {
+                "text": "\n".join(table_info),
+                "references": {fk[2] for fk in foreign_keys},
+                "keywords": keywords,
+            }
+        return tables
+
+    def describe(self, query: Optional[str] = None, compact: bool = False) -> str:
+        """Full schema text, or with compact=True only the tables relevant to query plus the tables joining them"""
+        with self._lock:
+            self._refresh()
+            if not compact or not query:
+                return self.full_text
+            selected = self.relevant_tables(query)
+            if not selected:
+                return self.full_text
+            return "\n\n".join(self.tables[name]["text"] for name in self.tables if name in selected)
+
+    def matched_tables(self, query: str) -> Set[str]:
+        """Tables whose name, columns or keywords appear in the query"""
+        with self._lock:
+            self._refresh()
+            return self._matched(query)
+
+    def _matched(self, query: str) -> Set[str]:
+        text = _normalize(query)
+        return {
+            name for name, table in self.tables.items()
+            if any(f" {keyword} " in text for keyword in table["keywords"])
+        }
+
+    def relevant_tables(self, query: str) -> Set[str]:
+        """Tables whose name, columns or keywords appear in the query, connected through foreign keys"""
+        matched = self._matched(query)
+        if len(matched) < 2:
+            return matched
+
+        # Add the tables on the shortest foreign-key path between matched tables so joins stay possible
+        graph: Dict[str, Set[str]] = {name: set() for name in self.tables}
+        for name, table in self.tables.items():
+            for ref in table["references"]:
+                if ref in graph:
+                    graph[name].add(ref)
+                    graph[ref].add(name)
+
+        selected = set(matched)
+        ordered = sorted(matched)
+        for target in ordered[1:]:
+            path = self._shortest_path(graph, ordered[0], target)
+            selected.update(path)
+        return selected
+
+    @staticmethod
+    def _shortest_path(graph: Dict[str, Set[str]], start: str, target: str) -> List[str]:
+        parents = {start: None}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if node == target:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = parents[node]
+                return path
+            for neighbour in sorted(graph[node]):
+                if neighbour not in parents:
+                    parents[neighbour] = node
+                    queue.append(neighbour)
+        return []
+
+    def stats(self) -> dict:
+        return {"schema_version": self.version, "rebuilds": self.rebuilds, "tables": len(self.tables)}
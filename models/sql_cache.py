@@ -0,0 +1,344 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .embedding_cache import normalize_query
+
+
+def normalize_question(text: str) -> str:
+    """Cache key for a question: normalize_query without punctuation"""
+    return " ".join(re.sub(r"[^\w\s]", " ", normalize_query(text)).split())
+
+
+def question_numbers(text: str) -> List[str]:
+    """Numbers in a question; near-duplicate questions must agree on them ("dưới 30000" vs "dưới 50000")"""
+    return [n.replace(",", "").replace(".", "") for n in re.findall(r"\d+(?:[.,]\d+)*", text)]
+
+
+# Labelled question pairs for the semantic-match threshold: pairs that must share SQL, and pairs that
+# must not (no numbers in either, so the "same numbers" guard cannot tell them apart)
+PARAPHRASE_PAIRS: List[Tuple[str, str]] = [
+    ("Món nào bán chạy nhất?", "Sản phẩm nào bán chạy nhất?"),
+    ("Món nào rẻ nhất?", "Đồ uống nào có giá rẻ nhất?"),
+    ("Có bao nhiêu cửa hàng?", "Tổng số cửa hàng là bao nhiêu?"),
+    ("Liệt kê các danh mục sản phẩm", "Cho tôi danh sách các danh mục sản phẩm"),
+    ("Đồ uống nào có nhiều caffeine nhất?", "Món nào chứa nhiều caffeine nhất?"),
+    ("Đồ uống nào ít calo nhất?", "Món nào có lượng calo thấp nhất?"),
+    ("Có bao nhiêu khách hàng?", "Tổng số khách hàng là bao nhiêu?"),
+    ("Có bao nhiêu đơn hàng?", "Tổng cộng có bao nhiêu đơn hàng?"),
+    ("Cửa hàng nào có nhiều đơn hàng nhất?", "Chi nhánh nào có nhiều đơn hàng nhất?"),
+    ("Giá trung bình của các món là bao nhiêu?", "Giá trung bình của đồ uống là bao nhiêu?"),
+    ("Món nào được đánh giá cao nhất?", "Sản phẩm nào có đánh giá cao nhất?"),
+    ("Liệt kê các món trong danh mục Coffee", "Danh mục Coffee có những món nào?"),
+    ("Món nào có nhiều đường nhất?", "Đồ uống nào chứa nhiều đường nhất?"),
+    ("Khách hàng nào mua nhiều nhất?", "Ai là khách hàng mua nhiều nhất?"),
+    ("Tổng doanh thu là bao nhiêu?", "Doanh thu tổng cộng là bao nhiêu?"),
+    ("Các cửa hàng mở cửa lúc mấy giờ?", "Giờ mở cửa của các cửa hàng là mấy giờ?"),
+]
+DISTINCT_PAIRS: List[Tuple[str, str]] = [
+    ("Món nào bán chạy nhất?", "Món nào rẻ nhất?"),
+    ("Món nào bán chạy nhất?", "Món nào đắt nhất?"),
+    ("Món nào rẻ nhất?", "Món nào đắt nhất?"),
+    ("Đồ uống nào ít calo nhất?", "Đồ uống nào nhiều calo nhất?"),
+    ("Đồ uống nào có nhiều caffeine nhất?", "Đồ uống nào có ít caffeine nhất?"),
+    ("Có bao nhiêu cửa hàng?", "Có bao nhiêu khách hàng?"),
+    ("Có bao nhiêu đơn hàng?", "Có bao nhiêu sản phẩm?"),
+    ("Có bao nhiêu khách hàng nam?", "Có bao nhiêu khách hàng nữ?"),
+    ("Món nào có nhiều đường nhất?", "Món nào có nhiều protein nhất?"),
+    ("Khách hàng nào mua nhiều nhất?", "Khách hàng nào mua ít nhất?"),
+    ("Cửa hàng nào có nhiều đơn hàng nhất?", "Cửa hàng nào có ít đơn hàng nhất?"),
+    ("Giá trung bình của các món là bao nhiêu?", "Giá cao nhất của các món là bao nhiêu?"),
+    ("Tổng doanh thu là bao nhiêu?", "Tổng số đơn hàng là bao nhiêu?"),
+    ("Liệt kê các món trong danh mục Coffee", "Liệt kê các món trong danh mục Smoothies"),
+    ("Món nào được đánh giá cao nhất?", "Món nào được đánh giá thấp nhất?"),
+    ("Liệt kê các danh mục sản phẩm", "Liệt kê các cửa hàng"),
+    ("Khách hàng nào lớn tuổi nhất?", "Khách hàng nào trẻ tuổi nhất?"),
+    ("Các cửa hàng mở cửa lúc mấy giờ?", "Số điện thoại của các cửa hàng là gì?"),
+]
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class SQLPlanCache:
+    """Persistent question -> generated SQL cache, invalidated when the schema hash changes.
+
+    Exact hits match the normalized question. With semantic=True, a question can also reuse the SQL of
+    an earlier question that contains the same numbers and whose embedding is close enough. Similarity
+    is cosine after centering on the mean calibration embedding, as in QueryRouter: raw cosine between
+    mean-pooled PhoBERT vectors of unrelated questions is often above 0.95. The threshold is fitted on
+    PARAPHRASE_PAIRS / DISTINCT_PAIRS (just above the closest distinct pair) unless similarity_threshold
+    is given, and semantic matching turns itself off if that threshold keeps too few paraphrases.
+    Entries are kept in LRU order in plans.json, with their question embeddings in plans.npy; both are
+    written every flush_every puts, after flush_interval seconds or at exit.
+    """
+
+    def __init__(self, directory: str, namespace: str, embeddings=None, max_size: int = 500,
+                 ttl: int = 0, semantic: bool = False, similarity_threshold: float = 0.0,
+                 min_paraphrase_recall: float = 0.5, flush_every: int = 16, flush_interval: float = 30.0):
+        self.directory = directory
+        self.namespace = namespace
+        self.embeddings = embeddings
+        self.max_size = max_size
+        self.ttl = ttl
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.plans_path = os.path.join(directory, "plans.json")
+        self.vectors_path = os.path.join(directory, "plans.npy")
+        self.calibration_path = os.path.join(directory, "calibration.npz")
+        self._dirty = 0
+        self._last_flush = time.time()
+
+        self.schema_hash: Optional[str] = None
+        # key -> {"sql", "numbers", "created", "vector"}, least recently used first
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[str] = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+        atexit.register(self.flush)
+
+        self.center: Optional[np.ndarray] = None
+        self.similarity_threshold: Optional[float] = None
+        self.calibration: Dict[str, Any] = {}
+        if semantic and embeddings is not None:
+            try:
+                self._calibrate(similarity_threshold, min_paraphrase_recall)
+            except Exception as e:
+                print(f"Error calibrating SQL plan cache: {e}. Using exact matches only.")
+                self.center = self.similarity_threshold = None
+
+    def _calibrate(self, fixed_threshold: float, min_recall: float):
+        """Center and threshold for semantic matches, cached per embedding namespace and labelled pairs"""
+        key = hashlib.sha256(json.dumps([self.namespace, PARAPHRASE_PAIRS, DISTINCT_PAIRS],
+                                        ensure_ascii=False).encode("utf-8")).hexdigest()
+        cached = None
+        if os.path.exists(self.calibration_path):
+            try:
+                cached = np.load(self.calibration_path, allow_pickle=False)
+                if str(cached["key"]) != key:
+                    cached = None
+            except Exception as e:
+                print(f"Error loading SQL cache calibration: {e}. Recomputing.")
+                cached = None
+        if cached is not None:
+            center, paraphrase, distinct = cached["center"], cached["paraphrase"], cached["distinct"]
+        else:
+            texts = sorted({text for pair in PARAPHRASE_PAIRS + DISTINCT_PAIRS for text in pair})
+            vectors = _unit(np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32))
+            center = vectors.mean(axis=0)
+            centered = dict(zip(texts, _unit(vectors - center)))
+            paraphrase = np.array([float(centered[a] @ centered[b]) for a, b in PARAPHRASE_PAIRS])
+            distinct = np.array([float(centered[a] @ centered[b]) for a, b in DISTINCT_PAIRS])
+            try:
+                np.savez(self.calibration_path, key=np.array(key), center=center,
+                         paraphrase=paraphrase, distinct=distinct)
+            except Exception as e:
+                print(f"Error saving SQL cache calibration: {e}")
+
+        threshold = fixed_threshold if fixed_threshold > 0 else min(float(distinct.max()) + 0.02, 0.999)
+        recall = float((paraphrase >= threshold).mean())
+        self.calibration = {"threshold": threshold, "paraphrase_recall": recall,
+                            "max_distinct": float(distinct.max()), "min_paraphrase": float(paraphrase.min())}
+        if recall < min_recall:
+            print(f"SQL plan cache: centered cosine {threshold:.3f} keeps only {recall:.0%} of labelled paraphrases; "
+                  f"semantic matching disabled")
+            return
+        self.center, self.similarity_threshold = center, threshold
+        print(f"SQL plan cache: semantic threshold {threshold:.3f} (centered cosine), "
+              f"{recall:.0%} of labelled paraphrases matched, closest distinct pair {float(distinct.max()):.3f}")
+
+    def _load(self):
+        if not os.path.exists(self.plans_path):
+            return
+        try:
+            with open(self.plans_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("namespace") != self.namespace:
+                print(f"SQL plan cache at {self.directory} was built for another model. Resetting.")
+                return
+            vectors = np.load(self.vectors_path) if os.path.exists(self.vectors_path) else None
+            self.schema_hash = data.get("schema_hash")
+            now = time.time()
+            for row, entry in enumerate(data.get("entries", [])):
+                if self.ttl and now - entry["created"] > self.ttl:
+                    continue
+                vector = vectors[row] if vectors is not None and row < len(vectors) and entry.get("has_vector") else None
+                self._entries[entry["key"]] = {
+                    "sql": entry["sql"],
+                    "numbers": entry["numbers"],
+                    "created": entry["created"],
+                    "vector": vector
+                }
+        except Exception as e:
+            print(f"Error loading SQL plan cache: {e}. Starting fresh.")
+            self._entries = OrderedDict()
+
+    def _save(self):
+        entries, vectors = [], []
+        for key, entry in self._entries.items():
+            entries.append({
+                "key": key,
+                "sql": entry["sql"],
+                "numbers": entry["numbers"],
+                "created": entry["created"],
+                "has_vector": entry["vector"] is not None
+            })
+            vectors.append(entry["vector"])
+        dim = next((len(v) for v in vectors if v is not None), 0)
+        matrix = np.zeros((len(vectors), dim), dtype=np.float32)
+        for row, vector in enumerate(vectors):
+            if vector is not None:
+                matrix[row] = vector
+
+        tmp_vectors = self.vectors_path + ".tmp.npy"
+        np.save(tmp_vectors, matrix)
+        os.replace(tmp_vectors, self.vectors_path)
+        tmp_plans = self.plans_path + ".tmp"
+        with open(tmp_plans, 'w', encoding='utf-8') as f:
+            json.dump({"namespace": self.namespace, "schema_hash": self.schema_hash, "entries": entries},
+                      f, ensure_ascii=False)
+        os.replace(tmp_plans, self.plans_path)
+        self._dirty = 0
+        self._last_flush = time.time()
+
+    def flush(self):
+        """Write pending changes to plans.json / plans.npy"""
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                self._save()
+            except Exception as e:
+                print(f"Error saving SQL plan cache: {e}")
+
+    def _check_schema(self, schema_hash: str):
+        """Drop every plan generated against another schema"""
+        if schema_hash == self.schema_hash:
+            return
+        if self._entries:
+            print("Database schema changed. Clearing SQL plan cache.")
+            self.invalidations += 1
+        self._entries.clear()
+        self._matrix = None
+        self.schema_hash = schema_hash
+        self._dirty += 1
+
+    def _embed(self, question: str) -> Optional[np.ndarray]:
+        if self.embeddings is None or self.center is None:
+            return None
+        try:
+            vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+            return vector / max(float(np.linalg.norm(vector)), 1e-12)
+        except Exception as e:
+            print(f"Error embedding question for SQL plan cache: {e}")
+            return None
+
+    def _semantic_match(self, question: str, numbers: List[str]) -> Optional[str]:
+        vector = self._embed(question)
+        if vector is None:
+            return None
+        if self._matrix is None:
+            self._matrix_keys = [key for key, entry in self._entries.items() if entry["vector"] is not None]
+            # Centered once per change: cosine without the direction every PhoBERT question vector shares
+            self._matrix = (_unit(np.stack([self._entries[key]["vector"] for key in self._matrix_keys]) - self.center)
+                            if self._matrix_keys else np.zeros((0, len(vector)), dtype=np.float32))
+        if not len(self._matrix_keys):
+            return None
+        scores = self._matrix @ _unit(vector - self.center)
+        for row in np.argsort(-scores):
+            if scores[row] < self.similarity_threshold:
+                break
+            key = self._matrix_keys[row]
+            if key in self._entries and self._entries[key]["numbers"] == numbers:
+                return key
+        return None
+
+    def get(self, question: str, schema_hash: str) -> Tuple[Optional[str], Optional[str]]:
+        """Returns (sql, "exact" | "semantic") on a hit, (None, None) on a miss"""
+        key = normalize_question(question)
+        with self._lock:
+            self._check_schema(schema_hash)
+            kind = "exact"
+            entry = self._entries.get(key)
+            if entry is None:
+                kind = "semantic"
+                match = self._semantic_match(question, question_numbers(question))
+                entry = self._entries.get(match) if match else None
+                key = match
+            if entry is not None and self.ttl and time.time() - entry["created"] > self.ttl:
+                del self._entries[key]
+                self._matrix = None
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None, None
+
+            self._entries.move_to_end(key)
+            if kind == "exact":
+                self.hits += 1
+            else:
+                self.semantic_hits += 1
+            return entry["sql"], kind
+
+    def put(self, question: str, schema_hash: str, sql: str):
+        """Remember SQL that validated and executed successfully for this question"""
+        key = normalize_question(question)
+        vector = self._embed(question)
+        with self._lock:
+            self._check_schema(schema_hash)
+            self._entries[key] = {
+                "sql": sql,
+                "numbers": question_numbers(question),
+                "created": time.time(),
+                "vector": vector
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._matrix = None
+            self._dirty += 1
+            if self._dirty >= self.flush_every or time.time() - self._last_flush >= self.flush_interval:
+                try:
+                    self._save()
+                except Exception as e:
+                    print(f"Error saving SQL plan cache: {e}")
+
+    def discard(self, sql: str):
+        """Forget every cached plan with this SQL, e.g. when it no longer validates"""
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry["sql"] == sql]
+            for key in stale:
+                del self._entries[key]
+            if stale:
+                self._matrix = None
+                self._dirty += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.semantic_hits + self.misses
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "size": len(self._entries),
+            "semantic": self.similarity_threshold is not None,
+            "calibration": self.calibration or None
+        }
@@ -0,0 +1,479 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from langchain_core.documents import Document
+
+from .faiss_index import (IndexSpec, docstore_documents, add_documents, buildable_kind, configure_search, index_kind,
+                          kind_key, make_index, reindex_store, remove_documents, sample_mean, stored_vectors)
+from .lexical_index import LexicalIndex, manifest_digest
+
+MANIFEST_NAME = "manifest.json"
+
+
+def document_hash(content: str, metadata: Dict[str, Any]) -> str:
+    """Content hash of one document; the row position is ignored so deleting other rows changes nothing"""
+    stable = {k: v for k, v in metadata.items() if k != "original_row_index"}
+    payload = json.dumps([content, stable], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+class SavedOnlyEmbeddings(Embeddings):
+    """Stand-in embedder for stores that are built from precomputed vectors and only saved"""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        raise RuntimeError("This store was built from precomputed vectors; load it with a real embedder to search")
+
+    def embed_query(self, text: str) -> List[float]:
+        raise RuntimeError("This store was built from precomputed vectors; load it with a real embedder to search")
+
+
+def store_from_vectors(documents: List[Dict[str, Any]], vectors: np.ndarray, embeddings=None,
+                       index_spec: Optional[IndexSpec] = None) -> FAISS:
+    """FAISS store over already embedded documents, keyed like FAISS.from_texts(ids=keys)"""
+    index = make_index(index_spec or IndexSpec(), vectors)
+    return FAISS(embeddings or SavedOnlyEmbeddings(), index, InMemoryDocstore(docstore_documents(documents)),
+                 {i: doc["key"] for i, doc in enumerate(documents)})
+
+
+def swap_directory(new_path: str, path: str):
+    """Move a finished store from new_path to path; the previous store stays at path.old until the swap is done"""
+    old_path = path + ".old"
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(new_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def recover_swap(path: str):
+    """Put back the previous store if a swap_directory was interrupted between its two renames"""
+    old_path = path + ".old"
+    if os.path.exists(os.path.join(old_path, "index.faiss")) and not os.path.exists(os.path.join(path, "index.faiss")):
+        print(f"Restoring {path} from an interrupted index swap")
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(old_path, path)
+
+
+class VectorStoreSync:
+    """Keeps a saved FAISS store in step with the database without re-embedding unchanged rows.
+
+    manifest.json next to index.faiss maps each document key ("table:pk") to its docstore id and content
+    hash. sync() diffs the documents produced by load_documents against it, deletes removed or changed
+    documents by docstore id and embeds only new or changed ones. A store saved without a manifest is
+    adopted by matching content hashes; a store built with another embedding model is rebuilt, one
+    built with another index type (index_spec) is re-indexed from its stored vectors when it can be.
+    With lexical=True a BM25 index of the same documents is kept in lexical.json (self.lexical).
+    """
+
+    def __init__(self, path: str, embeddings, namespace: str, load_documents: Callable[[], List[Dict[str, Any]]],
+                 name: str = "vector store", index_spec: Optional[IndexSpec] = None, lexical: bool = False):
+        self.path = path
+        self.embeddings = embeddings
+        self.namespace = namespace
+        self.index_spec = index_spec or IndexSpec()
+        self.load_documents = load_documents
+        self.name = name
+        self.manifest_path = os.path.join(path, MANIFEST_NAME)
+        self.last_sync: Dict[str, Any] = {}
+        # Build id of the manifest the in-memory store was loaded from; a different id on disk means
+        # the store was rebuilt by scripts/build_index.py and must be reloaded before syncing
+        self.loaded_build: Optional[str] = None
+        self.lexical_enabled = lexical
+        self.lexical: Optional[LexicalIndex] = None
+
+    def _read_manifest(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.manifest_path):
+            return None
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error reading {self.manifest_path}: {e}")
+            return None
+
+    def _write_manifest(self, store: FAISS, documents: Dict[str, Dict[str, str]], build: Optional[str] = None):
+        # The index type actually built: an ivf_pq spec with too few vectors to train is saved as flat
+        index = kind_key(self.index_spec, index_kind(store.index))
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"namespace": self.namespace, "index": index, "build": build,
+                       "documents": documents}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _refresh_lexical(self, store: Optional[FAISS], rebuild: bool = False):
+        """Use the saved lexical index if it was built for the current manifest, otherwise rebuild it from the docstore"""
+        if not self.lexical_enabled or store is None:
+            return
+        digest = manifest_digest(self._read_manifest())
+        if not rebuild and digest is not None:
+            if self.lexical is not None and self.lexical.digest == digest:
+                return
+            saved = LexicalIndex.load(self.path)
+            if saved is not None and saved.digest == digest:
+                self.lexical = saved
+                return
+        self.lexical = LexicalIndex.from_docstore(store.docstore, digest)
+        try:
+            self.lexical.save(self.path)
+        except Exception as e:
+            print(f"Error saving lexical index of {self.name}: {e}")
+
+    def lexical_indexes(self) -> Dict[Optional[str], LexicalIndex]:
+        return {None: self.lexical} if self.lexical is not None else {}
+
+    def exists(self) -> bool:
+        recover_swap(self.path)
+        return os.path.exists(os.path.join(self.path, "index.faiss"))
+
+    def load(self) -> Optional[FAISS]:
+        """Saved store as-is (None if there is none or it cannot be read)"""
+        if not self.exists():
+            return None
+        try:
+            manifest = self._read_manifest()
+            store = FAISS.load_local(self.path, self.embeddings, allow_dangerous_deserialization=True)
+            configure_search(store.index, self.index_spec)
+            self.loaded_build = manifest.get("build") if manifest else None
+            self._refresh_lexical(store)
+            return store
+        except Exception as e:
+            print(f"Error loading {self.name}: {e}")
+            return None
+
+    def save(self, store: FAISS, documents: List[Dict[str, Any]]) -> str:
+        """Save a freshly built store with a manifest for its documents; returns the new build id"""
+        os.makedirs(self.path, exist_ok=True)
+        store.save_local(self.path)
+        build = uuid.uuid4().hex
+        self._write_manifest(store, {
+            doc["key"]: {"id": doc["key"], "hash": document_hash(doc["content"], doc["metadata"])}
+            for doc in documents
+        }, build)
+        self.loaded_build = build
+        self._refresh_lexical(store, rebuild=True)
+        return build
+
+    def build(self, documents: Optional[List[Dict[str, Any]]] = None) -> Optional[FAISS]:
+        """Embed every document and save a new store with its manifest"""
+        documents = self.load_documents() if documents is None else documents
+        if not documents:
+            print(f"No documents for {self.name}")
+            return None
+        print(f"Creating {self.name} with {len(documents)} documents ({self.index_spec.kind} index)")
+        vectors = self.embeddings.embed_documents([doc["content"] for doc in documents])
+        store = store_from_vectors(documents, np.asarray(vectors, dtype=np.float32), self.embeddings, self.index_spec)
+        self.save(store, documents)
+        self.last_sync = {"rebuilt": True, "added": len(documents), "updated": 0, "deleted": 0,
+                          "unchanged": 0, "at": time.time()}
+        print(f"{self.name} created and saved successfully")
+        return store
+
+    @staticmethod
+    def _adopt(store: FAISS, current: Dict[str, str]) -> Dict[str, Dict[str, str]]:
+        """Manifest for a store saved without one: match stored documents to keys by content hash"""
+        by_hash: Dict[str, List[str]] = {}
+        for doc_id, doc in store.docstore._dict.items():
+            by_hash.setdefault(document_hash(doc.page_content, doc.metadata), []).append(doc_id)
+        manifest, stale = {}, []
+        for key, digest in current.items():
+            ids = by_hash.get(digest)
+            if ids:
+                manifest[key] = {"id": ids.pop(), "hash": digest}
+        for ids in by_hash.values():
+            stale.extend(ids)
+        # Unmatched stored documents get a placeholder key so sync() deletes them
+        for doc_id in stale:
+            manifest[f"__stale__:{doc_id}"] = {"id": doc_id, "hash": ""}
+        return manifest
+
+    def sync(self, store: Optional[FAISS] = None) -> Optional[FAISS]:
+        """Bring the saved store up to date with the database and return it"""
+        manifest = self._read_manifest()
+        if store is not None and manifest is not None and manifest.get("build") != self.loaded_build:
+            print(f"{self.name} was rebuilt on disk. Reloading.")
+            store = None
+        store = store if store is not None else self.load()
+        documents = self.load_documents()
+        manifest = self._read_manifest()
+        if store is None or (manifest is not None and manifest.get("namespace") != self.namespace):
+            if store is not None:
+                print(f"{self.name} was built with another embedding model. Rebuilding.")
+            return self.build(documents)
+        if not documents:
+            print(f"No documents for {self.name}; keeping the saved store")
+            return store
+
+        reindexed = False
+        # Stores saved before manifests recorded the index type are flat. The target is what the spec builds
+        # from the stored vectors, so a flat fallback is re-indexed once there are enough vectors to train
+        target = kind_key(self.index_spec, buildable_kind(self.index_spec, store.index.d, store.index.ntotal))
+        if (manifest or {}).get("index", "flat") != target:
+            converted = reindex_store(store, self.index_spec)
+            if converted is None:
+                print(f"{self.name} index cannot be converted to {self.index_spec.kind} without its vectors. Rebuilding.")
+                return self.build(documents)
+            print(f"{self.name} re-indexed as {self.index_spec.kind}")
+            store, reindexed = converted, True
+
+        current = {doc["key"]: document_hash(doc["content"], doc["metadata"]) for doc in documents}
+        entries = manifest["documents"] if manifest is not None else self._adopt(store, current)
+
+        changed = [key for key, digest in current.items() if key in entries and entries[key]["hash"] != digest]
+        added = [key for key in current if key not in entries]
+        removed = [key for key in entries if key not in current]
+
+        present = set(store.index_to_docstore_id.values())
+        to_delete = [entries[key]["id"] for key in changed + removed]
+        # A key may already be in the store if a previous sync saved the index but not the manifest
+        to_delete += [key for key in changed + added if key in present and key not in to_delete]
+        to_delete = [doc_id for doc_id in to_delete if doc_id in present]
+        to_add = [doc for doc in documents if doc["key"] in set(changed + added)]
+
+        if to_delete:
+            remove_documents(store, to_delete)
+        if to_add:
+            vectors = self.embeddings.embed_documents([doc["content"] for doc in to_add])
+            add_documents(store, to_add, np.asarray(vectors, dtype=np.float32))
+
+        new_entries = {key: entries[key] for key in current if key in entries and key not in changed}
+        new_entries.update({doc["key"]: {"id": doc["key"], "hash": current[doc["key"]]} for doc in to_add})
+        if to_delete or to_add or reindexed:
+            store.save_local(self.path)
+            self._write_manifest(store, new_entries, self.loaded_build)
+            self._refresh_lexical(store, rebuild=True)
+        elif manifest is None:
+            # Adopted as it is: only the manifest is new, the saved (possibly git-tracked) index is not rewritten
+            self._write_manifest(store, new_entries, self.loaded_build)
+            self._refresh_lexical(store, rebuild=True)
+        else:
+            self._refresh_lexical(store)
+
+        self.last_sync = {"rebuilt": False, "added": len(added), "updated": len(changed), "deleted": len(removed),
+                          "unchanged": len(current) - len(added) - len(changed), "at": time.time()}
+        print(f"{self.name} synced: {len(added)} added, {len(changed)} updated, {len(removed)} deleted")
+        return store
+
+
+def partition_of(metadata: Dict[str, Any]) -> str:
+    """Partition a document belongs to: its table for row documents"""
+    return str(metadata.get("partition") or metadata.get("table") or "default")
+
+
+def group_by_partition(documents: List[Dict[str, Any]]) -> Dict[str, List[int]]:
+    """partition -> positions of its documents, in document order"""
+    groups: Dict[str, List[int]] = {}
+    for position, doc in enumerate(documents):
+        groups.setdefault(partition_of(doc["metadata"]), []).append(position)
+    return groups
+
+
+def saved_store_paths(path: str) -> List[str]:
+    """Directories holding an index.faiss for a store: each of its partitions, or else the store itself"""
+    partitions = [os.path.join(path, entry) for entry in sorted(os.listdir(path))
+                  if os.path.exists(os.path.join(path, entry, "index.faiss"))] if os.path.isdir(path) else []
+    if partitions:
+        return partitions
+    return [path] if os.path.exists(os.path.join(path, "index.faiss")) else []
+
+
+class PartitionedVectorStore:
+    """One FAISS store per partition; a query searches only the partitions its selector picks.
+
+    Scores are L2 distances in the same embedding space, so results from several partitions are
+    merged by distance. Without a selector every partition is searched.
+    """
+
+    def __init__(self, stores: Dict[str, FAISS], embeddings, selector=None):
+        self.stores = stores
+        self.embeddings = embeddings
+        self.selector = selector
+        means = {name: sample_mean(store) for name, store in stores.items()}
+        present = [mean for mean in means.values() if mean is not None]
+        # Mean-pooled embeddings all lean the same way; centering on the mean of the partition means (as
+        # QueryRouter does) leaves the directions that tell partitions apart
+        self.center = np.mean(present, axis=0) if len(present) > 1 else None
+        self.centroids = {name: self._centered(mean) if mean is not None else None for name, mean in means.items()}
+
+    def _centered(self, vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        if self.center is not None:
+            vector = vector - self.center
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def select_partitions(self, query: str, vector) -> List[str]:
+        """Partitions a question searches (every partition without a selector)"""
+        if self.selector is None:
+            return list(self.stores)
+        return self.selector.select(query, self._centered(vector), self.centroids)
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     partitions: Optional[List[str]] = None) -> List[Tuple[Document, float]]:
+        vector = self.embeddings.embed_query(query)
+        if partitions is None:
+            partitions = self.select_partitions(query, vector)
+        return self.similarity_search_with_score_by_vector(vector, k, partitions)
+
+    def similarity_search_with_score_by_vector(self, vector, k: int, partitions: List[str]) -> List[Tuple[Document, float]]:
+        results = []
+        for name in partitions:
+            store = self.stores.get(name)
+            if store is not None and store.index.ntotal:
+                results.extend(store.similarity_search_with_score_by_vector(vector, k=k))
+        return sorted(results, key=lambda item: item[1])[:k]
+
+    def similarity_search(self, query: str, k: int = 4, partitions: Optional[List[str]] = None) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, partitions)]
+
+    def stats(self) -> dict:
+        return {
+            "partitions": {name: store.index.ntotal for name, store in self.stores.items()},
+            "selector": self.selector.stats() if self.selector is not None else None
+        }
+
+
+class PartitionedStoreSync:
+    """VectorStoreSync for each partition of a store, kept in <path>/<partition>/.
+
+    load_documents returns the documents of every partition; each partition is synced with its own
+    manifest, so a change to one table only touches that table's index. When no partition exists yet,
+    a store saved in the old single-index layout (<path>/index.faiss) is split into partitions from its
+    stored vectors; the single index is left in place (it is tracked in git) and no longer read.
+    """
+
+    def __init__(self, path: str, embeddings, namespace: str, load_documents: Callable[[], List[Dict[str, Any]]],
+                 name: str = "vector store", index_spec: Optional[IndexSpec] = None, selector=None,
+                 lexical: bool = False):
+        self.path = path
+        self.embeddings = embeddings
+        self.namespace = namespace
+        self.load_documents = load_documents
+        self.name = name
+        self.index_spec = index_spec or IndexSpec()
+        self.selector = selector
+        self.lexical_enabled = lexical
+        self.partitions: Dict[str, VectorStoreSync] = {}
+        self.last_sync: Dict[str, Any] = {}
+
+    def _partition(self, partition: str, documents: Optional[List[Dict[str, Any]]] = None) -> VectorStoreSync:
+        part = self.partitions.get(partition)
+        if part is None:
+            part = VectorStoreSync(os.path.join(self.path, partition), self.embeddings, self.namespace, None,
+                                   name=f"{self.name} [{partition}]", index_spec=self.index_spec,
+                                   lexical=self.lexical_enabled)
+            self.partitions[partition] = part
+        part.load_documents = lambda: documents or []
+        return part
+
+    def _on_disk(self) -> List[str]:
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(
+            entry for entry in os.listdir(self.path)
+            if not entry.endswith((".old", ".new", ".build"))
+            and (os.path.exists(os.path.join(self.path, entry, "index.faiss"))
+                 or os.path.exists(os.path.join(self.path, entry + ".old", "index.faiss")))
+        )
+
+    def _remove_partition(self, partition: str):
+        shutil.rmtree(os.path.join(self.path, partition), ignore_errors=True)
+        self.partitions.pop(partition, None)
+        print(f"{self.name} [{partition}] has no documents left; removed")
+
+    def lexical_indexes(self) -> Dict[Optional[str], LexicalIndex]:
+        return {name: part.lexical for name, part in self.partitions.items() if part.lexical is not None}
+
+    def _split_legacy(self, wanted: Optional[set] = None):
+        """Split a single-index store into one store per partition (only the wanted ones), reusing its vectors"""
+        if self._on_disk():
+            return
+        legacy = VectorStoreSync(self.path, self.embeddings, self.namespace, None, name=self.name)
+        if not legacy.exists():
+            return
+        manifest = legacy._read_manifest()
+        store = legacy.load()
+        saved = stored_vectors(store) if store is not None else None
+        if saved is not None and saved[1] is not None and (manifest is None or manifest.get("namespace") == self.namespace):
+            ids, vectors = saved
+            doc_ids = [store.index_to_docstore_id[i] for i in ids]
+            groups: Dict[str, List[int]] = {}
+            for row, doc_id in enumerate(doc_ids):
+                partition = partition_of(store.docstore.search(doc_id).metadata)
+                if wanted is None or partition in wanted:
+                    groups.setdefault(partition, []).append(row)
+            for partition, rows in groups.items():
+                part_ids = [doc_ids[row] for row in rows]
+                # Without a manifest the split store stays flat and is adopted and re-indexed by the next sync
+                spec = self.index_spec if manifest is not None else IndexSpec()
+                part_store = FAISS(self.embeddings, make_index(spec, vectors[rows]),
+                                   InMemoryDocstore({doc_id: store.docstore.search(doc_id) for doc_id in part_ids}),
+                                   {i: doc_id for i, doc_id in enumerate(part_ids)})
+                part = self._partition(partition)
+                os.makedirs(part.path, exist_ok=True)
+                part_store.save_local(part.path)
+                if manifest is not None:
+                    wanted = set(part_ids)
+                    part._write_manifest(part_store, {key: entry for key, entry in manifest["documents"].items()
+                                          if entry["id"] in wanted}, manifest.get("build"))
+            print(f"Split {self.name} into {len(groups)} partitions: {', '.join(sorted(groups))}")
+        else:
+            print(f"{self.name} cannot be split from its stored vectors; partitions will be rebuilt")
+
+    def _wrap(self, stores: Dict[str, FAISS]) -> Optional[PartitionedVectorStore]:
+        stores = {name: store for name, store in stores.items() if store is not None}
+        return PartitionedVectorStore(stores, self.embeddings, self.selector) if stores else None
+
+    def exists(self) -> bool:
+        return bool(self._on_disk()) or os.path.exists(os.path.join(self.path, "index.faiss"))
+
+    def load(self) -> Optional[PartitionedVectorStore]:
+        self._split_legacy()
+        return self._wrap({partition: self._partition(partition).load() for partition in self._on_disk()})
+
+    def build(self, documents: Optional[List[Dict[str, Any]]] = None) -> Optional[PartitionedVectorStore]:
+        documents = self.load_documents() if documents is None else documents
+        groups = group_by_partition(documents)
+        for partition in self._on_disk():
+            if partition not in groups:
+                self._remove_partition(partition)
+        stores = {}
+        for partition, positions in groups.items():
+            part_documents = [documents[i] for i in positions]
+            stores[partition] = self._partition(partition, part_documents).build(part_documents)
+        self.last_sync = {"rebuilt": True, "added": len(documents), "updated": 0, "deleted": 0,
+                          "unchanged": 0, "at": time.time()}
+        return self._wrap(stores)
+
+    def sync(self, store: Optional[PartitionedVectorStore] = None) -> Optional[PartitionedVectorStore]:
+        """Sync every partition with the database; returns the partitioned store"""
+        documents = self.load_documents()
+        if not documents:
+            print(f"No documents for {self.name}; keeping the saved store")
+            return store if store is not None else self.load()
+        groups = group_by_partition(documents)
+        self._split_legacy(set(groups))
+        current = store.stores if store is not None else {}
+        totals = {"rebuilt": False, "added": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+        stores = {}
+        for partition in sorted(set(groups) | set(self._on_disk()) | set(current)):
+            if partition not in groups:
+                self._remove_partition(partition)
+                continue
+            part = self._partition(partition, [documents[i] for i in groups[partition]])
+            stores[partition] = part.sync(current.get(partition))
+            for key in ("added", "updated", "deleted", "unchanged"):
+                totals[key] += part.last_sync.get(key, 0)
+            totals["rebuilt"] = totals["rebuilt"] or part.last_sync.get("rebuilt", False)
+        self.last_sync = {**totals, "partitions": len(stores), "at": time.time()}
+        return self._wrap(stores)
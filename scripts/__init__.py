@@ -0,0 +1 @@
+# Maintenance scripts, run from the project root: python -m scripts.<name>
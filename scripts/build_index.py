@@ -0,0 +1,238 @@
+"""Offline builder for vector_store/ and description_vector_store/.
+
+Streams documents from Database.db in chunks, embeds the chunks in worker processes and writes
+each embedded chunk to a checkpoint directory (<store>.build/) as it finishes. A killed build
+re-run with the same settings reuses every checkpointed chunk whose documents are unchanged.
+The finished store (one index per document source when VECTOR_STORE_PARTITIONED=true) is written next to
+the live one and swapped in with two renames, so the app (or the next sync) never sees a
+half-written index.
+
+Run from the project root:
+    python -m scripts.build_index [--store rows|descriptions|all] [--workers 4] [--chunk-size 512] [--fresh]
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from config import Config
+from models.faiss_index import IndexSpec
+from models.rag_system import create_embeddings, embedding_namespace
+from models.vector_store import (VectorStoreSync, document_hash, group_by_partition, recover_swap, store_from_vectors,
+                                 swap_directory)
+from utils import count_vector_documents, iter_vector_documents, load_product_descriptions, parse_document_sources
+
+# name -> (Config attribute with the store path, documents, document count, Config flag for one index per partition);
+# the document functions take the Config
+STORES = {
+    "rows": ("vector_store_path",
+             lambda config: iter_vector_documents(config.db_path, parse_document_sources(config.vector_document_sources)),
+             lambda config: count_vector_documents(config.db_path, parse_document_sources(config.vector_document_sources)),
+             "vector_store_partitioned"),
+    "descriptions": ("description_vector_store_path",
+                     lambda config: iter(load_product_descriptions(config.db_path)),
+                     lambda config: len(load_product_descriptions(config.db_path)), None),
+}
+
+_embedder = None
+
+
+def _init_worker(config, threads):
+    """Load one embedder per worker process, sharing the cores between workers"""
+    global _embedder
+    import torch
+    torch.set_num_threads(threads)
+    if config.embedding_backend == "onnx" and not config.onnx_intra_op_threads:
+        config.onnx_intra_op_threads = threads
+    _embedder = create_embeddings(config)
+
+
+def _embed_chunk(number, texts):
+    return number, np.asarray(_embedder.embed_documents(texts), dtype=np.float32)
+
+
+def _chunks(documents, chunk_size):
+    iterator = iter(documents)
+    for number in itertools.count():
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield number, chunk
+
+
+def _format_eta(seconds):
+    if seconds is None:
+        return "?"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class Checkpoint:
+    """Embedded chunks of one build; a chunk is reused only if its document hashes still match"""
+
+    def __init__(self, directory, namespace, chunk_size, fresh=False):
+        self.directory = directory
+        state = {"namespace": namespace, "chunk_size": chunk_size}
+        state_path = os.path.join(directory, "state.json")
+        if os.path.exists(directory) and not fresh:
+            try:
+                with open(state_path, 'r', encoding='utf-8') as f:
+                    if json.load(f) != state:
+                        print(f"Checkpoint at {directory} has other settings. Starting over.")
+                        fresh = True
+            except Exception:
+                fresh = True
+        if fresh and os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory, exist_ok=True)
+        with open(state_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+
+    def _path(self, number):
+        return os.path.join(self.directory, f"chunk_{number:06d}.npz")
+
+    def load(self, number, hashes):
+        path = self._path(number)
+        if not os.path.exists(path):
+            return None
+        try:
+            saved = np.load(path)
+            if saved["hashes"].tolist() == hashes:
+                return saved["vectors"]
+        except Exception as e:
+            print(f"Ignoring unreadable checkpoint {path}: {e}")
+        return None
+
+    def save(self, number, hashes, vectors):
+        tmp_path = self._path(number) + ".tmp.npz"
+        np.savez(tmp_path, hashes=np.array(hashes), vectors=vectors)
+        os.replace(tmp_path, self._path(number))
+
+
+def build_store(config, name, workers, chunk_size, fresh=False):
+    path_attr, iter_documents, count_documents, partitioned_attr = STORES[name]
+    path = getattr(config, path_attr).rstrip(os.sep)
+    namespace = embedding_namespace(config)
+    index_spec = IndexSpec.from_config(config)
+    recover_swap(path)
+    checkpoint = Checkpoint(path + ".build", namespace, chunk_size, fresh)
+
+    total = count_documents(config)
+    print(f"\n=== Building {name} store at {path}: {total} documents, "
+          f"{workers or 'no'} worker processes, chunks of {chunk_size} ===")
+
+    pool, inline = None, None
+    if workers > 0:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker, initargs=(config, threads))
+    else:
+        inline = create_embeddings(config)
+
+    documents, vectors, pending = [], {}, {}
+    done = reused = embedded = 0
+    start = last_report = time.time()
+    # Throughput counts only embedded documents, from the moment the first chunk goes to the embedders
+    rate_start = None
+
+    def report(force=False):
+        nonlocal last_report
+        now = time.time()
+        if not force and now - last_report < 5:
+            return
+        last_report = now
+        rate = embedded / max(now - rate_start, 1e-9) if rate_start else 0.0
+        eta = (total - done) / rate if rate > 0 else None
+        print(f"  {done}/{total} documents ({100 * done / max(total, 1):.1f}%), {reused} from checkpoint, "
+              f"{rate:.1f} docs/s, ETA {_format_eta(eta)}")
+
+    def collect(results):
+        nonlocal done, embedded
+        for number, chunk_vectors in results:
+            hashes = pending.pop(number)
+            checkpoint.save(number, hashes, chunk_vectors)
+            vectors[number] = chunk_vectors
+            done += len(hashes)
+            embedded += len(hashes)
+        report()
+
+    try:
+        futures = set()
+        for number, chunk in _chunks(iter_documents(config), chunk_size):
+            documents.extend(chunk)
+            hashes = [document_hash(doc["content"], doc["metadata"]) for doc in chunk]
+            saved = checkpoint.load(number, hashes)
+            if saved is not None:
+                vectors[number] = saved
+                done += len(chunk)
+                reused += len(chunk)
+                continue
+            texts = [doc["content"] for doc in chunk]
+            pending[number] = hashes
+            if rate_start is None:
+                rate_start = time.time()
+            if pool is None:
+                collect([(number, np.asarray(inline.embed_documents(texts), dtype=np.float32))])
+                continue
+            futures.add(pool.submit(_embed_chunk, number, texts))
+            # Keep the row stream at most two chunks per worker ahead of the embedders
+            if len(futures) >= 2 * workers:
+                finished, futures = wait(futures, return_when=FIRST_COMPLETED)
+                collect(future.result() for future in finished)
+        while futures:
+            finished, futures = wait(futures, return_when=FIRST_COMPLETED)
+            collect(future.result() for future in finished)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    report(force=True)
+
+    if not documents:
+        print(f"No documents for the {name} store; leaving {path} as it is")
+        return
+    matrix = np.concatenate([vectors[number] for number in sorted(vectors)])
+    new_path = path + ".new"
+    if os.path.exists(new_path):
+        shutil.rmtree(new_path)
+    if partitioned_attr and getattr(config, partitioned_attr):
+        groups = group_by_partition(documents)
+    else:
+        groups = {None: list(range(len(documents)))}
+    for partition, positions in groups.items():
+        part_documents = [documents[i] for i in positions]
+        print(f"Indexing {len(part_documents)} vectors{f' of {partition}' if partition else ''} ({index_spec.kind})")
+        store = store_from_vectors(part_documents, matrix[positions], index_spec=index_spec)
+        part_path = os.path.join(new_path, partition) if partition else new_path
+        # The row store's BM25 index (lexical.json) is written with it so the app loads both at once
+        VectorStoreSync(part_path, None, namespace, None, name=name, index_spec=index_spec,
+                        lexical=name == "rows" and config.hybrid_search).save(store, part_documents)
+    swap_directory(new_path, path)
+    shutil.rmtree(checkpoint.directory, ignore_errors=True)
+    elapsed = time.time() - start
+    print(f"Built {name} store: {len(documents)} documents ({embedded} embedded, {reused} reused) "
+          f"in {_format_eta(elapsed)}, swapped into {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store", choices=list(STORES) + ["all"], default="all")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                        help="Embedding processes (0 = embed in this process)")
+    parser.add_argument("--chunk-size", type=int, default=512, help="Documents per chunk and checkpoint file")
+    parser.add_argument("--fresh", action="store_true", help="Ignore checkpoints from an earlier run")
+    args = parser.parse_args()
+
+    config = Config()
+    for name in (STORES if args.store == "all" else [args.store]):
+        build_store(config, name, args.workers, args.chunk_size, args.fresh)
+
+
+if __name__ == "__main__":
+    main()
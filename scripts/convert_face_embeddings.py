@@ -0,0 +1,70 @@
+"""Convert customers.embedding from JSON text to the binary BLOB format.
+
+Rows that are already binary are left alone, so the script can be re-run safely
+and the application keeps working with a mix of both formats in the meantime.
+
+Run from the project root:
+    python -m scripts.convert_face_embeddings [--db Database.db] [--dtype float16] [--dry-run] [--vacuum]
+"""
+import argparse
+
+from db import default_db_path, get_db
+from models.face_embedding_codec import DTYPE_NAMES, decode_face_embedding, encode_face_embedding, is_binary_embedding
+
+
+def convert(db_path, dtype="float32", batch_size=500, dry_run=False):
+    conn = get_db(db_path).open()
+    converted = skipped = invalid = 0
+    bytes_before = bytes_after = 0
+    try:
+        rows = conn.execute(
+            "SELECT id, embedding FROM customers WHERE embedding IS NOT NULL"
+        ).fetchall()
+        updates = []
+        for customer_id, value in rows:
+            if is_binary_embedding(value):
+                skipped += 1
+                continue
+            embedding = decode_face_embedding(value)
+            if embedding is None or embedding.size == 0:
+                print(f"  - customer {customer_id}: unreadable embedding, left unchanged")
+                invalid += 1
+                continue
+            blob = encode_face_embedding(embedding, dtype)
+            bytes_before += len(value.encode("utf-8") if isinstance(value, str) else value)
+            bytes_after += len(blob)
+            updates.append((blob, customer_id))
+
+        if not dry_run:
+            for start in range(0, len(updates), batch_size):
+                with conn:
+                    conn.executemany("UPDATE customers SET embedding = ? WHERE id = ?", updates[start:start + batch_size])
+        converted = len(updates)
+    finally:
+        conn.close()
+
+    print(f"{'Would convert' if dry_run else 'Converted'} {converted} rows "
+          f"({bytes_before / 1024:.1f} KiB -> {bytes_after / 1024:.1f} KiB), "
+          f"{skipped} already binary, {invalid} unreadable")
+    return converted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=default_db_path())
+    parser.add_argument("--dtype", choices=sorted(DTYPE_NAMES), default="float32")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--vacuum", action="store_true", help="Reclaim the freed space afterwards")
+    args = parser.parse_args()
+
+    converted = convert(args.db, args.dtype, args.batch_size, args.dry_run)
+    if args.vacuum and converted and not args.dry_run:
+        conn = get_db(args.db).open()
+        conn.execute("VACUUM")
+        conn.close()
+        print("Database vacuumed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Index advisor and schema migrations for Database.db.
+
+Reads the SQL log written by the chatbot (SQL_LOG_PATH), runs EXPLAIN QUERY PLAN on every
+distinct query, reports full scans of large tables and proposes indexes. Proposals can be
+written as the next numbered file in migrations/, and pending migrations applied on request.
+
+Run from the project root:
+    python -m scripts.index_advisor report [--log logs/generated_sql.jsonl] [--min-rows 10000]
+    python -m scripts.index_advisor propose --write
+    python -m scripts.index_advisor status
+    python -m scripts.index_advisor migrate [--dry-run]
+"""
+import argparse
+import os
+
+from config import Config
+from db import MIGRATIONS_DIR, applied_migrations, apply_migrations, default_db_path, get_db, list_migrations
+from models.index_advisor import IndexAdvisor, read_sql_log
+
+
+def _advise(args):
+    entries = read_sql_log(args.log)
+    if not entries:
+        print(f"No logged SQL in {args.log}")
+        return [], []
+    advisor = IndexAdvisor(args.db, min_rows=args.min_rows)
+    return advisor.advise(entry["sql"] for entry in entries)
+
+
+def report(args):
+    reports, proposals = _advise(args)
+    for item in reports:
+        print(f"\n[{item['executions']}x] {item['sql']}")
+        if "error" in item:
+            print(f"  ! {item['error']}")
+            continue
+        for step in item["plan"]:
+            print(f"  - {step}")
+        if item["large_scans"]:
+            print(f"  full scan of large table(s): {', '.join(item['large_scans'])}")
+    _print_proposals(proposals)
+
+
+def _print_proposals(proposals):
+    print("\n=== Proposed indexes ===")
+    if not proposals:
+        print("None")
+    for proposal in proposals:
+        print(f"{proposal.create_statement()}  -- {proposal.queries} queries, "
+              f"{proposal.executions} executions ({', '.join(sorted(proposal.reasons))})")
+
+
+def propose(args):
+    _, proposals = _advise(args)
+    _print_proposals(proposals)
+    if not proposals or not args.write:
+        return
+    existing = list_migrations(args.migrations)
+    version = (existing[-1][0] + 1) if existing else 1
+    path = os.path.join(args.migrations, f"{version:04d}_advisor_indexes.sql")
+    os.makedirs(args.migrations, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"-- Proposed by scripts/index_advisor.py from {args.log}\n")
+        for proposal in proposals:
+            f.write(f"-- {proposal.executions} logged executions ({', '.join(sorted(proposal.reasons))})\n")
+            f.write(proposal.create_statement() + "\n")
+    print(f"Wrote {path}. Review it, then run: python -m scripts.index_advisor migrate")
+
+
+def status(args):
+    with get_db(args.db).connection() as conn:
+        applied = applied_migrations(conn, create=False)
+    for version, name, _ in list_migrations(args.migrations):
+        print(f"{version:04d}_{name}: {'applied' if version in applied else 'pending'}")
+
+
+def migrate(args):
+    done = apply_migrations(args.db, args.migrations, dry_run=args.dry_run)
+    if not done:
+        print("Database is up to date")
+    elif args.dry_run:
+        for version, name in done:
+            print(f"Would apply {version:04d}_{name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["report", "propose", "status", "migrate"])
+    parser.add_argument("--db", default=default_db_path())
+    parser.add_argument("--log", default=os.path.join(Config.base_dir, Config.sql_log_path))
+    parser.add_argument("--migrations", default=MIGRATIONS_DIR)
+    parser.add_argument("--min-rows", type=int, default=10000, help="Tables smaller than this are never flagged")
+    parser.add_argument("--write", action="store_true", help="propose: write the proposals as a new migration")
+    parser.add_argument("--dry-run", action="store_true", help="migrate: only list pending migrations")
+    args = parser.parse_args()
+    {"report": report, "propose": propose, "status": status, "migrate": migrate}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def shop_db(tmp_path):
+    """Small copy of the shop schema: 20 products, 5 stores, 50 order lines"""
+    path = str(tmp_path / "shop.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE Product (Id INTEGER PRIMARY KEY, Name_Product TEXT, Descriptions TEXT);
+        CREATE TABLE Store (Id INTEGER PRIMARY KEY, Name_Store TEXT, Address TEXT);
+        CREATE TABLE Order_detail (Id INTEGER PRIMARY KEY, Order_id INTEGER, Variant_id INTEGER, Quantity INTEGER);
+        CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT, embedding BLOB);
+    """)
+    conn.executemany("INSERT INTO Product VALUES (?, ?, ?)",
+                     [(i, f"Trà sữa {i}", "x" * 200) for i in range(1, 21)])
+    conn.executemany("INSERT INTO Store VALUES (?, ?, ?)", [(i, f"Store {i}", f"{i} Lê Lợi") for i in range(1, 6)])
+    conn.executemany("INSERT INTO Order_detail VALUES (?, ?, ?, ?)",
+                     [(i, i // 3, i % 20 + 1, i % 4 + 1) for i in range(1, 51)])
+    conn.execute("INSERT INTO customers VALUES (1, 'An', x'00')")
+    conn.commit()
+    conn.close()
+    return path
@@ -0,0 +1,39 @@
+from utils import execute_sql_query
+
+
+def test_small_result_is_not_truncated(shop_db):
+    result = execute_sql_query(shop_db, "SELECT * FROM Store")
+    assert result.error is None
+    assert len(result.rows) == 5
+    assert not result.truncated
+    assert result.total_exact and result.total_rows == 5
+
+
+def test_row_cap_stops_fetching(shop_db):
+    result = execute_sql_query(shop_db, "SELECT * FROM Order_detail", max_rows=5, batch_size=10)
+    assert len(result.rows) == 5
+    assert result.truncated and result.reason == "rows"
+    # Only the first batch was read, so the total is a lower bound
+    assert result.total_rows == 10
+    assert not result.total_exact
+
+
+def test_row_cap_total_is_exact_when_result_ends_in_batch(shop_db):
+    result = execute_sql_query(shop_db, "SELECT * FROM Order_detail", max_rows=5, batch_size=100)
+    assert result.truncated and result.reason == "rows"
+    assert result.total_exact and result.total_rows == 50
+
+
+def test_byte_cap(shop_db):
+    result = execute_sql_query(shop_db, "SELECT Descriptions FROM Product", max_bytes=500)
+    assert len(result.rows) == 2
+    assert result.truncated and result.reason == "bytes"
+
+
+def test_time_budget(shop_db):
+    query = ("WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 100000000) "
+             "SELECT count(*) FROM c")
+    result = execute_sql_query(shop_db, query, time_budget_ms=50)
+    assert result.rows == []
+    assert "time budget" in result.error
+    assert result.elapsed_ms < 5000
@@ -0,0 +1,58 @@
+import pytest
+
+from utils import check_sql_query
+
+
+def test_plain_select_is_allowed(shop_db):
+    gate = check_sql_query(shop_db, "SELECT Name_Product FROM Product WHERE Id = 3;")
+    assert gate.allowed
+    assert not gate.rewritten
+    assert gate.query == "SELECT Name_Product FROM Product WHERE Id = 3"
+
+
+@pytest.mark.parametrize("query", [
+    "DELETE FROM Product",
+    "INSERT INTO Store VALUES (9, 'x', 'y')",
+    "UPDATE Product SET Name_Product = 'x'",
+    "SELECT * FROM Product; DROP TABLE Product;",
+    "ATTACH DATABASE 'other.db' AS other",
+])
+def test_writes_and_attach_are_refused(shop_db, query):
+    assert not check_sql_query(shop_db, query).allowed
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT embedding FROM customers",
+    "SELECT name FROM sqlite_master",
+    "SELECT load_extension('x') FROM Product",
+])
+def test_authorizer_refuses_what_validation_lets_through(shop_db, query):
+    gate = check_sql_query(shop_db, query)
+    assert not gate.allowed
+    assert gate.reason != "failed validation"
+
+
+def test_full_scan_over_budget_is_refused(shop_db):
+    gate = check_sql_query(shop_db, "SELECT * FROM Order_detail WHERE Quantity > 1", max_scan_rows=10)
+    assert not gate.allowed
+    assert "scan budget" in gate.reason
+    assert gate.plan
+
+
+def test_nested_full_scans_are_refused(shop_db):
+    # 20 products x 5 stores: each scan fits the budget, the cartesian product does not
+    gate = check_sql_query(shop_db, "SELECT * FROM Product, Store", max_scan_rows=50)
+    assert not gate.allowed
+    assert gate.reason.startswith("Nested full scans")
+
+
+def test_small_limit_skips_the_scan_budget(shop_db):
+    gate = check_sql_query(shop_db, "SELECT * FROM Order_detail LIMIT 5", max_scan_rows=10)
+    assert gate.allowed
+
+
+def test_big_unlimited_scan_is_capped(shop_db):
+    gate = check_sql_query(shop_db, "SELECT * FROM Order_detail", max_rows=2, large_table_rows=20)
+    assert gate.allowed and gate.rewritten
+    assert gate.row_cap == 20
+    assert gate.query == "SELECT * FROM (SELECT * FROM Order_detail) LIMIT 20"
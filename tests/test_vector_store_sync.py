@@ -0,0 +1,95 @@
+import hashlib
+import os
+from typing import List
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from models.vector_store import VectorStoreSync
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic embedder that counts the texts it embeds"""
+
+    def __init__(self, dim: int = 16):
+        self.dim = dim
+        self.embedded: List[str] = []
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.md5(text.encode("utf-8")).digest()[:4], "little")
+        return np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.embedded.extend(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+
+def file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+@pytest.fixture
+def rows():
+    return {i: f"Trà sữa số {i}" for i in range(1, 11)}
+
+
+@pytest.fixture
+def store_sync(tmp_path, rows):
+    def load_documents():
+        return [{"key": f"product:{i}", "content": name, "metadata": {"table": "product", "Id": i}}
+                for i, name in rows.items()]
+    return VectorStoreSync(str(tmp_path / "store"), HashEmbeddings(), "hash-16", load_documents)
+
+
+def saved_files(store_sync):
+    return {name: file_digest(os.path.join(store_sync.path, name)) for name in ("index.faiss", "index.pkl")}
+
+
+def test_unchanged_rows_are_not_re_embedded(store_sync):
+    store = store_sync.build()
+    before = saved_files(store_sync)
+    store_sync.embeddings.embedded.clear()
+
+    store = store_sync.sync(store)
+    assert store_sync.embeddings.embedded == []
+    assert saved_files(store_sync) == before
+    assert store_sync.last_sync["unchanged"] == 10 and not store_sync.last_sync["rebuilt"]
+
+    # Same from a fresh process that loads the saved store
+    store_sync.sync()
+    assert store_sync.embeddings.embedded == []
+    assert saved_files(store_sync) == before
+
+
+def test_changed_and_added_rows_are_embedded_alone(store_sync, rows):
+    store_sync.build()
+    store_sync.embeddings.embedded.clear()
+    rows[3] = "Cà phê sữa đá"
+    rows[11] = "Trà đào cam sả"
+    del rows[5]
+
+    store = store_sync.sync()
+    assert sorted(store_sync.embeddings.embedded) == sorted(["Cà phê sữa đá", "Trà đào cam sả"])
+    assert store_sync.last_sync["added"] == 1
+    assert store_sync.last_sync["updated"] == 1
+    assert store_sync.last_sync["deleted"] == 1
+    assert store.index.ntotal == 10
+    assert store.similarity_search("Cà phê sữa đá", k=1)[0].metadata["Id"] == 3
+
+
+def test_store_without_manifest_is_adopted_without_rewriting(store_sync):
+    store_sync.build()
+    before = saved_files(store_sync)
+    os.remove(store_sync.manifest_path)
+    store_sync.embeddings.embedded.clear()
+
+    store_sync.sync()
+    assert store_sync.embeddings.embedded == []
+    assert saved_files(store_sync) == before
+    assert os.path.exists(store_sync.manifest_path)
+    assert store_sync.last_sync["unchanged"] == 10
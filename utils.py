@@ -1,165 +1,411 @@
+import itertools
 import json
 import sqlite3
-from typing import List, Dict, Any, Tuple
+import time
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 import base64
-import os
 import re
 
+from db import get_db
+
+# Tên hiển thị tiếng Việt cho các cột trong database
+COLUMN_NAME_MAPPING = {
+    # Bảng Categories
+    "Id": "id danh mục",
+    "Name_Cat": "tên danh mục", 
+    "Description": "mô tả danh mục",
+
+    # Bảng Product
+    "Categories_id": "id danh mục",
+    # "Id": "id sản phẩm",       
+    "Name_Product": "tên sản phẩm",       
+    "Descriptions": "mô tả sản phẩm",
+    "Link_Image": "link ảnh",
+    # Bảng Variant
+    "Product_Prep": "thành phần sản phẩm",
+    "Calories": "calo",
+    "Dietary_Fibre_g": "chất xơ",
+    "Sugars_g": "đường",
+    "Protein_g": "protein",
+    "Vitamin_A": "vitamin A",
+    "Vitamin_C": "vitamin C",
+    "Caffeine_mg": "caffeine",
+    "Price": "đơn giá",
+    "Sales_rank": "bán chạy",
+    # Bảng Store
+    # "Id": "id cửa hàng",          
+    "Name_Store": "tên cửa hàng",        
+    "Address": "địa chỉ",
+    "Phone": "số điện thoại",
+    "Open_Close": "giờ mở cửa đóng cửa",
+
+    # Bảng Orders
+    # "Id": "id đơn hàng",        
+    "Customer_id": "id khách hàng",
+    "Store_id": "id cửa hàng",
+    "Order_date": "ngày đặt hàng",
+
+    # Bảng Order_detail
+    "Order_id": "id đơn hàng",
+    "Product_id": "id sản phẩm",
+    "Quantity": "số lượng",
+    "Price": "đơn giá",
+    "Rate": "đánh giá", # Hoặc "đánh giá"
+
+    # Bảng Customer_preferences
+
+    "Preferred_categories": "danh mục ưa thích",
+    "Max_price": "giá tối đa",
+
+    # Bảng customers
+    "id": "id khách hàng", 
+    "name": "tên khách hàng",
+    "sex": "giới tính",
+    "age": "tuổi",
+    "location": "địa chỉ", 
+    "picture": "ảnh",            
+    "embedding": "embedding"     
+}
+
+
+VECTOR_STORE_SKIP_TABLES = ('sqlite_sequence', 'schema_migrations')
+
+
+def _row_document(table_name: str, column_names: List[str], row_idx: int, key: str, row) -> Dict[str, Any]:
+    """One table row as a vector store document"""
+    # Create a dictionary of column names and values
+    row_dict = {}
+    for col_name, val in zip(column_names, row):
+        if (table_name == "customers" and col_name in ["embedding", "picture"]) or \
+           (table_name == "Product" and col_name == "Link_Image"):
+            continue
+        row_dict[col_name] = val
+
+    content_parts = []
+    for k, v in row_dict.items():
+        display_name = COLUMN_NAME_MAPPING.get(k, k) 
+        value_str = str(v) if v is not None else "không có"
+        content_parts.append(f"{display_name}: {value_str}")
+
+    content = f"Bảng {table_name}: " + ", ".join(content_parts)
+
+    metadata = {
+        "table": table_name,
+         "columns": list(row_dict.keys()), 
+        "data": row_dict, 
+        "original_row_index": row_idx 
+    }
+
+    return {
+        "key": key,
+        "content": content,
+        "metadata": metadata
+    }
+
+
+def iter_table_documents(db_path: str, batch_size: int = 1000,
+                         tables: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+    """Stream the documents of load_table_data table by table, fetching batch_size rows at a time.
+
+    tables limits the tables read (default: all of them).
+    """
+    with get_db(db_path).connection(read_only=True) as conn:
+        all_tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table';")]
+        for table_name in all_tables:
+            if table_name in VECTOR_STORE_SKIP_TABLES or (tables is not None and table_name not in tables):
+                continue
+            print(f"Processing table: {table_name}")
+            columns_info = conn.execute(f"PRAGMA table_info({table_name});").fetchall()
+            column_names = [col[1] for col in columns_info]
+            # Stable document key "table:pk" (composite keys joined with ","), rowid if there is no PK
+            pk_positions = [i for _, i in sorted((col[5], i) for i, col in enumerate(columns_info) if col[5] > 0)]
+
+            cursor = conn.execute(f"SELECT {'' if pk_positions else 'rowid, '}* FROM {table_name};")
+            row_idx = 0
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    if pk_positions:
+                        key = f"{table_name}:{','.join(str(row[i]) for i in pk_positions)}"
+                    else:
+                        key, row = f"{table_name}:{row[0]}", row[1:]
+                    yield _row_document(table_name, column_names, row_idx, key, row)
+                    row_idx += 1
+            print(f"  - Found {row_idx} rows")
+
+
+def count_table_documents(db_path: str, tables: Optional[List[str]] = None) -> int:
+    """Number of documents iter_table_documents will yield"""
+    with get_db(db_path).connection(read_only=True) as conn:
+        all_tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table';")]
+        return sum(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                   for table in all_tables
+                   if table not in VECTOR_STORE_SKIP_TABLES and (tables is None or table in tables))
+
+
 def load_table_data(db_path: str) -> List[Dict[str, Any]]:
     """Load data from all tables in the database and format for vector store"""
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Get all table names
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-        
-        documents = []
+        print("\n=== Loading Data for Vector Store ===")
+        documents = list(iter_table_documents(db_path))
+
+        print("\n=== Summary ===")
+        print(f"Total documents created: {len(documents)}")
+        print("="*50)
+
+        return documents
         
-        column_name_mapping = {
-            # Bảng Categories
-            "Id": "id danh mục",
-            "Name_Cat": "tên danh mục", 
-            "Description": "mô tả danh mục",
-
-            # Bảng Product
-            "Categories_id": "id danh mục",
-            # "Id": "id sản phẩm",       
-            "Name_Product": "tên sản phẩm",       
-            "Descriptions": "mô tả sản phẩm",
-            "Link_Image": "link ảnh",
-            # Bảng Variant
-            "Product_Prep": "thành phần sản phẩm",
-            "Calories": "calo",
-            "Dietary_Fibre_g": "chất xơ",
-            "Sugars_g": "đường",
-            "Protein_g": "protein",
-            "Vitamin_A": "vitamin A",
-            "Vitamin_C": "vitamin C",
-            "Caffeine_mg": "caffeine",
-            "Price": "đơn giá",
-            "Sales_rank": "bán chạy",
-            # Bảng Store
-            # "Id": "id cửa hàng",          
-             "Name_Store": "tên cửa hàng",        
-            "Address": "địa chỉ",
-            "Phone": "số điện thoại",
-            "Open_Close": "giờ mở cửa đóng cửa",
-
-            # Bảng Orders
-            # "Id": "id đơn hàng",        
-            "Customer_id": "id khách hàng",
-            "Store_id": "id cửa hàng",
-            "Order_date": "ngày đặt hàng",
-
-            # Bảng Order_detail
-            "Order_id": "id đơn hàng",
-            "Product_id": "id sản phẩm",
-            "Quantity": "số lượng",
-            "Price": "đơn giá",
-            "Rate": "đánh giá", # Hoặc "đánh giá"
-
-            # Bảng Customer_preferences
-          
-            "Preferred_categories": "danh mục ưa thích",
-            "Max_price": "giá tối đa",
-
-            # Bảng customers
-            "id": "id khách hàng", 
-            "name": "tên khách hàng",
-            "sex": "giới tính",
-            "age": "tuổi",
-            "location": "địa chỉ", 
-            "picture": "ảnh",            
-            "embedding": "embedding"     
-        }
+    except Exception as e:
+        print(f"Error loading table data: {e}")
+        return []
 
-        print("\n=== Loading Data for Vector Store ===")
-        for table_tuple in tables:
-            table_name = table_tuple[0]
-            print(f"Processing table: {table_name}")
-            
 
-            if table_name == 'sqlite_sequence':
+VARIANT_COLUMNS = ("Price", "Calories", "Sugars_g", "Protein_g", "Dietary_Fibre_g", "Caffeine_mg",
+                   "Vitamin_A", "Vitamin_C", "Sales_rank")
+
+
+def _fetch_batches(cursor, batch_size: int):
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def iter_product_documents(db_path: str, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+    """One document per product: its category, description and every variant (size, price, nutrition)"""
+    query = f"""
+        SELECT p.Id, p.Name_Product, p.Descriptions, c.Name_Cat, v.Product_Prep,
+               {', '.join('v.' + col for col in VARIANT_COLUMNS)}
+        FROM Product p
+        LEFT JOIN Categories c ON c.Id = p.Categories_id
+        LEFT JOIN Variant v ON v.Product_id = p.Id
+        ORDER BY p.Id, v.Id
+    """
+    with get_db(db_path).connection(read_only=True) as conn:
+        print("Processing entity: products (Product + Variant + Categories)")
+        count = 0
+        product, variants, prices = None, [], []
+        # Rows arrive grouped by product; a document is emitted when the next product starts
+        for row in itertools.chain(_fetch_batches(conn.execute(query), batch_size), [None]):
+            if product is not None and (row is None or row[0] != product[0]):
+                product_id, name, description, category = product
+                description = (description or "không có").strip().rstrip(".")
+                content = f"Sản phẩm: {name}. Danh mục: {category or 'không có'}. Mô tả: {description}."
+                if variants:
+                    content += " Các lựa chọn: " + "; ".join(variants) + "."
+                yield {
+                    "key": f"products:{product_id}",
+                    "content": content,
+                    "metadata": {
+                        "partition": "products", "table": "Product", "id": product_id, "name": name,
+                        "category": category, "variants": len(variants),
+                        "min_price": min(prices, default=None), "max_price": max(prices, default=None)
+                    }
+                }
+                count += 1
+            if row is None:
+                break
+            if product is None or row[0] != product[0]:
+                product, variants, prices = tuple(row[:4]), [], []
+            if row[4] is None and row[5] is None:  # product without variants
                 continue
+            details = ", ".join(f"{COLUMN_NAME_MAPPING.get(col, col)}: {value}"
+                                for col, value in zip(VARIANT_COLUMNS, row[5:]) if value is not None)
+            variants.append(f"{row[4] or 'mặc định'} ({details})")
+            if row[5] is not None:
+                prices.append(row[5])
+        print(f"  - Built {count} product documents")
+
+
+def iter_store_documents(db_path: str, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+    """One document per store: name, address, phone and opening hours"""
+    with get_db(db_path).connection(read_only=True) as conn:
+        print("Processing entity: stores (Store)")
+        count = 0
+        cursor = conn.execute("SELECT Id, Name_Store, Address, Phone, Open_Close FROM Store ORDER BY Id")
+        for store_id, name, address, phone, open_close in _fetch_batches(cursor, batch_size):
+            details = ", ".join(f"{COLUMN_NAME_MAPPING[col]}: {value if value is not None else 'không có'}"
+                                for col, value in (("Address", address), ("Phone", phone), ("Open_Close", open_close)))
+            yield {
+                "key": f"stores:{store_id}",
+                "content": f"Cửa hàng: {name}. {details}.",
+                "metadata": {"partition": "stores", "table": "Store", "id": store_id, "name": name}
+            }
+            count += 1
+        print(f"  - Built {count} store documents")
+
+
+# Entity documents: source name -> (builder, tables it joins). Any other source name is a table indexed row by row
+ENTITY_SOURCES = {
+    "products": (iter_product_documents, ("Product", "Variant", "Categories")),
+    "stores": (iter_store_documents, ("Store",)),
+}
+
+
+def parse_document_sources(sources: str) -> List[str]:
+    """Comma-separated VECTOR_DOCUMENT_SOURCES -> source names; "tables" means every table, row by row"""
+    return [source.strip() for source in sources.split(",") if source.strip()]
+
+
+def _table_sources(db_path: str, sources: List[str]) -> List[str]:
+    """Tables named in sources (all of them for "tables"), in database order"""
+    raw = [source for source in sources if source not in ENTITY_SOURCES]
+    if not raw:
+        return []
+    with get_db(db_path).connection(read_only=True) as conn:
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table';")
+                  if row[0] not in VECTOR_STORE_SKIP_TABLES]
+    for source in raw:
+        if source != "tables" and source not in tables:
+            print(f"Unknown vector document source {source!r}; skipped")
+    return tables if "tables" in raw else [table for table in tables if table in raw]
+
+
+def iter_vector_documents(db_path: str, sources: List[str], batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+    """Documents of the row vector store: entity documents, then row documents of the listed tables"""
+    for source in sources:
+        if source in ENTITY_SOURCES:
+            yield from ENTITY_SOURCES[source][0](db_path, batch_size)
+    tables = _table_sources(db_path, sources)
+    if tables:
+        yield from iter_table_documents(db_path, batch_size, tables=tables)
+
+
+def count_vector_documents(db_path: str, sources: List[str]) -> int:
+    """Number of documents iter_vector_documents will yield"""
+    queries = {"products": "SELECT COUNT(*) FROM Product", "stores": "SELECT COUNT(*) FROM Store"}
+    with get_db(db_path).connection(read_only=True) as conn:
+        total = sum(conn.execute(queries[source]).fetchone()[0] for source in sources if source in ENTITY_SOURCES)
+    return total + count_table_documents(db_path, tables=_table_sources(db_path, sources))
+
+
+def load_vector_documents(db_path: str, sources: List[str]) -> List[Dict[str, Any]]:
+    """Load the documents of the configured sources for the row vector store"""
+    try:
+        print(f"\n=== Loading Data for Vector Store ({', '.join(sources)}) ===")
+        documents = list(iter_vector_documents(db_path, sources))
 
-            cursor.execute(f"PRAGMA table_info({table_name});")
-            columns_info = cursor.fetchall()
-            column_names = [col[1] for col in columns_info]
-            
-            cursor.execute(f"SELECT * FROM {table_name};")
-            rows = cursor.fetchall()
-            
-            print(f"  - Found {len(rows)} rows")
-            
-            # Convert each row to a document
-            for row_idx, row in enumerate(rows):
-                # Create a dictionary of column names and values
-                row_dict = {}
-                for col_name, val in zip(column_names, row):
-                    if (table_name == "customers" and col_name in ["embedding", "picture"]) or \
-                       (table_name == "Product" and col_name == "Link_Image"):
-                        continue
-                    row_dict[col_name] = val
-
-                content_parts = []
-                for k, v in row_dict.items():
-                    display_name = column_name_mapping.get(k, k) 
-                    value_str = str(v) if v is not None else "không có"
-                    content_parts.append(f"{display_name}: {value_str}")
-
-                content = f"Bảng {table_name}: " + ", ".join(content_parts)
-                
-                metadata = {
-                    "table": table_name,
-                     "columns": list(row_dict.keys()), 
-                    "data": row_dict, 
-                    "original_row_index": row_idx 
-                }
-                
-                documents.append({
-                    "content": content,
-                    "metadata": metadata
-                })
-        
         print("\n=== Summary ===")
         print(f"Total documents created: {len(documents)}")
         print("="*50)
-        
-        conn.close()
+
         return documents
-        
+
     except Exception as e:
-        print(f"Error loading table data: {e}")
+        print(f"Error loading vector documents: {e}")
         return []
 
 
 
-def execute_sql_query(db_path: str, query: str, timeout: int = 30) -> List[Dict[str, Any]]:
-    """Execute SQL query and return results"""
+def load_product_descriptions(db_path: str) -> List[Dict[str, Any]]:
+    """Product descriptions for the image-search vector store, keyed Product:<Id>"""
     try:
-        conn = sqlite3.connect(db_path, timeout=timeout)
-        cursor = conn.cursor()
-        
-        cursor.execute(query)
-        
-  
-        columns = [description[0] for description in cursor.description]
+        with get_db(db_path).connection() as conn:
+            products = conn.execute("SELECT Id, Name_Product, Descriptions FROM Product;").fetchall()
+        return [
+            {"key": f"Product:{product_id}", "content": f"{description}", "metadata": {"name": name, "description": description}}
+            for product_id, name, description in products
+        ]
+    except Exception as e:
+        print(f"Error loading product descriptions: {e}")
+        return []
+
+
+@dataclass
+class QueryResult:
+    """Rows returned by execute_sql_query, with the limits that cut them short.
+
+    Behaves like the list of row dicts it used to be (len, iteration, truthiness).
+    """
+    rows: List[Dict[str, Any]] = field(default_factory=list)
+    columns: List[str] = field(default_factory=list)
+    truncated: bool = False
+    reason: Optional[str] = None   # "rows", "bytes" or "time" when truncated
+    total_rows: int = 0            # rows seen; exact unless total_exact is False
+    total_exact: bool = True
+    error: Optional[str] = None
+    elapsed_ms: float = 0.0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __bool__(self):
+        return bool(self.rows)
+
+
+def execute_sql_query(db_path: str, query: str, timeout: int = 30, max_rows: int = 200,
+                      time_budget_ms: int = 2000, max_bytes: int = 32 * 1024,
+                      batch_size: int = 100) -> QueryResult:
+    """Execute SQL query and stream at most max_rows rows / max_bytes of values within time_budget_ms.
+
+    Fetching stops at the row or byte limit; rows of the batch already fetched are counted, so the
+    answer can say "showing first N of at least M" (M is exact when the result ended in that batch).
+    """
+    result = QueryResult()
+    start = time.perf_counter()
+    deadline = start + time_budget_ms / 1000 if time_budget_ms > 0 else None
+    try:
+        # LLM-generated SQL only ever gets a read-only connection
+        with get_db(db_path).connection(read_only=True) as conn:
+            conn.execute(f"PRAGMA busy_timeout = {int(timeout * 1000)}")
+            if deadline is not None:
+                # Called every 1000 VM instructions; a non-zero return interrupts the statement
+                conn.set_progress_handler(lambda: int(time.perf_counter() > deadline), 1000)
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query)
+                result.columns = [description[0] for description in cursor.description]
+
+                size = 0
+                while not result.truncated:
+                    batch = cursor.fetchmany(batch_size)
+                    if not batch:
+                        break
+                    for row in batch:
+                        result.total_rows += 1
+                        if result.truncated:
+                            continue
+                        row_size = sum(len(str(value)) for value in row)
+                        if len(result.rows) >= max_rows:
+                            result.truncated, result.reason = True, "rows"
+                        elif size + row_size > max_bytes and result.rows:
+                            result.truncated, result.reason = True, "bytes"
+                        else:
+                            result.rows.append(dict(zip(result.columns, row)))
+                            size += row_size
+                    if result.truncated and len(batch) == batch_size:
+                        # Rows past this batch are never read; the total is a lower bound
+                        result.total_exact = False
+            except sqlite3.OperationalError as e:
+                if deadline is None or time.perf_counter() <= deadline or "interrupt" not in str(e):
+                    raise
+                # Out of time: keep what was read, the row count is only a lower bound
+                result.total_exact = False
+                if not result.rows:
+                    result.error = f"Query exceeded the {time_budget_ms} ms time budget"
+                    print(f"Error executing SQL query: {result.error}")
+                elif not result.truncated:
+                    result.truncated, result.reason = True, "time"
+            finally:
+                cursor.close()
+                conn.set_progress_handler(None, 0)
 
-        rows = cursor.fetchall()
-        
-        results = []
-        for row in rows:
-            result_dict = dict(zip(columns, row))
-            results.append(result_dict)
-        
-        conn.close()
-        return results
-        
     except Exception as e:
         print(f"Error executing SQL query: {e}")
-        return []
+        result.error = str(e)
+
+    result.elapsed_ms = (time.perf_counter() - start) * 1000
+    if result.truncated:
+        print(f"SQL result truncated ({result.reason}): {len(result.rows)} of "
+              f"{'' if result.total_exact else 'at least '}{result.total_rows} rows")
+    return result
 
 def format_sql_results(results: List[Dict[str, Any]]) -> str:
     """Format SQL results into a readable string"""
@@ -173,6 +419,10 @@ def format_sql_results(results: List[Dict[str, Any]]) -> str:
             f"{k}: {v}" for k, v in result.items()
         ])
         formatted_results.append(result_str)
+
+    if getattr(results, "truncated", False):
+        total = f"{results.total_rows}" if results.total_exact else f"ít nhất {results.total_rows}"
+        formatted_results.append(f"(Chỉ hiển thị {len(results)} dòng đầu tiên trong tổng số {total} dòng kết quả)")
     
     return "\n".join(formatted_results)
 
@@ -232,35 +482,168 @@ def validate_sql_query(query: str) -> bool:
         print(f"Error during SQL query validation: {str(e)}")
         return False
 
+# Tables LLM-generated SQL may read; customers.embedding / picture are never readable
+SQL_ALLOWED_TABLES = {"categories", "product", "variant", "store", "orders", "order_detail", "customers", "customer_preferences"}
+SQL_DENIED_COLUMNS = {("customers", "embedding"), ("customers", "picture")}
+SQL_DENIED_FUNCTIONS = {"load_extension", "readfile", "writefile", "randomblob", "zeroblob"}
+
+SQL_KEYWORDS = {
+    "select", "from", "join", "inner", "left", "right", "outer", "cross", "on", "where", "group", "order",
+    "by", "having", "limit", "offset", "as", "and", "or", "not", "in", "like", "between", "is", "null",
+    "union", "all", "distinct", "case", "when", "then", "else", "end", "asc", "desc", "natural", "using"
+}
+
+_table_rows_cache: Dict[str, Tuple[float, Dict[str, int]]] = {}
+
+
+def sql_table_aliases(sql: str, tables) -> Dict[str, str]:
+    """alias (or table name) -> lower-case table name, from FROM / JOIN / comma-separated table lists"""
+    aliases = {}
+    for match in re.finditer(r"(?i)(?:from|join|,)\s+([A-Za-z_]\w*)(?:\s+(?:as\s+)?([A-Za-z_]\w*))?", sql):
+        table, alias = match.group(1).lower(), (match.group(2) or "").lower()
+        if table not in tables:
+            continue
+        aliases[table] = table
+        if alias and alias not in SQL_KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+
+def table_row_counts(db_path: str, max_age: float = 60.0) -> Dict[str, int]:
+    """Approximate row count per table (max rowid), cached for max_age seconds"""
+    cached = _table_rows_cache.get(db_path)
+    if cached and time.time() - cached[0] < max_age:
+        return cached[1]
+    counts = {}
+    with get_db(db_path).connection(read_only=True) as conn:
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        for table in tables:
+            try:
+                counts[table.lower()] = conn.execute(f"SELECT max(rowid) FROM {table}").fetchone()[0] or 0
+            except sqlite3.OperationalError:  # WITHOUT ROWID table
+                counts[table.lower()] = conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+    _table_rows_cache[db_path] = (time.time(), counts)
+    return counts
+
+
+@dataclass
+class SQLGateResult:
+    """Outcome of check_sql_query; query is the SQL to run (possibly rewritten with a LIMIT)"""
+    allowed: bool
+    query: str
+    reason: Optional[str] = None
+    rewritten: bool = False
+    row_cap: Optional[int] = None
+    plan: List[str] = field(default_factory=list)
+
+    def __bool__(self):
+        return self.allowed
+
+
+def _sql_authorizer(action, arg1, arg2, db_name, trigger):
+    """Allow only reading whitelisted tables/columns and calling harmless functions"""
+    if action == sqlite3.SQLITE_SELECT or action == sqlite3.SQLITE_RECURSIVE:
+        return sqlite3.SQLITE_OK
+    if action == sqlite3.SQLITE_READ:
+        table = (arg1 or "").lower()
+        if table in SQL_ALLOWED_TABLES and (table, (arg2 or "").lower()) not in SQL_DENIED_COLUMNS:
+            return sqlite3.SQLITE_OK
+        return sqlite3.SQLITE_DENY
+    if action == sqlite3.SQLITE_FUNCTION:
+        return sqlite3.SQLITE_DENY if (arg2 or "").lower() in SQL_DENIED_FUNCTIONS else sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+
+def check_sql_query(db_path: str, query: str, max_rows: int = 200, large_table_rows: int = 10000,
+                    max_scan_rows: int = 1000000) -> SQLGateResult:
+    """Validate generated SQL before running it.
+
+    On top of validate_sql_query, the statement is prepared under an authorizer that only allows
+    reading whitelisted tables, and its EXPLAIN QUERY PLAN is checked: nested full scans (cartesian
+    joins) or a full scan of a table above max_scan_rows are rejected, and a query without LIMIT that
+    scans a table of at least large_table_rows rows is wrapped in a LIMIT of 10 * max_rows rows.
+    """
+    if not validate_sql_query(query):
+        return SQLGateResult(False, query, "failed validation")
+    query = query.strip().rstrip(";").rstrip()
+
+    try:
+        with get_db(db_path).connection(read_only=True) as conn:
+            conn.set_authorizer(_sql_authorizer)
+            try:
+                plan_rows = conn.execute("EXPLAIN QUERY PLAN " + query).fetchall()
+            finally:
+                conn.set_authorizer(None)
+    except sqlite3.DatabaseError as e:
+        print(f"Validation failed: {e}")
+        return SQLGateResult(False, query, str(e))
+
+    plan = [row[3] for row in plan_rows]
+    rows = table_row_counts(db_path)
+    aliases = sql_table_aliases(query, rows)
+
+    # Full scans (including automatic indexes built from a full scan), grouped by plan level
+    scans_by_parent: Dict[int, List[Tuple[str, int]]] = {}
+    for _, parent, _, detail in plan_rows:
+        match = re.match(r"(?:SCAN|SEARCH) (?:TABLE )?(\w+)(?: AS (\w+))?", detail)
+        if not match:
+            continue
+        full_scan = (detail.startswith("SCAN") and "COVERING INDEX" not in detail) or "AUTOMATIC" in detail
+        table = aliases.get((match.group(2) or match.group(1)).lower())
+        if full_scan and table:
+            scans_by_parent.setdefault(parent, []).append((table, rows.get(table, 0)))
+
+    def reject(reason: str) -> SQLGateResult:
+        print(f"Validation failed: {reason}")
+        return SQLGateResult(False, query, reason, plan=plan)
+
+    # A small LIMIT with nothing forcing the whole input to be read first (sort, grouping, aggregate) stops early
+    limit = re.search(r"(?i)\bLIMIT\s+(\d+)(?:\s*(?:,|OFFSET)\s*\d+)?\s*$", query)
+    row_cap = max_rows * 10
+    early_exit = (
+        limit is not None and int(limit.group(1)) <= row_cap
+        and not any("TEMP B-TREE" in step for step in plan)
+        and not re.search(r"(?i)\b(count|sum|avg|min|max|total|group_concat)\s*\(", query)
+    )
+
+    largest_scan = 0
+    for scans in ([] if early_exit else scans_by_parent.values()):
+        for table, count in scans:
+            if count > max_scan_rows:
+                return reject(f"Full scan of {table} ({count} rows) exceeds the scan budget")
+            largest_scan = max(largest_scan, count)
+        if len(scans) > 1:
+            product = 1
+            for _, count in scans:
+                product *= max(count, 1)
+            if product > max_scan_rows:
+                return reject(f"Nested full scans of {', '.join(t for t, _ in scans)} (~{product} row combinations)")
+
+    # Bound the result of big unlimited queries; the rows themselves are streamed by execute_sql_query
+    if largest_scan >= large_table_rows and (limit is None or int(limit.group(1)) > row_cap):
+        print(f"Query scans {largest_scan} rows without a usable LIMIT; capping at {row_cap} rows")
+        return SQLGateResult(True, f"SELECT * FROM ({query}) LIMIT {row_cap}", rewritten=True, row_cap=row_cap, plan=plan)
+
+    return SQLGateResult(True, query, plan=plan)
+
 def get_purchase_history(user_id: int) -> list:
     """Fetches the last 5 purchase history items for a given user ID."""
     try:
-        # Assuming Database.db is in the root directory relative to where app is run
-        db_path = os.path.join(os.path.dirname(__file__), '..', 'Database.db')
-        if not os.path.exists(db_path):
-             # If not in root, maybe it's inside the flask folder?
-             db_path = os.path.join(os.path.dirname(__file__), 'Database.db')
-             if not os.path.exists(db_path):
-                 print(f"Database file not found at expected locations.")
-                 return []
-
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
         query = """
-            SELECT o.Order_date, p.Name, od.Quantity, (p.Price * od.Quantity) AS Price, od.Rate
+            SELECT o.Order_date, p.Name_Product, v.Product_Prep, od.Quantity, (v.Price * od.Quantity) AS Price
             FROM Orders o
             JOIN Order_detail od ON o.Id = od.Order_id
-            JOIN Product p ON od.Product_id = p.Id
+            JOIN Variant v ON od.Variant_id = v.Id
+            JOIN Product p ON v.Product_id = p.Id
             WHERE o.Customer_id = ?
             ORDER BY o.Order_date DESC
             LIMIT 5
         """
 
-        cursor.execute(query, (user_id,))
-        results = cursor.fetchall()
-        conn.close()
+        with get_db().connection() as conn:
+            results = conn.execute(query, (user_id,)).fetchall()
         history = [
-            {"date": row[0], "product": row[1], "quantity": row[2], "price": row[3], "rate": row[4]}
+            {"date": row[0], "product": row[1], "prep": row[2], "quantity": row[3], "price": row[4]}
             for row in results
         ]
         return history